@@ -0,0 +1,227 @@
+"""Read-only JSON API for reporting tools — runs alongside the Streamlit app.
+
+    python passport_cli.py api --port 8502
+
+Serves the same cached reads and derived views the pages use, so a request
+costs no Sheets calls once the views are built:
+
+    GET /api/v1/health
+    GET /api/v1/residents                     roster with logged-case counts
+    GET /api/v1/residents/<email>             per procedure and step: most recent, best, attempts, readiness
+    GET /api/v1/procedures                    case, resident and attending totals per procedure
+    GET /api/v1/procedures/<procedure_id>     cohort step aggregates plus every resident's progress
+    GET /api/v1/cohort                        program-wide aggregates
+
+?tenant=<id> picks the program.  Requests need "Authorization: Bearer <API_TOKEN>"
+(secrets or the environment); without a token the server only listens on
+localhost.  Every response carries an ETag built from the spreadsheet's
+modification time (core.table_version(), re-checked every few seconds), so a
+poll with If-None-Match gets a 304 without any data being read while nothing
+has changed — including edits made by other replicas or directly in the sheet.
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pandas as pd
+import streamlit as st
+
+import passport_core as core
+
+API_PREFIX = "/api/v1"
+LOOPBACK   = {"127.0.0.1", "localhost", "::1"}
+
+
+def api_token() -> str:
+    try:
+        token = st.secrets.get("API_TOKEN", "")
+    except Exception:  # no secrets file
+        token = ""
+    return str(token or os.environ.get("PASSPORT_API_TOKEN", "")).strip()
+
+
+def _records(df: pd.DataFrame) -> list:
+    """JSON-ready rows: NaN/NA become null, timestamps ISO dates."""
+    return json.loads(df.to_json(orient="records", date_format="iso", date_unit="s"))
+
+
+def _names() -> tuple:
+    """(procedure names, step names, resident names) for labelling view rows."""
+    _, procs_df, steps_df, _ = core.load_refs()
+    residents = core.read_sheet_df(core.SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    return (dict(zip(procs_df["procedure_id"].astype(str).str.strip(), procs_df["procedure_name"].astype(str))),
+            dict(zip(steps_df["step_id"].astype(str).str.strip(), steps_df["step_name"].astype(str))),
+            dict(zip(residents["email"].astype(str).str.strip(), residents["name"].astype(str))))
+
+
+def _progress(resident=None, procedure_id=None) -> pd.DataFrame:
+    """Summary rows joined with readiness, one per rated (resident, procedure, step)."""
+    summary   = core.get_derived_view("summaries").records(resident, procedure_id)
+    readiness = core.get_derived_view("readiness").table(procedure_id, resident)
+    keys = ["resident_email", "procedure_id", "step_id"]
+    merged = summary.merge(readiness[keys + ["readiness", "evidence", "last_rated", "ready"]], on=keys, how="left")
+    procs, steps, _ = _names()
+    return merged.assign(procedure_name=merged["procedure_id"].map(procs),
+                         step_name=merged["step_id"].map(steps),
+                         readiness=merged["readiness"].round(1),
+                         evidence=merged["evidence"].round(2))
+
+
+# ─────────────────────────────────────────────
+# ENDPOINTS
+# ─────────────────────────────────────────────
+def get_health(params: dict):
+    return {"status": "ok", "tenant": core.current_tenant().id,
+            "sheets": "unavailable" if core.sheets_breaker().is_open() else "ok"}
+
+
+def get_residents(params: dict):
+    residents = core.read_sheet_df(core.SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    cases = core.get_derived_view("summaries").cases
+    per_resident: dict = {}
+    for (email, _), n in list(cases.items()):
+        per_resident[email] = per_resident.get(email, 0) + n
+    residents = residents.assign(email=residents["email"].astype(str).str.strip())
+    return _records(residents.assign(cases=residents["email"].map(per_resident).fillna(0).astype(int)))
+
+
+def get_resident(params: dict, email: str):
+    _, _, names = _names()
+    if email not in names:
+        raise LookupError(f"No resident {email!r}")
+    progress = _progress(resident=email)
+    procedures = [
+        {"procedure_id": proc, "procedure_name": grp["procedure_name"].iloc[0], "cases": int(grp["cases"].iloc[0]),
+         "steps": _records(grp[["step_id", "step_name", "most_recent", "best", "attempts",
+                                "readiness", "evidence", "last_rated", "ready"]])}
+        for proc, grp in progress.groupby("procedure_id", sort=True)
+    ]
+    return {"email": email, "name": names[email], "procedures": procedures}
+
+
+def get_procedures(params: dict):
+    _, procs_df, _, _ = core.load_refs()
+    procs = procs_df[["procedure_id", "procedure_name", "specialty_id"]].assign(
+        procedure_id=procs_df["procedure_id"].astype(str).str.strip())
+    totals = core.get_derived_view("analytics").tables.get("procedures", pd.DataFrame(columns=["procedure_id"]))
+    out = procs.merge(totals, on="procedure_id", how="left")
+    counts = [c for c in ("cases", "residents", "attendings") if c in out]
+    return _records(out.assign(**{c: out[c].fillna(0).astype(int) for c in counts}))
+
+
+def get_procedure(params: dict, procedure_id: str):
+    procs, _, names = _names()
+    if procedure_id not in procs:
+        raise LookupError(f"No procedure {procedure_id!r}")
+    cube = core.get_derived_view("analytics")
+    steps = cube.tables.get("steps", pd.DataFrame(columns=["procedure_id"]))
+    progress = _progress(procedure_id=procedure_id)
+    return {"procedure_id": procedure_id, "procedure_name": procs[procedure_id],
+            "steps": _records(steps[steps["procedure_id"] == procedure_id]),
+            "residents": _records(progress.assign(resident_name=progress["resident_email"].map(names)))}
+
+
+def get_cohort(params: dict):
+    cube = core.get_derived_view("analytics")
+    return {name: _records(df) for name, df in cube.tables.items()}
+
+
+ROUTES = [
+    (re.compile(r"^/health$"),                  get_health),
+    (re.compile(r"^/residents$"),               get_residents),
+    (re.compile(r"^/residents/(?P<email>[^/]+)$"), get_resident),
+    (re.compile(r"^/procedures$"),              get_procedures),
+    (re.compile(r"^/procedures/(?P<procedure_id>[^/]+)$"), get_procedure),
+    (re.compile(r"^/cohort$"),                  get_cohort),
+]
+
+
+# ─────────────────────────────────────────────
+# HTTP
+# ─────────────────────────────────────────────
+class PassportAPIHandler(BaseHTTPRequestHandler):
+    server_version = "PassportAPI/1"
+    token = ""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if self.token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {self.token}"):
+            return self._send(HTTPStatus.UNAUTHORIZED, {"error": "missing or wrong bearer token"})
+        if not url.path.startswith(API_PREFIX + "/"):
+            return self._send(HTTPStatus.NOT_FOUND, {"error": "not found"})
+        path = url.path[len(API_PREFIX):].rstrip("/")
+        route = next(((m, h) for m, h in ((r.match(path), h) for r, h in ROUTES) if m), None)
+        if route is None:
+            return self._send(HTTPStatus.NOT_FOUND, {"error": "not found"})
+        match, handler = route
+        try:
+            tenant = params.get("tenant") or core.default_tenant_id()
+            if tenant not in core.tenants():
+                return self._send(HTTPStatus.NOT_FOUND, {"error": f"unknown tenant {tenant!r}"})
+            with core.use_tenant(tenant):
+                core.sync_shared_cache()
+                if handler is get_health:   # answers while Google is unreachable, so never revalidated
+                    return self._send(HTTPStatus.OK, get_health(params))
+                # Read before the data: a change made meanwhile only makes the tag older than the body.
+                etag = self._etag(url, tenant, core.table_version())
+                if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                    return self._send(HTTPStatus.NOT_MODIFIED, None, etag)
+                body = handler(params, **{k: unquote(v) for k, v in match.groupdict().items()})
+                return self._send(HTTPStatus.OK, body, etag)
+        except LookupError as exc:
+            return self._send(HTTPStatus.NOT_FOUND, {"error": str(exc)})
+        except ConnectionError as exc:
+            return self._send(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(exc)})
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal server error"})
+
+    do_HEAD = do_GET   # _send() leaves the body out of HEAD responses
+
+    @staticmethod
+    def _etag(url, tenant: str, version: str) -> str:
+        key = f"{url.path}?{url.query}|{tenant}|{version}"
+        return '"' + hashlib.sha1(key.encode()).hexdigest()[:20] + '"'
+
+    def _send(self, status: HTTPStatus, body, etag: str = None) -> None:
+        payload = b"" if body is None else json.dumps(body, default=str).encode()
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if payload and self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def log_message(self, fmt, *args):
+        pass   # one line per poll would drown the server's output
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8502, token: str = None) -> ThreadingHTTPServer:
+    """A ready-to-run API server; refuses to listen beyond localhost without a token."""
+    token = api_token() if token is None else token
+    if not token and host not in LOOPBACK:
+        raise ValueError("Set API_TOKEN (secrets or PASSPORT_API_TOKEN) before serving beyond localhost.")
+    handler = type("BoundPassportAPIHandler", (PassportAPIHandler,), {"token": token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_background(host: str = "127.0.0.1", port: int = 0, token: str = None) -> ThreadingHTTPServer:
+    """Start a server on a daemon thread (port 0 picks a free one); stop it with .shutdown()."""
+    server = make_server(host, port, token)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
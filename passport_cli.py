@@ -0,0 +1,437 @@
+"""Headless command-line tools for Procedure Passport.
+
+Run from the repository root so Streamlit finds .streamlit/secrets.toml:
+
+    python passport_cli.py batch --out passports/            # one .xlsx per resident
+    python passport_cli.py batch --out passports.zip -j 8    # zipped, 8 worker processes
+    python passport_cli.py batch --format pdf --out pdf/     # one passport PDF per resident
+    python passport_cli.py cohort --out cohort.xlsx --since 2024-07-01  # one sheet per procedure
+    python passport_cli.py migrate-scores --to wide --dry-run # preview the wide score layout
+    python passport_cli.py archive                           # archive completed academic years
+    python passport_cli.py compact --dry-run                 # report duplicates and orphans
+    python passport_cli.py migrate-case-ids --dry-run        # count legacy random case IDs
+    python passport_cli.py backup                            # incremental local backup (cron: every few minutes)
+    python passport_cli.py restore --table cases --at "2025-03-01 14:00" --dry-run  # table as of a UTC time
+    python passport_cli.py journal init                      # seed the event journal (JOURNAL_PATH) from the sheets
+    python passport_cli.py journal replay --views            # rebuild every table and derived view from the journal
+    python passport_cli.py journal replay --table residents --at "2025-03-01 14:00" --write  # rewrite a table as of then
+    python passport_cli.py reconcile --log caselog.csv --out recon/  # case-log export vs passport cases
+    python passport_cli.py api --port 8502                   # read-only JSON API for reporting tools
+    python passport_cli.py loadtest --residents 20 --attendings 10  # concurrent sessions, offline
+    python passport_cli.py --tenant ohsu-obgyn compact --dry-run    # any command, for one program
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+import zipfile
+
+import pandas as pd
+from streamlit import logger as st_logger
+
+# Streamlit caching works outside `streamlit run`, but warns about the missing runtime.
+st_logger.set_log_level("error")
+
+import passport_api as api  # noqa: E402
+import passport_core as core  # noqa: E402
+
+
+# ─────────────────────────────────────────────
+# BATCH PASSPORTS
+# ─────────────────────────────────────────────
+_WORKER_REFS: dict = {}
+
+
+BATCH_FORMATS = {"xlsx": ("cumulative.xlsx", core.resident_workbook),
+                 "pdf":  ("passport.pdf", core.resident_passport_document)}
+
+
+def _init_batch_worker(steps_df: pd.DataFrame, atnds_df: pd.DataFrame, procs_map: dict, fmt: str = "xlsx") -> None:
+    """Receive the reference tables once per worker process instead of once per task."""
+    _WORKER_REFS.update(steps_df=steps_df, atnds_df=atnds_df, procs_map=procs_map, fmt=fmt)
+
+
+def _build_resident(resident: str, cases_df: pd.DataFrame, scores_df: pd.DataFrame):
+    """Worker task: (resident, workbook or PDF bytes or None, seconds)."""
+    start = time.perf_counter()
+    data = BATCH_FORMATS[_WORKER_REFS["fmt"]][1](
+        cases_df, scores_df, _WORKER_REFS["steps_df"], _WORKER_REFS["atnds_df"],
+        _WORKER_REFS["procs_map"], resident,
+    )
+    return resident, data, time.perf_counter() - start
+
+
+def cmd_batch(args) -> int:
+    t0 = time.perf_counter()
+    cases_df  = core.read_cases_df()
+    scores_df = core.read_scores_df()
+    _, procs_df, steps_df, atnds_df = core.load_refs()
+    procs_map = dict(zip(procs_df["procedure_id"].astype(str), procs_df["procedure_name"].astype(str)))
+    load_secs = time.perf_counter() - t0
+
+    # Partition once in the parent so each task only ships its own resident's rows.
+    cases_df = cases_df.assign(case_id=core.norm_id(cases_df["case_id"]),
+                               resident_email=cases_df["resident_email"].astype(str).str.strip())
+    scores_df = scores_df.assign(case_id=core.norm_id(scores_df["case_id"]))
+    residents = sorted(r for r in cases_df["resident_email"].unique() if r and r != "nan")
+    if args.residents:
+        wanted = {r.strip() for r in args.residents.split(",")}
+        residents = [r for r in residents if r in wanted]
+    if not residents:
+        print("No residents with logged cases.")
+        return 1
+
+    tasks = []
+    for resident in residents:
+        res_cases = cases_df[cases_df["resident_email"] == resident]
+        tasks.append((resident, res_cases, scores_df[scores_df["case_id"].isin(res_cases["case_id"])]))
+
+    zip_out = args.out.lower().endswith(".zip")
+    if not zip_out:
+        os.makedirs(args.out, exist_ok=True)
+    archive = zipfile.ZipFile(args.out, "w", zipfile.ZIP_DEFLATED) if zip_out else None
+
+    results = []
+    t1 = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_batch_worker,
+        initargs=(steps_df, atnds_df, procs_map, args.format),
+    ) as pool:
+        futures = [pool.submit(_build_resident, *task) for task in tasks]
+        for fut in concurrent.futures.as_completed(futures):
+            resident, data, secs = fut.result()
+            if data is None:
+                results.append((resident, "—", 0, secs))
+                continue
+            file_name = f"{resident}_{BATCH_FORMATS[args.format][0]}"
+            if archive is not None:
+                archive.writestr(file_name, data)
+            else:
+                with open(os.path.join(args.out, file_name), "wb") as fh:
+                    fh.write(data)
+            results.append((resident, file_name, len(data), secs))
+    if archive is not None:
+        archive.close()
+    build_secs = time.perf_counter() - t1
+
+    width = max(len(r[1]) for r in results)
+    print(f"{'file':<{width}}  {'KB':>7}  {'seconds':>7}")
+    for resident, file_name, size, secs in sorted(results):
+        print(f"{file_name:<{width}}  {size / 1024:>7.1f}  {secs:>7.2f}")
+    written = sum(1 for r in results if r[2])
+    print(f"\n{written} {'workbook' if args.format == 'xlsx' else 'passport'}(s) → {args.out}  |  load {load_secs:.2f}s, "
+          f"build {build_secs:.2f}s on {args.workers or os.cpu_count()} worker(s), "
+          f"sum of task time {sum(r[3] for r in results):.2f}s")
+    return 0
+
+
+def cmd_cohort(args) -> int:
+    t0 = time.perf_counter()
+    residents = [r.strip() for r in args.residents.split(",") if r.strip()] or None
+    since = pd.Timestamp(args.since) if args.since else None
+    until = pd.Timestamp(args.until) if args.until else None
+    data = core.cohort_workbook(core.current_tenant().id, residents, since, until)
+    with open(args.out, "wb") as fh:
+        fh.write(data)
+    print(f"Wrote {args.out} ({len(data) / 1024:.0f} KB) in {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# SCORE LAYOUT MIGRATION
+# ─────────────────────────────────────────────
+def cmd_migrate_scores(args) -> int:
+    try:
+        report = core.migrate_scores(args.to, dry_run=args.dry_run, replace=args.replace)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    width = max(len(k) for k in report)
+    for key, value in report.items():
+        print(f"{key:<{width}}  {value}")
+    if report.get("verified") is False:
+        print("\nRound-trip check failed — do not switch SCORES_LAYOUT.")
+        return 1
+    if args.dry_run:
+        print("\nDry run — nothing written.")
+    else:
+        print(f'\nDone. Set SCORES_LAYOUT = "{args.to}" in secrets to read and write the new layout.')
+    return 0
+
+
+# ─────────────────────────────────────────────
+# ACADEMIC-YEAR ARCHIVAL
+# ─────────────────────────────────────────────
+def cmd_archive(args) -> int:
+    years = [int(y) for y in args.years.split(",")] if args.years else None
+    report = core.archive_academic_years(years, dry_run=args.dry_run)
+    if not report:
+        print("Nothing to archive.")
+        return 0
+    width = max(len(r["sheet"]) for r in report)
+    print(f"{'sheet':<{width}}  {'moved':>7}  {'archived':>8}")
+    for r in report:
+        print(f"{r['sheet']:<{width}}  {r['moved']:>7}  {r['archived_rows']:>8}")
+    if args.dry_run:
+        print("\nDry run — nothing written.")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# COMPACTION
+# ─────────────────────────────────────────────
+def cmd_compact(args) -> int:
+    report = core.compact_tables(dry_run=args.dry_run, drop_unknown_steps=args.drop_unknown_steps)
+    width = max(len(k) for k in report)
+    for key, value in report.items():
+        print(f"{key:<{width}}  {value}")
+    if args.dry_run:
+        print("\nDry run — nothing written.")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# CASE IDS
+# ─────────────────────────────────────────────
+def cmd_migrate_case_ids(args) -> int:
+    report = core.migrate_case_ids(dry_run=args.dry_run)
+    width = max(len(k) for k in report)
+    for key, value in report.items():
+        print(f"{key:<{width}}  {', '.join(value) if isinstance(value, list) else value}")
+    if args.dry_run:
+        print("\nDry run — nothing written.")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# BACKUPS
+# ─────────────────────────────────────────────
+def cmd_backup(args) -> int:
+    t0 = time.perf_counter()
+    try:
+        report = core.backup_tables(full=args.full)
+    except RuntimeError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    width = max(len(r["table"]) for r in report)
+    print(f"{'table':<{width}}  {'snapshot':<9}  {'download':<8}  {'rows':>7}  {'added':>6}  {'removed':>7}")
+    for r in report:
+        print(f"{r['table']:<{width}}  {r['snapshot']:<9}  {r['downloaded']:<8}  {r.get('rows', ''):>7}  "
+              f"{r.get('added', ''):>6}  {r.get('removed', ''):>7}")
+    print(f"\nBacked up to {core.backup_dir()} in {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+def cmd_restore(args) -> int:
+    try:
+        df = core.restore_table(args.table, pd.Timestamp(args.at) if args.at else None, dry_run=args.dry_run)
+    except LookupError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    print(f"{args.table}: {len(df)} rows as of {args.at or 'the latest backup'}")
+    if args.dry_run:
+        print("\nDry run — nothing written.")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# EVENT JOURNAL
+# ─────────────────────────────────────────────
+def cmd_journal(args) -> int:
+    if core.event_journal() is None:
+        print("No event journal configured: set JOURNAL_PATH in secrets or the environment.", file=sys.stderr)
+        return 2
+    t0 = time.perf_counter()
+    if args.action == "init":
+        report = core.record_journal_baseline()
+        width = max(len(t) for t in report)
+        for table, rows in report.items():
+            print(f"{table:<{width}}  {rows:>7}")
+        print(f"\nBaseline of {len(report)} table(s) journaled in {time.perf_counter() - t0:.1f}s")
+    elif args.action == "status":
+        status = core.journal_status()
+        print(status.to_string(index=False) if not status.empty else "The journal is empty; run `journal init`.")
+        print(f"\ncheckpoints at events: {', '.join(map(str, core.event_journal().checkpoints())) or 'none'}")
+    elif args.action == "checkpoint":
+        print(f"Checkpoint at event {core.checkpoint_journal()} in {time.perf_counter() - t0:.1f}s")
+    else:  # replay
+        until = pd.Timestamp(args.at) if args.at else None
+        if args.table:
+            try:
+                df = core.rebuild_table_from_journal(args.table, until, dry_run=not args.write)
+            except LookupError as exc:
+                print(exc, file=sys.stderr)
+                return 2
+            print(f"{args.table}: {len(df)} rows as of {args.at or 'the last event'}")
+            if not args.write:
+                print("\nDry run — nothing written (add --write to rewrite the sheet).")
+            return 0
+        state = core.replay_journal(until)
+        print(f"Replayed to event {state.seq} in {time.perf_counter() - t0:.2f}s")
+        width = max([len(t) for t in state.tables] or [0])
+        for table, data in sorted(state.tables.items()):
+            print(f"{table:<{width}}  {len(data['rows']):>7}{'' if data['complete'] else '  (appends only)'}")
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            for table in state.tables:
+                df = state.frame(table)
+                if df is not None:
+                    df.to_csv(os.path.join(args.out, f"{table}.csv"), index=False)
+            print(f"\nWrote one CSV per complete table to {args.out}")
+        if args.views and until is None:
+            with core.reading_from_journal():
+                core.clear_read_caches()
+                core.reset_derived_views()
+                for name in core.DERIVED_VIEWS:
+                    t1 = time.perf_counter()
+                    core.get_derived_view(name)
+                    print(f"view {name:<12}  {time.perf_counter() - t1:>6.2f}s")
+            print(f"\nFull rebuild in {time.perf_counter() - t0:.2f}s")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# CASE-LOG RECONCILIATION
+# ─────────────────────────────────────────────
+def cmd_reconcile(args) -> int:
+    log_df = pd.read_csv(args.log, dtype=str, keep_default_na=False)
+    try:
+        report = core.reconcile_case_log(log_df, args.window)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    for key in ("matched", "unmatched_log", "unmatched_cases"):
+        print(f"{key:<16}  {len(report[key])}")
+    if report["unmapped_procedures"]:
+        print(f"\nUnmapped case-log procedures: {', '.join(report['unmapped_procedures'])}")
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for key in ("matched", "unmatched_log", "unmatched_cases"):
+            report[key].to_csv(os.path.join(args.out, f"{key}.csv"), index=False)
+        print(f"\nWrote matched.csv, unmatched_log.csv and unmatched_cases.csv to {args.out}")
+    return 0
+
+
+# ─────────────────────────────────────────────
+# JSON API
+# ─────────────────────────────────────────────
+def cmd_api(args) -> int:
+    try:
+        server = api.make_server(args.host, args.port)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    host, port = server.server_address[:2]
+    print(f"Serving {api.API_PREFIX} on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+# ─────────────────────────────────────────────
+# LOAD TEST  (local Sheets stand-in)
+# ─────────────────────────────────────────────
+def cmd_loadtest(args) -> int:
+    import passport_loadtest  # Streamlit's test harness internals: only this command needs them
+    return passport_loadtest.run(args)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="passport_cli", description=__doc__.splitlines()[0])
+    parser.add_argument("--tenant", default="", help="program to work on (default: PASSPORT_TENANT or the first configured)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_batch = sub.add_parser("batch", help="build every resident's cumulative Excel workbook or passport PDF")
+    p_batch.add_argument("--out", required=True, help="output directory, or a path ending in .zip")
+    p_batch.add_argument("-j", "--workers", type=int, default=None,
+                         help="worker processes (default: one per CPU)")
+    p_batch.add_argument("--residents", default="", help="comma-separated emails (default: all)")
+    p_batch.add_argument("--format", choices=sorted(BATCH_FORMATS), default="xlsx",
+                         help="cumulative Excel workbook (default) or passport PDF")
+    p_batch.set_defaults(func=cmd_batch)
+
+    p_coh = sub.add_parser("cohort", help="build one workbook for the whole program, a sheet per procedure")
+    p_coh.add_argument("--out", required=True, help="output .xlsx path")
+    p_coh.add_argument("--residents", default="", help="comma-separated emails (default: all)")
+    p_coh.add_argument("--since", default="", help="first case date, YYYY-MM-DD (default: all)")
+    p_coh.add_argument("--until", default="", help="last case date, YYYY-MM-DD (default: all)")
+    p_coh.set_defaults(func=cmd_cohort)
+
+    p_mig = sub.add_parser("migrate-scores", help="copy step scores into the wide or long storage layout")
+    p_mig.add_argument("--to", required=True, choices=["wide", "long"])
+    p_mig.add_argument("--dry-run", action="store_true", help="report without writing")
+    p_mig.add_argument("--replace", action="store_true", help="overwrite scores already in the target layout")
+    p_mig.set_defaults(func=cmd_migrate_scores)
+
+    p_arch = sub.add_parser("archive", help="move completed academic years into archive sheets")
+    p_arch.add_argument("--years", default="",
+                        help="comma-separated starting years, e.g. 2023 for 2023-24 (default: all completed)")
+    p_arch.add_argument("--dry-run", action="store_true", help="report without writing")
+    p_arch.set_defaults(func=cmd_archive)
+
+    p_comp = sub.add_parser("compact", help="rewrite cases and scores without duplicates or orphans")
+    p_comp.add_argument("--drop-unknown-steps", action="store_true",
+                        help="also drop scores for steps missing from the steps sheet")
+    p_comp.add_argument("--dry-run", action="store_true", help="report without writing")
+    p_comp.set_defaults(func=cmd_compact)
+
+    p_ids = sub.add_parser("migrate-case-ids", help="replace legacy random case IDs with time-ordered ones")
+    p_ids.add_argument("--dry-run", action="store_true", help="report without writing")
+    p_ids.set_defaults(func=cmd_migrate_case_ids)
+
+    p_bak = sub.add_parser("backup", help="save changed rows of every table under BACKUP_DIR")
+    p_bak.add_argument("--full", action="store_true", help="re-read every table and start new full snapshots")
+    p_bak.set_defaults(func=cmd_backup)
+
+    p_res = sub.add_parser("restore", help="rewrite a table as it was at a point in time, from local backups")
+    p_res.add_argument("--table", required=True, help="sheet name, e.g. cases")
+    p_res.add_argument("--at", default="", help="UTC date/time, e.g. 2025-03-01T14:00 (default: latest backup)")
+    p_res.add_argument("--dry-run", action="store_true", help="report without writing")
+    p_res.set_defaults(func=cmd_restore)
+
+    p_jrn = sub.add_parser("journal", help="event journal: baseline, status, checkpoint, or replay tables and views")
+    p_jrn.add_argument("action", choices=["init", "status", "checkpoint", "replay"])
+    p_jrn.add_argument("--at", default="", help="replay: UTC date/time to replay to (default: the last event)")
+    p_jrn.add_argument("--table", default="", help="replay: just this table")
+    p_jrn.add_argument("--write", action="store_true", help="replay --table: rewrite the sheet with the replayed rows")
+    p_jrn.add_argument("--out", default="", help="replay: directory for one CSV per table")
+    p_jrn.add_argument("--views", action="store_true", help="replay: also rebuild every derived view from the journal")
+    p_jrn.set_defaults(func=cmd_journal)
+
+    p_rec = sub.add_parser("reconcile", help="match a national case-log CSV export against passport cases")
+    p_rec.add_argument("--log", required=True, help="case-log CSV export")
+    p_rec.add_argument("--window", type=int, default=core.CASE_LOG_WINDOW_DAYS,
+                       help="days a case-log date may differ from the passport case date")
+    p_rec.add_argument("--out", default="", help="directory for matched and unmatched CSVs")
+    p_rec.set_defaults(func=cmd_reconcile)
+
+    p_api = sub.add_parser("api", help="serve read-only JSON summaries for reporting tools")
+    p_api.add_argument("--host", default="127.0.0.1", help="interface to listen on (beyond localhost needs API_TOKEN)")
+    p_api.add_argument("--port", type=int, default=8502)
+    p_api.set_defaults(func=cmd_api)
+
+    p_load = sub.add_parser("loadtest", help="drive concurrent app sessions against the local Sheets stand-in")
+    p_load.add_argument("--residents", type=int, default=10, help="concurrent resident sessions")
+    p_load.add_argument("--attendings", type=int, default=5, help="concurrent magic-link attending sessions")
+    p_load.add_argument("--rounds", type=int, default=2, help="cases each session submits")
+    p_load.add_argument("--latency-ms", type=float, default=100, help="simulated Sheets round trip per request")
+    p_load.add_argument("--timeout", type=float, default=120, help="seconds one page run may take")
+    p_load.add_argument("--seed-dir", default="", help="CSV seed directory (default: LOCAL_SHEETS_DIR or the repo)")
+    p_load.set_defaults(func=cmd_loadtest)
+
+    args = parser.parse_args(argv)
+    if args.tenant:
+        if args.tenant not in core.tenants():
+            parser.error(f"unknown tenant {args.tenant!r}; configured: {', '.join(core.tenants())}")
+        os.environ["PASSPORT_TENANT"] = args.tenant  # inherited by batch worker processes
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3914 @@
+"""Data layer for Procedure Passport — shared by the Streamlit app and the headless tools.
+
+Everything here is free of page/UI code: sheet access and caching, mutations,
+derived views, the cumulative join/pivot and the PDF/PNG/Excel renderers.
+"""
+import time
+import collections
+import contextlib
+import datetime
+import functools
+import gzip
+import io
+import base64
+import json
+import math
+import re
+import hashlib
+import threading
+import os
+import uuid
+import pickle
+import random
+import sqlite3
+import contextvars
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+import gspread
+import requests
+from gspread_dataframe import get_as_dataframe, set_with_dataframe
+from pandas.io.parsers import TextParser
+from google.oauth2.service_account import Credentials
+import matplotlib
+import matplotlib.backends.backend_pdf
+import matplotlib.patches
+from matplotlib.figure import Figure
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Font
+
+import passport_local_sheets
+
+
+# ─────────────────────────────────────────────
+# CONFIG
+# ─────────────────────────────────────────────
+RATING_OPTIONS = ["Not Assessed", "Shown/Told", "Not Yet", "Steer", "Prompt", "Back up", "Auto"]
+RATING_TO_NUM  = {
+    "Not Assessed": -1,
+    "Shown/Told":    0,
+    "Not Yet":       1,
+    "Steer":         2,
+    "Prompt":        3,
+    "Back up":       4,
+    "Auto":          5,
+}
+RATING_HEX = {
+    "Not Assessed": "#F0F0F0",  # white/empty — explicitly rated as not assessed
+    "Shown/Told":   "#9E9E9E",  # dark gray — explicitly shown or told
+    "Not Yet":      "#5B8DB8",
+    "Steer":        "#FF944D",
+    "Prompt":       "#FFD633",
+    "Back up":      "#99E699",
+    "Auto":         "#33CC33",
+}
+RATING_COLOR = {
+    k: f"background-color:{v}; color:{'white' if k in ('Not Yet','Auto') else 'black'};"
+    for k, v in RATING_HEX.items()
+}
+
+def fmt_date(d):
+    """Format a date value as MM-DD-YYYY; pass through non-date strings unchanged."""
+    try:
+        if pd.isna(d):
+            return ""
+    except TypeError:
+        pass
+    try:
+        return pd.Timestamp(d).strftime("%m-%d-%Y")
+    except Exception:
+        return str(d)
+
+
+def norm_id(series: pd.Series) -> pd.Series:
+    """Normalise a case_id Series to clean strings regardless of pandas version.
+
+    pandas 3.x can infer all-digit hex IDs as float64, making astype(str)
+    produce "123456789012.0" while the other sheet retains "123456789012".
+    The three-step chain below is safe for every dtype:
+      float64  123456789012.0  → "123456789012.0" → strip → remove .0 → "123456789012"
+      int64    123456789012    → "123456789012"   → strip → no-op      → "123456789012"
+      object   "abc123def456"  → "abc123def456"   → strip → no-op      → "abc123def456"
+    A missing ID becomes "" (pandas 3's string dtype keeps NaN through astype(str)).
+    """
+    return (series.astype(str)
+                  .fillna("")
+                  .str.strip()
+                  .str.replace(r"\.0$", "", regex=True))
+
+
+def _clean_id(val) -> str:
+    """str(x).strip() then remove a trailing .0 left by float→str conversion."""
+    s = str(val).strip()
+    return s[:-2] if s.endswith(".0") else s
+
+
+def frame_version(df: pd.DataFrame) -> str:
+    """Short content hash of a DataFrame — changes whenever any value changes."""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def sort_by_date(df: pd.DataFrame, col: str = "date"):
+    """Sort `df` ascending by date (unparseable last); returns it with the datetime64 keys date_window() searches."""
+    dates = pd.to_datetime(df[col], errors="coerce").values
+    order = np.argsort(dates, kind="stable")        # NaT sorts to the end
+    return df.iloc[order], dates[order]
+
+
+def date_window(sorted_dates: np.ndarray, date_from=None, date_to=None) -> slice:
+    """Row slice of `sorted_dates` within [date_from, date_to], whole days inclusive; no bounds give every row."""
+    if date_from is None and date_to is None:
+        return slice(0, len(sorted_dates))
+    valid = sorted_dates[: len(sorted_dates) - int(np.isnat(sorted_dates).sum())]
+    lo = np.searchsorted(valid, np.datetime64(pd.Timestamp(date_from)), "left") if date_from is not None else 0
+    hi = (np.searchsorted(valid, np.datetime64(pd.Timestamp(date_to) + pd.Timedelta(days=1)), "left")
+          if date_to is not None else len(valid))
+    return slice(int(lo), int(hi))
+
+
+def sort_by_case_id(df: pd.DataFrame, col: str = "case_id"):
+    """Sort `df` by creation order; returns it with its sorted ID keys (legacy random IDs last, keyed "")."""
+    ids = norm_id(df[col]).to_numpy()
+    legacy = np.fromiter((not is_time_ordered_id(i) for i in ids), bool, len(ids))
+    keys = np.where(legacy, "", ids)
+    if not legacy.any() and (ids[1:] >= ids[:-1]).all():
+        return df, keys
+    order = np.lexsort((keys, legacy))
+    return df.iloc[order], keys[order]
+
+
+def case_id_window(sorted_ids: np.ndarray, since=None, until=None) -> slice:
+    """Row slice of `sorted_ids` (from sort_by_case_id) created in [since, until); bounds are times or case_ids."""
+    n = len(sorted_ids) - int((sorted_ids == "").sum())
+    if since is None and until is None:
+        return slice(0, len(sorted_ids))
+    valid = sorted_ids[:n]
+    lo = np.searchsorted(valid, _case_id_bound(since), "left") if since is not None else 0
+    hi = np.searchsorted(valid, _case_id_bound(until), "left") if until is not None else n
+    return slice(int(lo), int(hi))
+
+
+def _case_id_bound(bound) -> str:
+    """A window bound given as a time-ordered case_id (resume after a checkpoint) or a time."""
+    return str(bound) if is_time_ordered_id(bound) else case_id_floor(bound)
+
+
+def attending_display_name(attending_id: str, atnds_lookup: dict) -> str:
+    """Resolve a display name from an attending_id, including magic_ IDs."""
+    if attending_id in atnds_lookup:
+        return atnds_lookup[attending_id]
+    if isinstance(attending_id, str) and attending_id.startswith("magic_"):
+        return attending_id[len("magic_"):].replace("_", " ")
+    return attending_id or "Unknown"
+
+
+def _attending_name_key(name: str) -> str:
+    """Comparable form of an attending name: "Dr._Mackenzie_Cook" ~ "mackenzie cook"."""
+    name = re.sub(r"[\s_]+", " ", str(name)).strip().casefold()
+    return re.sub(r"^dr\.?\s+", "", name)
+
+
+def attending_name_index(atnds_df: pd.DataFrame) -> dict:
+    """Name key → attending_id for the attendings sheet (first ID wins)."""
+    index: dict = {}
+    for aid, name in zip(atnds_df["attending_id"].astype(str), atnds_df["attending_name"].astype(str)):
+        index.setdefault(_attending_name_key(name), aid.strip())
+    return index
+
+
+def canonical_attending_id(attending_id: str, name_index: dict) -> str:
+    """Map a magic_<Name> ID onto the attendings-sheet ID with the same name, if there is one."""
+    attending_id = str(attending_id).strip()
+    if not attending_id.startswith("magic_"):
+        return attending_id
+    return name_index.get(_attending_name_key(attending_id[len("magic_"):]), attending_id)
+
+
+COMPLEXITY_HEX = {
+    "Straight Forward": "#C8E6C9",
+    "Moderate":         "#FFF59D",
+    "Complex":          "#FFAB91",
+}
+O_SCORE_HEX = {
+    "1": "#378ADD",
+    "2": "#FF944D",
+    "3": "#FFD633",
+    "4": "#99E699",
+    "5": "#33CC33",
+}
+O_SCORE_OPTIONS = [
+    "— Make a selection —",
+    "1 - Not Yet",
+    "2 - Steer",
+    "3 - Prompt",
+    "4 - Backup",
+    "5 - Auto",
+]
+
+SHEET_RESIDENTS  = "residents"
+SHEET_ATTENDINGS = "attendings"
+SHEET_PROCEDURES = "procedures"
+SHEET_STEPS      = "steps"
+SHEET_CASES      = "cases"
+SHEET_SCORES     = "scores"
+SHEET_SPECIALTY  = "specialties"
+SHEET_CASE_SCORES   = "case_scores"     # wide score layout, see SCORE STORAGE
+SHEET_STEP_VERSIONS = "step_versions"
+SHEET_PARTITIONS    = "partitions"      # catalog of academic-year archives
+SHEET_STEP_HISTORY  = "step_history"    # every revision of each procedure's step template
+SHEET_STEP_ALIASES  = "step_aliases"    # retired step_id → current step_id
+SHEET_CASE_ID_MAP   = "case_id_map"     # legacy random case_id → time-ordered case_id
+SHEET_CASE_LOG_MAP  = "case_log_map"    # national case-log procedure code/name → procedure_id
+
+CASE_COLS  = ["case_id", "resident_email", "date", "specialty_id",
+              "procedure_id", "attending_id", "notes",
+              "case_complexity", "overall_performance"]
+SCORE_COLS = ["case_id", "step_id", "rating", "rating_num",
+              "case_complexity", "overall_performance"]
+WIDE_SCORE_COLS   = ["case_id", "procedure_id", "step_version", "ratings",
+                     "case_complexity", "overall_performance"]
+STEP_VERSION_COLS = ["step_version", "procedure_id", "step_ids"]
+PARTITION_COLS    = ["table", "academic_year", "sheet_name", "rows", "archived_at"]
+STEP_HISTORY_COLS = ["procedure_id", "template_version", "step_id", "step_order", "step_name",
+                     "maps_to", "revised_at"]
+STEP_ALIAS_COLS   = ["step_id", "procedure_id", "current_step_id"]
+CASE_ID_MAP_COLS  = ["old_case_id", "case_id", "mapped_at"]
+CASE_LOG_MAP_COLS = ["case_log_procedure", "procedure_id"]
+
+# ─────────────────────────────────────────────
+# CASE IDS  (time-ordered, sortable)
+# ─────────────────────────────────────────────
+# "C" + 10 Crockford base32 characters of Unix milliseconds + 16 of randomness
+# (a ULID behind a letter, so Sheets never reads one as a number).  IDs sort
+# by creation time as plain strings: a sheet appended in save order is sorted
+# by case_id, and "cases since T" is a binary search.  IDs minted by one process
+# in the same millisecond are incremented, so they stay strictly ordered.
+CASE_ID_PREFIX  = "C"
+_CROCKFORD      = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_CASE_ID_RE     = re.compile(rf"^{CASE_ID_PREFIX}[0-7][{_CROCKFORD}]{{25}}$")
+
+
+def _b32(value: int, width: int) -> str:
+    return "".join(_CROCKFORD[(value >> (5 * i)) & 31] for i in reversed(range(width)))
+
+
+@st.cache_resource(show_spinner=False)
+def _case_id_clock() -> dict:
+    return {"lock": threading.Lock(), "ms": -1, "rand": 0}
+
+
+def new_case_id(when=None) -> str:
+    """A fresh time-ordered case_id (`when`: a timestamp to mint it at; default now)."""
+    ms = int((time.time() if when is None else pd.Timestamp(when).timestamp()) * 1000)
+    clock = _case_id_clock()
+    with clock["lock"]:
+        if when is None and ms <= clock["ms"]:
+            ms, rand = clock["ms"], clock["rand"] + 1
+        else:
+            rand = int.from_bytes(os.urandom(10), "big")
+        if when is None:
+            clock["ms"], clock["rand"] = ms, rand
+    return CASE_ID_PREFIX + _b32(ms, 10) + _b32(rand % (1 << 80), 16)
+
+
+def is_time_ordered_id(case_id) -> bool:
+    return bool(_CASE_ID_RE.match(str(case_id)))
+
+
+def case_id_time(case_id):
+    """UTC creation time of a time-ordered case_id, or None for a legacy random ID."""
+    if not is_time_ordered_id(case_id):
+        return None
+    ms = 0
+    for ch in str(case_id)[1:11]:
+        ms = ms * 32 + _CROCKFORD.index(ch)
+    return pd.Timestamp(ms, unit="ms", tz="UTC")
+
+
+def case_id_floor(when) -> str:
+    """The smallest case_id minted at or after `when` — a range-scan bound."""
+    ts = pd.Timestamp(when)
+    ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts
+    return CASE_ID_PREFIX + _b32(max(int(ts.timestamp() * 1000), 0), 10) + "0" * 16
+
+# ─────────────────────────────────────────────
+# TENANTS  (several residency programs in one deployment)
+# ─────────────────────────────────────────────
+# Each program is a tenant with its own spreadsheet (or local seed directory),
+# admins, login domains, Sheets request budget and event journal, configured as a
+# [tenants.<id>] table in secrets:
+#
+#     [tenants.ohsu-obgyn]
+#     name          = "OHSU OB/GYN"
+#     sheet_key     = "1AbC…"              # or backend = "local", local_dir = "…"
+#     domains       = ["ohsu.edu"]
+#     admins        = ["someone@ohsu.edu"]
+#     quota_per_min = 120                  # optional; svc_b64 overrides GOOGLE_SVC_B64
+#
+# Without any, the top-level GOOGLE_SHEET_KEY is the single "default" tenant,
+# as before.  Requests pick a tenant with use_tenant()/set_tenant() (the app
+# does so from ?tenant= or the login email; the CLI from --tenant or
+# PASSPORT_TENANT).  Everything this module keeps per process — the gspread
+# client and its connection pool, read caches, the shared host cache, table
+# locks, write metrics, derived views, the circuit breaker and the request
+# budget — is held per tenant, so a busy program can neither evict another's
+# cached sheets nor spend its share of the Google quota.
+DEFAULT_TENANT       = "default"
+TENANT_QUOTA_PER_MIN = 240   # Sheets requests per tenant per minute (Google allows 300 per project)
+TENANT_QUOTA_WAIT    = 10    # seconds a request may queue for budget before failing
+_CURRENT_TENANT      = contextvars.ContextVar("passport_tenant", default=None)
+
+
+class Tenant:
+    """One program's configuration (see TENANTS)."""
+
+    def __init__(self, tenant_id: str, cfg: dict, backend: str, local_dir: str, shared_path: str, svc_b64: str,
+                 journal_path: str = ""):
+        self.id            = tenant_id
+        self.name          = str(cfg.get("name") or tenant_id)
+        self.backend       = "local" if str(cfg.get("backend", backend)).strip().lower() == "local" else "google"
+        self.sheet_key     = "local" if self.backend == "local" else str(cfg.get("sheet_key", "")).strip()
+        self.local_dir     = str(cfg.get("local_dir") or local_dir)
+        self.shared_path   = str(cfg.get("shared_cache_path") or shared_path)
+        self.journal_path  = str(cfg.get("journal_path") or journal_path)
+        self.svc_b64       = str(cfg.get("svc_b64") or svc_b64)
+        self.domains       = tuple(str(d).strip().lower().lstrip("@") for d in cfg.get("domains", ()))
+        self.admins        = [str(a).strip() for a in cfg.get("admins", ())]
+        self.quota_per_min = float(cfg.get("quota_per_min", TENANT_QUOTA_PER_MIN))
+
+
+TENANTS_TTL = 30   # seconds before an edited [tenants] secrets table takes effect
+
+
+@st.cache_resource(show_spinner=False)
+def _tenants_memo() -> dict:
+    return {"lock": threading.Lock(), "key": None, "at": 0.0, "table": None}
+
+
+def _tenant_table() -> tuple:
+    """(tenants, default tenant id), re-read from secrets only after TENANTS_TTL or an environment change."""
+    memo = _tenants_memo()
+    key = tuple(os.environ.get(k, "") for k in ("SHEETS_BACKEND", "LOCAL_SHEETS_DIR", "SHARED_CACHE_PATH",
+                                                  "JOURNAL_PATH", "PASSPORT_TENANT"))
+    with memo["lock"]:
+        if memo["key"] != key or time.monotonic() - memo["at"] > TENANTS_TTL:
+            known = _configured_tenants()
+            try:
+                preferred = os.environ.get("PASSPORT_TENANT") or st.secrets.get("DEFAULT_TENANT_ID", "")
+            except Exception:  # no secrets file
+                preferred = os.environ.get("PASSPORT_TENANT", "")
+            memo["table"] = (known, preferred if preferred in known else next(iter(known)))
+            memo["key"], memo["at"] = key, time.monotonic()
+        return memo["table"]
+
+
+def tenants() -> dict:
+    """tenant id → Tenant, in configuration order."""
+    return _tenant_table()[0]
+
+
+def _configured_tenants() -> dict:
+    try:
+        configured = {str(k): dict(v) for k, v in st.secrets.get("tenants", {}).items()}
+        svc_b64    = st.secrets.get("GOOGLE_SVC_B64", "")
+        if not configured:
+            configured = {DEFAULT_TENANT: {"sheet_key": st.secrets.get("GOOGLE_SHEET_KEY", ""),
+                                           "admins": list(st.secrets.get("ADMINS", [])),
+                                           "quota_per_min": st.secrets.get("SHEETS_QUOTA_PER_MIN",
+                                                                           TENANT_QUOTA_PER_MIN)}}
+    except Exception:  # no secrets file
+        configured, svc_b64 = {DEFAULT_TENANT: {}}, ""
+    single = len(configured) == 1
+    root, ext = os.path.splitext(shared_cache_path())
+    jroot, jext = os.path.splitext(journal_path())
+    return {
+        tid: Tenant(tid, cfg, sheets_backend(),
+                    local_dir=local_sheets_dir() if single else os.path.join(local_sheets_dir(), tid),
+                    shared_path=(root + ext if single else f"{root}.{tid}{ext}") if root else "",
+                    svc_b64=svc_b64,
+                    journal_path=(jroot + jext if single else f"{jroot}.{tid}{jext}") if jroot else "")
+        for tid, cfg in configured.items()
+    }
+
+
+def default_tenant_id() -> str:
+    """PASSPORT_TENANT, else DEFAULT_TENANT_ID from secrets, else the first tenant configured."""
+    return _tenant_table()[1]
+
+
+def current_tenant() -> Tenant:
+    known, default = _tenant_table()
+    return known.get(_CURRENT_TENANT.get() or "") or known[default]
+
+
+def set_tenant(tenant_id: str) -> None:
+    """Route this thread's sheet access to `tenant_id` (the app calls this once per script run)."""
+    if tenant_id not in tenants():
+        raise KeyError(f"Unknown tenant: {tenant_id!r}")
+    _CURRENT_TENANT.set(tenant_id)
+
+
+@contextlib.contextmanager
+def use_tenant(tenant_id: str):
+    """Temporarily route sheet access to `tenant_id`."""
+    if tenant_id not in tenants():
+        raise KeyError(f"Unknown tenant: {tenant_id!r}")
+    token = _CURRENT_TENANT.set(tenant_id)
+    try:
+        yield tenants()[tenant_id]
+    finally:
+        _CURRENT_TENANT.reset(token)
+
+
+def tenant_for_email(email: str):
+    """The tenant a login email belongs to, or None; of several sharing its domain, the one listing it."""
+    email = str(email).strip()
+    domain = email.rpartition("@")[2].lower()
+    known = tenants()
+    candidates = [t for t in known.values() if domain in t.domains] or list(known.values())
+    if len(candidates) == 1:
+        return candidates[0].id
+    for tenant in candidates:
+        if email in tenant.admins:
+            return tenant.id
+    for tenant in candidates:
+        try:
+            with use_tenant(tenant.id):
+                residents  = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email"])
+                attendings = read_sheet_df(SHEET_ATTENDINGS, expected_cols=["email"])
+        except ConnectionError:
+            continue
+        emails = pd.concat([residents["email"], attendings["email"]]).astype(str).str.strip().str.casefold()
+        if email.casefold() in set(emails):
+            return tenant.id
+    return None
+
+
+@st.cache_resource(show_spinner=False)
+def _tenant_state(tenant_id: str) -> dict:
+    return {"lock": threading.Lock()}
+
+
+def _tenant_resource(name: str, factory, tenant_id: str = None):
+    """The current tenant's process-wide `name` object, created by `factory` on first use."""
+    state = _tenant_state(tenant_id or current_tenant().id)
+    with state["lock"]:
+        if name not in state:
+            state[name] = factory()
+        return state[name]
+
+
+def _tenant_lru(name: str, key, build, max_entries: int, tenant_id: str = None):
+    """build() memoized under `key` in the tenant's bounded `name` cache, so tenants never evict each other."""
+    tenant_id = tenant_id or current_tenant().id
+    entries = _tenant_resource(name, collections.OrderedDict, tenant_id)
+    lock = _tenant_state(tenant_id)["lock"]
+    with lock:
+        if key in entries:
+            entries.move_to_end(key)
+            return entries[key]
+    value = build()
+    with lock:
+        entries[key] = value
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+    return value
+
+
+def _read_caches() -> dict:
+    return _tenant_resource("read_caches", lambda: {"generation": 0, "keys": {}})
+
+
+def _cache_namespace() -> str:
+    """Key of the current tenant's read caches; clear_read_caches() moves it on."""
+    tenant = current_tenant()
+    source = ":journal" if tenant.journal_path and journal_reads() else ""
+    source += ":strict" if _STRICT_READS.get() else ""
+    return f"{tenant.id}{source}:{_read_caches()['generation']}"
+
+
+def _cached_read(func, *args):
+    """func(namespace, *args) through its st.cache_data, noting the entry for clear_read_caches()."""
+    namespace = _cache_namespace()
+    caches = _read_caches()
+    with _tenant_state(current_tenant().id)["lock"]:
+        caches["keys"].setdefault((func.__name__, namespace, repr(args)), (func, (namespace, *args)))
+    return func(namespace, *args)
+
+
+def clear_read_caches() -> None:
+    """Invalidate the current tenant's cached reads and drop the superseded entries; other tenants keep theirs."""
+    caches = _read_caches()
+    with _tenant_state(current_tenant().id)["lock"]:
+        caches["generation"] += 1
+        stale, caches["keys"] = caches["keys"], {}
+    for func, args in stale.values():
+        func.clear(*args)
+
+
+# ─────────────────────────────────────────────
+# SHEETS TRANSPORT  (timeouts, retries, circuit breaker)
+# ─────────────────────────────────────────────
+SHEETS_TIMEOUT        = (5, 20)   # seconds: connect, read — no call may hang a session
+SHEETS_READ_RETRIES   = 3         # extra attempts for GETs only; writes are never replayed
+SHEETS_RETRY_BASE     = 0.5       # seconds; full-jitter exponential backoff
+SHEETS_POOL_SIZE      = 20        # keep-alive connections shared by the app's threads
+BREAKER_THRESHOLD     = 5         # consecutive failures that open the breaker
+BREAKER_COOLDOWN      = 30        # seconds before a trial call is let through
+_RETRYABLE_STATUS     = {408, 429, 500, 502, 503, 504}
+
+
+class SheetsUnavailable(ConnectionError):
+    """Raised without calling Google while the circuit breaker is open."""
+
+
+class SheetsQuotaExceeded(ConnectionError):
+    """Raised when a tenant has used its Sheets request budget for now."""
+
+
+class WriteConflict(ConnectionError):
+    """Raised when a sheet kept changing under a rewrite; nothing was written."""
+
+
+class CircuitBreaker:
+    """Closed → open after BREAKER_THRESHOLD consecutive failures; one trial call after the cooldown."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold, self.cooldown = threshold, cooldown
+        self.lock      = threading.Lock()
+        self.failures  = 0
+        self.opened_at = None
+        self.trial     = False
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self) -> None:
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.time() - self.opened_at < self.cooldown:
+                raise SheetsUnavailable("Google Sheets is not responding; retrying shortly.")
+            self.trial = True   # half-open: this call decides
+
+    def record(self, ok: bool) -> None:
+        with self.lock:
+            self.trial = False
+            if ok:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+class RequestBudget:
+    """Token bucket of `per_minute` Sheets requests, refilled continuously."""
+
+    def __init__(self, per_minute: float, wait: float = TENANT_QUOTA_WAIT):
+        self.rate, self.capacity, self.wait = per_minute / 60.0, float(per_minute), wait
+        self.lock      = threading.Lock()
+        self.tokens    = self.capacity
+        self.stamp     = time.monotonic()
+        self.throttled = 0   # requests that had to wait for budget
+
+    def acquire(self) -> None:
+        deadline = time.monotonic() + self.wait
+        waited = False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+                if not waited:
+                    self.throttled += 1
+                    waited = True
+            if time.monotonic() + delay > deadline:
+                raise SheetsQuotaExceeded("This program has reached its Google Sheets request budget; "
+                                          "try again in a minute.")
+            time.sleep(delay)
+
+
+class ResilientHTTPClient(gspread.http_client.HTTPClient):
+    """gspread transport with pooled sessions, timeouts, GET retries, a circuit breaker and a request budget."""
+
+    breaker: CircuitBreaker = None
+    budget: RequestBudget = None
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=SHEETS_POOL_SIZE, pool_maxsize=SHEETS_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.timeout = SHEETS_TIMEOUT
+
+    def request(self, method: str, endpoint: str, *args, **kwargs):
+        attempts = 1 + (SHEETS_READ_RETRIES if method.lower() == "get" else 0)
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            if self.budget is not None:
+                self.budget.acquire()
+            try:
+                response = super().request(method, endpoint, *args, **kwargs)
+            except gspread.exceptions.APIError as exc:
+                transient = exc.code in _RETRYABLE_STATUS
+                self.breaker.record(ok=not transient)   # a 404 or 403 says nothing about Google's health
+                if not transient or attempt == attempts - 1:
+                    raise
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                self.breaker.record(ok=False)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                self.breaker.record(ok=True)
+                return response
+            time.sleep(random.uniform(0, SHEETS_RETRY_BASE * 2 ** attempt))
+
+
+def sheets_breaker() -> CircuitBreaker:
+    """The current tenant's circuit breaker: one program's outage never trips another's."""
+    return _tenant_resource("breaker", CircuitBreaker)
+
+
+def sheets_budget() -> RequestBudget:
+    """The current tenant's Sheets request budget."""
+    return _tenant_resource("budget", lambda: RequestBudget(current_tenant().quota_per_min))
+
+
+def _last_good_sheets() -> dict:
+    """sheet name → last successfully read DataFrame, served while Google is unreachable."""
+    return _tenant_resource("last_good_sheets", dict)
+
+
+# ─────────────────────────────────────────────
+# SHARED HOST CACHE  (multi-replica deployments)
+# ─────────────────────────────────────────────
+# st.cache_data is per process.  With SHARED_CACHE_PATH set (secrets or the
+# environment), every replica on a host reads sheets through one SQLite file:
+# a sheet is downloaded once per host per SHARED_CACHE_TTL, and each write bumps
+# a host-wide generation that sync_shared_cache() turns into a cache clear in
+# the other replicas.
+SHARED_CACHE_TTL   = 300   # seconds, same as read_sheet_df
+SHARED_CACHE_LEASE = 30    # seconds one replica may spend downloading a sheet for the others
+
+
+class SharedCache:
+    """SQLite-backed sheet cache shared by the processes on one host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sheets (name TEXT PRIMARY KEY, fetched_at REAL, payload BLOB)")
+            db.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, until REAL, owner TEXT)")
+            if "owner" not in [c[1] for c in db.execute("PRAGMA table_info(leases)")]:
+                db.execute("ALTER TABLE leases ADD COLUMN owner TEXT")  # cache files from before lease owners
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per call: cheap for a local file and safe across Streamlit's threads.
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get(self, name: str, max_age: float = SHARED_CACHE_TTL):
+        with self._connect() as db:
+            row = db.execute("SELECT fetched_at, payload FROM sheets WHERE name = ?", (name,)).fetchone()
+        if row is None or time.time() - row[0] > max_age:
+            return None
+        return pickle.loads(row[1])
+
+    def put(self, name: str, df: pd.DataFrame) -> None:
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO sheets VALUES (?, ?, ?)",
+                       (name, time.time(), pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def read_through(self, name: str, download) -> pd.DataFrame:
+        """The host copy of `name`; on a miss one replica downloads it while the others wait."""
+        deadline = time.time() + SHARED_CACHE_LEASE
+        while True:
+            df = self.get(name)
+            if df is not None:
+                return df
+            owner = self._take_lease(name)
+            if owner or time.time() > deadline:
+                break
+            time.sleep(0.2)
+        try:
+            df = download(name)
+            self.put(name, df)
+            return df
+        finally:
+            if owner:  # past the deadline we download without the lease; another replica may hold it
+                self._release_lease(name, owner)
+
+    @contextlib.contextmanager
+    def lock(self, name: str):
+        """Host-wide mutex on `name`, renewed while held; a holder that dies frees it after SHARED_CACHE_LEASE."""
+        key = "lock:" + name
+        owner = self._take_lease(key)
+        while not owner:
+            time.sleep(0.05)
+            owner = self._take_lease(key)
+        done = threading.Event()
+        renewer = threading.Thread(target=self._keep_lease, args=(key, owner, done), daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            done.set()
+            renewer.join()
+            self._release_lease(key, owner)
+
+    def _take_lease(self, name: str):
+        """An owner token if the lease on `name` was free (or expired) and is now ours, else None."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT until FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] > now:
+                db.execute("COMMIT")
+                return None
+            owner = uuid.uuid4().hex
+            db.execute("INSERT OR REPLACE INTO leases (name, until, owner) VALUES (?, ?, ?)",
+                       (name, now + SHARED_CACHE_LEASE, owner))
+            db.execute("COMMIT")
+            return owner
+
+    def _keep_lease(self, name: str, owner: str, done: threading.Event) -> None:
+        """Extend `owner`'s lease on `name` every third of SHARED_CACHE_LEASE until `done`."""
+        while not done.wait(SHARED_CACHE_LEASE / 3):
+            try:
+                with self._connect() as db:
+                    held = db.execute("UPDATE leases SET until = ? WHERE name = ? AND owner = ?",
+                                      (time.time() + SHARED_CACHE_LEASE, name, owner)).rowcount
+            except sqlite3.Error:
+                continue  # busy file: the next round retries well before the lease runs out
+            if not held:
+                return
+
+    def _release_lease(self, name: str, owner: str) -> None:
+        """Free the lease on `name` if `owner` still holds it — never one another process took over."""
+        with self._connect() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def generation(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def invalidate(self, name=None) -> None:
+        """Drop one sheet (or all) and bump the generation; this process keeps its own caches."""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if name is None:
+                db.execute("DELETE FROM sheets")
+            else:
+                db.execute("DELETE FROM sheets WHERE name = ?", (name,))
+            db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            new = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+            db.execute("COMMIT")
+        state = _shared_cache_state()
+        with state["lock"]:
+            # Only our own bump: keep the in-process caches (save_case has just advanced them).
+            if state["seen"] == new - 1:
+                state["seen"] = new
+
+
+def shared_cache_path() -> str:
+    try:
+        path = st.secrets.get("SHARED_CACHE_PATH", "")
+    except Exception:  # no secrets file
+        path = ""
+    return str(path or os.environ.get("SHARED_CACHE_PATH", "")).strip()
+
+
+def _shared_cache_state() -> dict:
+    return _tenant_resource("shared_cache_state", lambda: {"lock": threading.Lock(), "seen": None})
+
+
+@st.cache_resource(show_spinner=False)
+def _open_shared_cache(path: str):
+    return SharedCache(path)
+
+
+def shared_cache():
+    """The current tenant's SharedCache on this host, or None when SHARED_CACHE_PATH is not configured."""
+    path = current_tenant().shared_path
+    return _open_shared_cache(path) if path else None
+
+
+def sync_shared_cache() -> None:
+    """Call once per script run: drop this process's caches if another replica has written."""
+    if sync_journal():
+        clear_read_caches()
+        reset_derived_views()
+    cache = shared_cache()
+    if cache is None:
+        return
+    generation = cache.generation()
+    state = _shared_cache_state()
+    with state["lock"]:
+        stale = state["seen"] is not None and state["seen"] != generation
+        state["seen"] = generation
+    if stale:
+        clear_read_caches()
+        reset_derived_views()
+
+
+# ─────────────────────────────────────────────
+# EVENT JOURNAL  (append-only, replayable)
+# ─────────────────────────────────────────────
+# With JOURNAL_PATH set (secrets or the environment), every table write is
+# also recorded in the tenant's append-only SQLite journal: rows appended (a
+# case saved, its scores recorded, a resident, attending or procedure added)
+# or a table rewritten (roster and procedure edits, step revisions,
+# compaction, archival), with the cell values as written.  Replaying the
+# events rebuilds any table as of any event; replay starts from the newest
+# checkpoint — every table as of one event, taken once JOURNAL_CHECKPOINT_EVERY
+# events have piled up — so a rebuild never reads the whole history.
+#
+# record_journal_baseline() seeds the journal with the sheets as they are:
+# run it when enabling the journal, and after editing sheets outside the app.
+# With JOURNAL_READS = true, sheet reads — and so every derived view — come
+# from the replayed journal instead of Google; for deployments where the app
+# is the only writer.
+JOURNAL_CHECKPOINT_EVERY = 1000
+JOURNAL_ACTIONS = {   # (table, kind) → the event's name in the journal; others are "<table>_<kind>"
+    (SHEET_CASES, "append"):       "case_saved",
+    (SHEET_SCORES, "append"):      "scores_recorded",
+    (SHEET_CASE_SCORES, "append"): "scores_recorded",
+    (SHEET_RESIDENTS, "append"):   "resident_added",
+    (SHEET_ATTENDINGS, "append"):  "attending_added",
+    (SHEET_PROCEDURES, "append"):  "procedure_added",
+    (SHEET_STEPS, "append"):       "steps_added",
+    (SHEET_RESIDENTS, "rewrite"):  "roster_edited",
+    (SHEET_ATTENDINGS, "rewrite"): "roster_edited",
+    (SHEET_PROCEDURES, "rewrite"): "procedures_edited",
+    (SHEET_STEPS, "rewrite"):      "steps_revised",
+}
+_JOURNAL_READS = contextvars.ContextVar("passport_journal_reads", default=None)
+
+
+def journal_path() -> str:
+    try:
+        path = st.secrets.get("JOURNAL_PATH", "")
+    except Exception:  # no secrets file
+        path = ""
+    return str(path or os.environ.get("JOURNAL_PATH", "")).strip()
+
+
+def journal_reads() -> bool:
+    """Whether sheet reads are served from the event journal (JOURNAL_READS, or reading_from_journal())."""
+    forced = _JOURNAL_READS.get()
+    if forced is not None:
+        return forced
+    try:
+        value = st.secrets.get("JOURNAL_READS", "")
+    except Exception:  # no secrets file
+        value = ""
+    value = value if str(value).strip() else os.environ.get("JOURNAL_READS", "")
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+@contextlib.contextmanager
+def reading_from_journal(enabled: bool = True):
+    """Serve this thread's sheet reads from the journal (or from Google) regardless of JOURNAL_READS."""
+    token = _JOURNAL_READS.set(enabled)
+    try:
+        yield
+    finally:
+        _JOURNAL_READS.reset(token)
+
+
+def _journal_cell(value):
+    """A cell as the journal stores it: what Sheets keeps for a USER_ENTERED write."""
+    return passport_local_sheets.user_entered_value(_cell(value))
+
+
+class EventJournal:
+    """SQLite append-only event log of one tenant, plus table checkpoints."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, at REAL, "
+                       "action TEXT, kind TEXT, sheet TEXT, rows INTEGER, payload TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS checkpoints (seq INTEGER PRIMARY KEY, at REAL, payload BLOB)")
+            for op in ("UPDATE", "DELETE"):
+                db.execute(f"CREATE TRIGGER IF NOT EXISTS events_no_{op.lower()} BEFORE {op} ON events "
+                           "BEGIN SELECT RAISE(ABORT, 'the event journal is append-only'); END")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per call, as in SharedCache.
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def append(self, kind: str, sheet: str, header: list, rows: list, **extra) -> int:
+        """Record one event; returns its sequence number."""
+        payload = json.dumps({"header": header, "rows": rows, **extra}, separators=(",", ":"), default=str)
+        action = JOURNAL_ACTIONS.get((sheet, kind), f"{sheet}_{kind}")
+        with self._connect() as db:
+            cur = db.execute("INSERT INTO events (at, action, kind, sheet, rows, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                             (time.time(), action, kind, sheet, len(rows), payload))
+            return cur.lastrowid
+
+    def events(self, after: int = 0, until: int = None):
+        """(seq, kind, sheet, payload) of the events after `after`, up to `until`, oldest first."""
+        with self._connect() as db:
+            cur = db.execute("SELECT seq, kind, sheet, payload FROM events WHERE seq > ? AND seq <= ? ORDER BY seq",
+                             (after, until if until is not None else 2 ** 62))
+            for seq, kind, sheet, payload in cur:
+                yield seq, kind, sheet, json.loads(payload)
+
+    def last_seq(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+    def seq_at(self, when) -> int:
+        """The last event recorded at or before `when` (naive times are UTC)."""
+        ts = pd.Timestamp(when)
+        ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts
+        with self._connect() as db:
+            return db.execute("SELECT COALESCE(MAX(seq), 0) FROM events WHERE at <= ?", (ts.timestamp(),)).fetchone()[0]
+
+    def checkpoint(self, until: int = None):
+        """(seq, tables) of the newest checkpoint at or before `until`, or (0, {})."""
+        with self._connect() as db:
+            row = db.execute("SELECT seq, payload FROM checkpoints WHERE seq <= ? ORDER BY seq DESC LIMIT 1",
+                             (until if until is not None else 2 ** 62,)).fetchone()
+        return (row[0], json.loads(gzip.decompress(row[1]))) if row else (0, {})
+
+    def save_checkpoint(self, seq: int, tables: dict) -> None:
+        payload = gzip.compress(json.dumps(tables, separators=(",", ":"), default=str).encode("utf-8"), compresslevel=6)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", (seq, time.time(), payload))
+
+    def summary(self) -> pd.DataFrame:
+        """Per table: events, rows recorded, and the last event."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT sheet, COUNT(*), SUM(rows), MAX(seq) FROM events GROUP BY sheet ORDER BY sheet").fetchall()
+            last = {seq: (action, at) for seq, action, at in db.execute(
+                "SELECT seq, action, at FROM events WHERE seq IN (SELECT MAX(seq) FROM events GROUP BY sheet)")}
+        return pd.DataFrame(
+            [(sheet, n, total, seq, last[seq][0], pd.Timestamp(last[seq][1], unit="s", tz="UTC").floor("s"))
+             for sheet, n, total, seq in rows],
+            columns=["table", "events", "rows", "last_seq", "last_action", "last_at"])
+
+    def checkpoints(self) -> list:
+        with self._connect() as db:
+            return [seq for (seq,) in db.execute("SELECT seq FROM checkpoints ORDER BY seq")]
+
+
+class JournalState:
+    """Every journaled table as of one event; a table with no baseline or rewrite yet holds only its appends."""
+
+    def __init__(self, seq: int = 0, tables: dict = None):
+        self.seq    = seq
+        self.tables = tables if tables is not None else {}
+
+    def apply(self, seq: int, kind: str, sheet: str, payload: dict) -> None:
+        if kind == "append":
+            table = self.tables.setdefault(sheet, {"header": [], "rows": [], "complete": bool(payload.get("blank"))})
+            table["header"] = payload["header"]
+            table["rows"].extend(payload["rows"])
+        else:  # "rewrite", "baseline"
+            self.tables[sheet] = {"header": payload["header"], "rows": payload["rows"], "complete": True}
+        self.seq = seq
+
+    def frame(self, sheet: str):
+        """The table as _download_sheet would return it, or None unless the journal holds all of it."""
+        table = self.tables.get(sheet)
+        if table is None or not table["complete"]:
+            return None
+        header = table["header"]
+        if not header:
+            return pd.DataFrame()
+        width = len(header)
+        values = [header] + [row + [""] * (width - len(row)) for row in table["rows"]]
+        return TextParser(values, header=0).read().dropna(how="all")
+
+
+@st.cache_resource(show_spinner=False)
+def _open_event_journal(path: str) -> EventJournal:
+    return EventJournal(path)
+
+
+def event_journal():
+    """The current tenant's EventJournal, or None when JOURNAL_PATH is not configured."""
+    path = current_tenant().journal_path
+    return _open_event_journal(path) if path else None
+
+
+def _require_journal() -> EventJournal:
+    journal = event_journal()
+    if journal is None:
+        raise LookupError("No event journal configured: set JOURNAL_PATH in secrets or the environment.")
+    return journal
+
+
+def _journal_live() -> dict:
+    """This process's replayed state of the tenant's journal (loaded on first journal read)."""
+    return _tenant_resource("journal_live", lambda: {"lock": threading.RLock(), "state": None,
+                                                     "gaps": set(), "foreign": False})
+
+
+def replay_journal(until=None) -> JournalState:
+    """Every journaled table as of event `until` (sequence number or time; default: the last), from a checkpoint."""
+    journal = _require_journal()
+    if until is not None and not isinstance(until, (int, np.integer)):
+        until = journal.seq_at(until)
+    seq, tables = journal.checkpoint(until)
+    state, applied = JournalState(seq, tables), 0
+    for event in journal.events(seq, until):
+        state.apply(*event)
+        applied += 1
+    if until is None and applied >= JOURNAL_CHECKPOINT_EVERY:
+        journal.save_checkpoint(state.seq, state.tables)
+    return state
+
+
+def checkpoint_journal() -> int:
+    """Checkpoint the journal at its last event now; returns that event's sequence number."""
+    journal = _require_journal()
+    state = replay_journal()
+    if state.seq and state.seq not in journal.checkpoints():
+        journal.save_checkpoint(state.seq, state.tables)
+    return state.seq
+
+
+def _catch_up(live: dict, own: int = None) -> None:
+    """Apply events recorded since the live state; any but `own` came from another process."""
+    state = live["state"]
+    for seq, kind, sheet, payload in event_journal().events(state.seq):
+        state.apply(seq, kind, sheet, payload)
+        if seq != own:
+            live["foreign"] = True
+
+
+def _journal_frame(sheet_name: str):
+    """`sheet_name` from the replayed journal, or None when the journal can't vouch for all of it."""
+    live = _journal_live()
+    with live["lock"]:
+        if live["state"] is None:
+            live["state"] = replay_journal()
+            live["foreign"] = False
+        else:
+            _catch_up(live)
+        if sheet_name in live["gaps"]:
+            return None
+        return live["state"].frame(sheet_name)
+
+
+def sync_journal() -> bool:
+    """Apply events other processes have journaled; True when any arrived since the last call."""
+    live = _journal_live()
+    with live["lock"]:
+        if live["state"] is None or event_journal() is None:
+            return False
+        _catch_up(live)
+        arrived, live["foreign"] = live["foreign"], False
+        return arrived
+
+
+def _record_event(kind: str, sheet_name: str, header: list, rows: list, **extra) -> None:
+    """Journal one table write (called under the table's lock, after the sheet is written)."""
+    journal = event_journal()
+    if journal is None:
+        return
+    live = _journal_live()
+    with live["lock"]:
+        try:
+            seq = journal.append(kind, sheet_name, header, rows, **extra)
+        except sqlite3.Error:
+            # The sheet already holds the write: never fail it over the journal.  The
+            # table is missing an event, so reads fall back to Google until a baseline.
+            live["gaps"].add(sheet_name)
+            return
+        if live["state"] is not None:
+            _catch_up(live, own=seq)
+
+
+def record_journal_baseline(tables=None) -> dict:
+    """Journal every sheet (or just `tables`) as it is now; returns sheet → rows recorded."""
+    journal = _require_journal()
+    sheet_key = current_tenant().sheet_key
+    try:
+        http = get_gs_client().http_client
+        titles = [s["properties"]["title"] for s in http.fetch_sheet_metadata(sheet_key)["sheets"]]
+    except Exception as exc:
+        raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+    # Tables the app reads but that don't exist yet are journaled empty, so
+    # journal reads don't create them on Google.
+    absent = [t for t in (SHEET_RESIDENTS, SHEET_ATTENDINGS, SHEET_PROCEDURES, SHEET_STEPS, SHEET_CASES,
+                          SHEET_SCORES, SHEET_SPECIALTY, SHEET_CASE_SCORES, SHEET_STEP_VERSIONS, SHEET_PARTITIONS,
+                          SHEET_STEP_HISTORY, SHEET_STEP_ALIASES, SHEET_CASE_ID_MAP, SHEET_CASE_LOG_MAP)
+              if t not in titles and (tables is None or t in tables)]
+    titles = [t for t in titles if tables is None or t in tables]
+    report = {}
+    with locked_tables(*titles):
+        try:
+            got = http.values_batch_get(sheet_key, [gspread.utils.absolute_range_name(t) for t in titles],
+                                        params={"valueRenderOption": "UNFORMATTED_VALUE",
+                                                "dateTimeRenderOption": "FORMATTED_STRING"})["valueRanges"]
+        except Exception as exc:
+            raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+        live = _journal_live()
+        for title, values in list(zip(titles, got)) + [(t, {}) for t in absent]:
+            values = values.get("values", [])
+            header = [str(h).strip() for h in values[0]] if values else []
+            while header and not header[-1]:
+                header.pop()
+            rows = [list(r[:len(header)]) for r in values[1:]]
+            while rows and not any(v != "" for v in rows[-1]):
+                rows.pop()
+            with live["lock"]:
+                seq = journal.append("baseline", title, header, rows)
+                live["gaps"].discard(title)
+                if live["state"] is not None:
+                    _catch_up(live, own=seq)
+            report[title] = len(rows)
+    clear_read_caches()
+    reset_derived_views()
+    return report
+
+
+def journal_status() -> pd.DataFrame:
+    """Per journaled table: events, rows recorded and the last event; empty without a journal."""
+    journal = event_journal()
+    if journal is None:
+        return pd.DataFrame(columns=["table", "events", "rows", "last_seq", "last_action", "last_at"])
+    summary = journal.summary()
+    gaps = _journal_live()["gaps"]
+    return summary.assign(gap=summary["table"].isin(gaps)) if gaps else summary
+
+
+def rebuild_table_from_journal(table: str, until=None, dry_run: bool = False) -> pd.DataFrame:
+    """Rewrite `table` as the journal has it at event `until` (default: now); the rewrite is journaled too."""
+    df = replay_journal(until).frame(table)
+    if df is None:
+        raise LookupError(f"The journal has no complete copy of {table}; record a baseline first.")
+    if not dry_run:
+        write_sheet_df(table, df)
+        reset_derived_views()   # case and score rewrites don't reset the views themselves
+    return df
+
+
+# ─────────────────────────────────────────────
+# GOOGLE SHEETS HELPERS
+# ─────────────────────────────────────────────
+
+def sheets_backend() -> str:
+    """Configured Sheets backend: "google", or "local" for the offline stand-in (a tenant may override it)."""
+    try:
+        backend = st.secrets.get("SHEETS_BACKEND", "")
+    except Exception:  # no secrets file
+        backend = ""
+    return "local" if str(backend or os.environ.get("SHEETS_BACKEND", "")).strip().lower() == "local" else "google"
+
+
+def local_sheets_dir() -> str:
+    """CSV seed directory of the local backend (default: the sample data; per tenant, its own subdirectory)."""
+    try:
+        path = st.secrets.get("LOCAL_SHEETS_DIR", "")
+    except Exception:  # no secrets file
+        path = ""
+    return str(path or os.environ.get("LOCAL_SHEETS_DIR", "")).strip() or os.path.dirname(os.path.abspath(__file__))
+
+
+def get_gs_client():
+    """Authorized gspread client of the current tenant — one per tenant for the process."""
+    return _tenant_client(current_tenant().id)
+
+
+@st.cache_resource(show_spinner=False)
+def _tenant_client(tenant_id: str):
+    tenant = tenants()[tenant_id]
+    if tenant.backend == "local":
+        return passport_local_sheets.local_client(tenant.local_dir)
+    svc_json = json.loads(base64.b64decode(tenant.svc_b64).decode())
+    creds = Credentials.from_service_account_info(
+        svc_json,
+        scopes=[
+            "https://www.googleapis.com/auth/spreadsheets",
+            "https://www.googleapis.com/auth/drive",
+        ],
+    )
+    # Its own connection pool, breaker and budget: see TENANTS.
+    http_client = type("TenantHTTPClient", (ResilientHTTPClient,), {
+        "breaker": _tenant_resource("breaker", CircuitBreaker, tenant_id),
+        "budget":  _tenant_resource("budget", lambda: RequestBudget(tenant.quota_per_min), tenant_id),
+    })
+    return gspread.authorize(creds, http_client=http_client)
+
+
+def get_sheet(sheet_name: str):
+    """Return a gspread worksheet of the current tenant, creating it if missing."""
+    try:
+        gc = get_gs_client()
+        sh = gc.open_by_key(current_tenant().sheet_key)
+        try:
+            return sh.worksheet(sheet_name)
+        except gspread.exceptions.WorksheetNotFound:
+            return sh.add_worksheet(title=sheet_name, rows="500", cols="26")
+    except Exception as exc:
+        raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+
+
+_STRICT_READS = contextvars.ContextVar("strict_reads", default=False)
+
+
+@contextlib.contextmanager
+def strict_reads():
+    """Reads inside raise when Google cannot be reached instead of serving a fallback copy."""
+    token = _STRICT_READS.set(True)
+    try:
+        yield
+    finally:
+        _STRICT_READS.reset(token)
+
+
+def read_sheet_df(sheet_name: str, expected_cols=None) -> pd.DataFrame:
+    """Cached worksheet read (300 s TTL), empty DF if blank; the last good copy if Google is down, unless strict."""
+    try:
+        return _cached_read(_read_sheet_cached, sheet_name, expected_cols)
+    except ConnectionError:
+        if _STRICT_READS.get():
+            raise
+        snapshot = _last_good_sheets().get(sheet_name)
+        cache = shared_cache()
+        if snapshot is None and cache:
+            snapshot = cache.get(sheet_name, max_age=float("inf"))
+        if snapshot is None:
+            raise
+        return _with_columns(snapshot, expected_cols)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _read_sheet_cached(namespace: str, sheet_name: str, expected_cols=None) -> pd.DataFrame:
+    return _fetch_sheet_df(sheet_name, expected_cols)
+
+
+def _fetch_sheet_df(sheet_name: str, expected_cols=None) -> pd.DataFrame:
+    cache = shared_cache()
+    df = cache.read_through(sheet_name, _download_sheet) if cache else _download_sheet(sheet_name)
+    _last_good_sheets()[sheet_name] = df
+    return _with_columns(df, expected_cols)
+
+
+def _with_columns(df: pd.DataFrame, expected_cols=None) -> pd.DataFrame:
+    if df.empty and expected_cols:
+        return pd.DataFrame(columns=expected_cols)
+    if expected_cols:
+        df = df.assign(**{col: pd.NA for col in expected_cols if col not in df.columns})[expected_cols]
+    return df
+
+
+def _download_sheet(sheet_name: str) -> pd.DataFrame:
+    if journal_reads() and event_journal() is not None:
+        df = _journal_frame(sheet_name)
+        if df is not None:
+            return df
+    return _worksheet_df(get_sheet(sheet_name))
+
+
+def _worksheet_df(ws) -> pd.DataFrame:
+    """The worksheet's rows as they are in Google now, never the journal or a cached copy."""
+    try:
+        return get_as_dataframe(ws, evaluate_formulas=True, header=0).dropna(how="all")
+    except Exception as exc:
+        raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+
+
+def write_sheet_df(sheet_name: str, df: pd.DataFrame) -> None:
+    """Overwrite a worksheet under its table lock, never leaving it empty mid-write, then clear all cached reads."""
+    started = time.perf_counter()
+    with table_lock(sheet_name):
+        waited = time.perf_counter() - started
+        _overwrite_sheet(sheet_name, df)
+        _after_write(sheet_name)
+    _record_write(sheet_name, "rewrite", len(df), waited, time.perf_counter() - started)
+
+
+def _overwrite_sheet(sheet_name: str, df: pd.DataFrame) -> None:
+    ws = get_sheet(sheet_name)
+    try:
+        set_with_dataframe(ws, df, include_index=False, include_column_header=True)
+        n_rows, n_cols = len(df) + 1, max(len(df.columns), 1)
+        stale = []
+        if ws.row_count > n_rows:
+            stale.append(f"A{n_rows + 1}:{gspread.utils.rowcol_to_a1(ws.row_count, ws.col_count)}")
+        if ws.col_count > n_cols:
+            stale.append(f"{gspread.utils.rowcol_to_a1(1, n_cols + 1)}:"
+                         f"{gspread.utils.rowcol_to_a1(n_rows, ws.col_count)}")
+        if stale:
+            ws.batch_clear(stale)
+    except Exception as exc:
+        raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+    _record_event("rewrite", sheet_name, [str(c) for c in df.columns],
+                  [[_journal_cell(v) for v in row] for row in df.to_numpy(dtype=object).tolist()])
+
+
+def _after_write(sheet_name: str) -> None:
+    cache = shared_cache()
+    if cache:
+        cache.invalidate(sheet_name)  # other replicas drop their caches on their next run
+    clear_read_caches()  # invalidate this tenant's read caches after every write
+    if sheet_name not in (SHEET_CASES, SHEET_SCORES, SHEET_CASE_SCORES, SHEET_STEP_VERSIONS, SHEET_PARTITIONS):
+        # Roster/procedure edits change names the derived views resolved at build
+        # time; case writes advance the views in place instead (see save_case).
+        reset_derived_views()
+
+
+def load_refs():
+    """Load all reference tables in one shot (cached 300 s per tenant)."""
+    return _cached_read(_load_refs_cached)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _load_refs_cached(namespace: str):
+    def _safe(name, cols):
+        try:
+            return read_sheet_df(name, expected_cols=cols)
+        except Exception:
+            if _STRICT_READS.get():
+                raise
+            return pd.DataFrame(columns=cols)
+
+    spec_df  = _safe(SHEET_SPECIALTY,  ["specialty_id",  "specialty_name"])
+    proc_df  = _safe(SHEET_PROCEDURES, ["procedure_id",  "procedure_name", "specialty_id"])
+    steps_df = _safe(SHEET_STEPS,      ["step_id",       "procedure_id",   "step_order", "step_name"])
+    atnd_df  = _safe(SHEET_ATTENDINGS, ["attending_id",  "attending_name", "specialty_id", "email"])
+    return spec_df, proc_df, steps_df, atnd_df
+
+
+def _row_runs(rows: list) -> list:
+    """Collapse sorted 1-based row numbers into contiguous (first, last) runs."""
+    runs: list = []
+    for r in rows:
+        if runs and r == runs[-1][1] + 1:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    return [tuple(run) for run in runs]
+
+
+def read_matching_rows(queries: list) -> list:
+    """Rows whose key column equals the key, a frame per (sheet, key_col, key, expected_cols), in two batch reads."""
+    out = [pd.DataFrame(columns=cols) for _, _, _, cols in queries]
+    cache = shared_cache()
+    remote = []
+    for i, (sheet_name, key_col, key, expected_cols) in enumerate(queries):
+        cached = cache.get(sheet_name) if cache else None
+        if cached is None:
+            remote.append(i)
+        elif key_col in cached.columns:
+            # The whole sheet is already on this host; filter it instead of calling the API.
+            rows = cached[cached[key_col].astype(str).str.strip() == key].fillna("").astype(str)
+            out[i] = _with_columns(rows, expected_cols).reset_index(drop=True)
+    if not remote:
+        return out
+
+    sheet_key = current_tenant().sheet_key
+    http = get_gs_client().http_client
+
+    def _batch(ranges: list) -> list:
+        return [vr.get("values", []) for vr in http.values_batch_get(sheet_key, ranges)["valueRanges"]] if ranges else []
+
+    def _column(sheet_name: str, index: int) -> str:
+        letter = gspread.utils.rowcol_to_a1(1, index + 1).rstrip("1")
+        return gspread.utils.absolute_range_name(sheet_name, f"{letter}:{letter}")
+
+    def _probe(idx: list) -> list:
+        return [rng for i in idx for rng in (gspread.utils.absolute_range_name(queries[i][0], "1:1"),
+                                             _column(queries[i][0], queries[i][3].index(queries[i][1])))]
+
+    try:
+        try:
+            got = _batch(_probe(remote))
+        except gspread.exceptions.APIError as exc:
+            if exc.code != 400:
+                raise
+            # A sheet that doesn't exist yet fails the whole batch: it has no rows.
+            titles = {s["properties"]["title"] for s in http.fetch_sheet_metadata(sheet_key)["sheets"]}
+            remote = [i for i in remote if queries[i][0] in titles]
+            got = _batch(_probe(remote))
+
+        headers, keys, moved = {}, {}, []
+        for n, i in enumerate(remote):
+            header = [str(h).strip() for h in (got[2 * n] or [[]])[0]]
+            key_col = queries[i][1]
+            if key_col not in header:
+                continue
+            headers[i] = header
+            if header.index(key_col) == queries[i][3].index(key_col):
+                keys[i] = got[2 * n + 1]
+            else:
+                moved.append(i)
+        for i, values in zip(moved, _batch([_column(queries[i][0], headers[i].index(queries[i][1])) for i in moved])):
+            keys[i] = values
+
+        wanted = []
+        for i, values in keys.items():
+            key = queries[i][2]
+            rows = [r + 1 for r, v in enumerate(values) if r > 0 and v and str(v[0]).strip() == key]
+            wanted += [(i, gspread.utils.absolute_range_name(
+                queries[i][0], f"{gspread.utils.rowcol_to_a1(first, 1)}:"
+                               f"{gspread.utils.rowcol_to_a1(last, len(headers[i]))}"))
+                       for first, last in _row_runs(rows)]
+        blocks = _batch([rng for _, rng in wanted])
+    except ConnectionError:
+        raise
+    except Exception as exc:
+        raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+
+    records: dict = {}
+    for (i, _), block in zip(wanted, blocks):
+        width = len(headers[i])
+        records.setdefault(i, []).extend(row + [""] * (width - len(row)) for row in block)
+    for i, rows in records.items():
+        df = pd.DataFrame(rows, columns=headers[i])
+        out[i] = df.assign(**{col: pd.NA for col in queries[i][3] if col not in df.columns})[queries[i][3]]
+    return out
+
+
+def load_procedure(procedure_id: str):
+    """Return (procedure_name, ordered steps DataFrame) for one procedure (cached 300 s, fetched narrowly)."""
+    return _cached_read(_load_procedure_cached, procedure_id)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _load_procedure_cached(namespace: str, procedure_id: str):
+    procedure_id = str(procedure_id).strip()
+    proc_rows, steps = read_matching_rows([
+        (SHEET_PROCEDURES, "procedure_id", procedure_id, ["procedure_id", "procedure_name", "specialty_id"]),
+        (SHEET_STEPS,      "procedure_id", procedure_id, ["step_id", "procedure_id", "step_order", "step_name"]),
+    ])
+    steps["step_order"] = pd.to_numeric(steps["step_order"], errors="coerce")
+    steps = steps.sort_values("step_order").reset_index(drop=True)
+    proc_name = proc_rows["procedure_name"].iloc[0] if not proc_rows.empty else procedure_id
+    return proc_name, steps
+
+
+# ─────────────────────────────────────────────
+# TABLE WRITER  (serialized, append-first)
+# ─────────────────────────────────────────────
+# Every mutation of a table runs under that table's lock: a re-entrant lock for
+# the sessions of this process plus, with SHARED_CACHE_PATH set, a host-wide
+# lease for the other replicas.  New rows are appended (Sheets applies appends
+# atomically, so concurrent submissions from other hosts cannot overwrite each
+# other); edits that must rewrite the sheet re-read it under the lock and are
+# re-applied if the sheet changed underneath them.
+WRITE_CONFLICT_RETRIES = 3
+
+
+def _table_locks() -> dict:
+    return _tenant_resource("table_locks", lambda: {"guard": threading.Lock(), "tables": {}})
+
+
+@contextlib.contextmanager
+def table_lock(sheet_name: str):
+    """Serialize mutations of one table across sessions and (via the shared cache) replicas."""
+    registry = _table_locks()
+    with registry["guard"]:
+        entry = registry["tables"].setdefault(sheet_name, {"lock": threading.RLock(), "depth": 0})
+    with entry["lock"], contextlib.ExitStack() as stack:
+        if entry["depth"] == 0 and shared_cache() is not None:
+            stack.enter_context(shared_cache().lock("table:" + sheet_name))
+        entry["depth"] += 1
+        try:
+            yield
+        finally:
+            entry["depth"] -= 1
+
+
+@contextlib.contextmanager
+def locked_tables(*sheet_names):
+    """Hold several table locks (in a fixed order) with fresh, strict reads inside, from read to rewrite."""
+    with contextlib.ExitStack() as stack:
+        for name in sorted(set(sheet_names)):
+            stack.enter_context(table_lock(name))
+        cache = shared_cache()
+        for name in sheet_names:
+            if cache:
+                cache.invalidate(name)
+        clear_read_caches()
+        stack.enter_context(strict_reads())
+        yield
+
+
+def _write_stats() -> dict:
+    return _tenant_resource("write_stats", lambda: {"lock": threading.Lock(), "tables": {}})
+
+
+def _record_write(sheet_name: str, kind: str, rows: int, waited: float, elapsed: float,
+                  conflicts: int = 0, skipped: int = 0) -> None:
+    stats = _write_stats()
+    with stats["lock"]:
+        t = stats["tables"].setdefault(sheet_name, {
+            "appends": 0, "rewrites": 0, "rows_written": 0, "conflicts_merged": 0,
+            "duplicates_skipped": 0, "lock_wait_s": 0.0, "busy_s": 0.0, "max_ms": 0.0,
+        })
+        t[kind + "s"]            += 1
+        t["rows_written"]       += rows
+        t["conflicts_merged"]   += conflicts
+        t["duplicates_skipped"] += skipped
+        t["lock_wait_s"]        += waited
+        t["busy_s"]             += elapsed - waited
+        t["max_ms"]              = max(t["max_ms"], elapsed * 1000)
+
+
+def write_metrics() -> pd.DataFrame:
+    """Per-table write counters of the current tenant for this process since it started."""
+    stats = _write_stats()
+    with stats["lock"]:
+        rows = [{"table": name, **t} for name, t in sorted(stats["tables"].items())]
+    df = pd.DataFrame(rows, columns=[
+        "table", "appends", "rewrites", "rows_written", "conflicts_merged",
+        "duplicates_skipped", "lock_wait_s", "busy_s", "max_ms",
+    ])
+    writes = df["appends"] + df["rewrites"]
+    df["mean_ms"] = (df["busy_s"] * 1000 / writes.where(writes > 0)).round(1)
+    return df.round({"lock_wait_s": 3, "busy_s": 3, "max_ms": 1})
+
+
+def _cell(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value if isinstance(value, (int, float, str)) else str(value)
+
+
+def append_sheet_rows(sheet_name: str, rows: list, columns: list, unique_key=None) -> int:
+    """Append `rows` (dicts) without rewriting the sheet, skipping keys already on it; returns rows appended."""
+    started = time.perf_counter()
+    with table_lock(sheet_name):
+        waited = time.perf_counter() - started
+        ws = get_sheet(sheet_name)
+        try:
+            header = [str(h).strip() for h in ws.row_values(1)]
+            while header and not header[-1]:
+                header.pop()
+            missing = [c for c in columns if c not in header]
+            if header and missing:
+                ws.update([missing], gspread.utils.rowcol_to_a1(1, len(header) + 1))
+            header += missing
+            skipped = 0
+            if unique_key is not None and len(header) > len(missing):
+                taken = {str(v).strip() for v in ws.col_values(header.index(unique_key) + 1)[1:]}
+                fresh = []
+                for row in rows:
+                    key = str(row.get(unique_key, "")).strip()
+                    if key in taken:
+                        skipped += 1
+                    else:
+                        taken.add(key)
+                        fresh.append(row)
+                rows = fresh
+            values = [[_cell(row.get(col)) for col in header] for row in rows]
+            blank = len(header) == len(missing)
+            if blank:  # blank sheet: write the header first
+                values.insert(0, header)
+            if values:
+                ws.append_rows(values, value_input_option="USER_ENTERED", table_range="A1")
+        except Exception as exc:
+            raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+        if rows:
+            _record_event("append", sheet_name, header,
+                          [[_journal_cell(v) for v in row] for row in (values[1:] if blank else values)], blank=blank)
+            _after_write(sheet_name)
+    _record_write(sheet_name, "append", len(rows), waited, time.perf_counter() - started, skipped=skipped)
+    return len(rows)
+
+
+def rewrite_sheet(sheet_name: str, mutate, expected_cols=None) -> pd.DataFrame:
+    """Apply `mutate(df) -> df` to the sheet read fresh under its lock; WriteConflict if it keeps changing."""
+    started = time.perf_counter()
+    conflicts = 0
+    with table_lock(sheet_name):
+        waited = time.perf_counter() - started
+        ws = get_sheet(sheet_name)
+        for _ in range(WRITE_CONFLICT_RETRIES + 1):
+            try:
+                before = ws.col_values(1)
+            except Exception as exc:
+                raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+            # Planned from the sheet itself, the copy the conflict check compares against.
+            with strict_reads():
+                updated = mutate(_with_columns(_worksheet_df(ws), expected_cols))
+            try:
+                changed = ws.col_values(1) != before
+            except Exception as exc:
+                raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+            if not changed:
+                break
+            conflicts += 1
+        else:
+            raise WriteConflict(f"{sheet_name} changed during each of {conflicts} attempts to rewrite it; "
+                                "nothing was written — try again.")
+        _overwrite_sheet(sheet_name, updated)
+        _after_write(sheet_name)
+    _record_write(sheet_name, "rewrite", len(updated), waited, time.perf_counter() - started,
+                  conflicts=conflicts)
+    return updated
+
+
+# ─────────────────────────────────────────────
+# SCORE STORAGE
+# ─────────────────────────────────────────────
+# Two layouts, chosen with SCORES_LAYOUT in secrets:
+#   "long" (default) — one `scores` row per (case, step).
+#   "wide"           — one `case_scores` row per case.  The step ratings are packed
+#                      into a single string, one character per step, in the step
+#                      order recorded under the row's step_version in `step_versions`.
+# Readers always get the long SCORE_COLS frame from read_scores_df().
+RATING_CODES   = {r: chr(ord("a") + i) for i, r in enumerate(RATING_OPTIONS)}  # letters keep cells as text
+CODE_TO_RATING = {c: r for r, c in RATING_CODES.items()}
+NO_RATING_CODE = "."
+
+
+def scores_layout() -> str:
+    """Configured score layout: "wide" or "long"."""
+    try:
+        layout = str(st.secrets.get("SCORES_LAYOUT", "long")).strip().lower()
+    except Exception:  # no secrets file
+        layout = "long"
+    return "wide" if layout == "wide" else "long"
+
+
+def step_version(procedure_id: str, step_ids: list) -> str:
+    """Stable id for an ordered step list; the "v" prefix stops Sheets reading it as a number."""
+    digest = hashlib.sha1("|".join([str(procedure_id), *map(str, step_ids)]).encode()).hexdigest()
+    return "v" + digest[:10]
+
+
+def encode_ratings(step_ids: list, scores: dict) -> str:
+    return "".join(RATING_CODES.get(scores.get(s), NO_RATING_CODE) for s in step_ids)
+
+
+def register_step_versions(entries: dict) -> None:
+    """Record {step_version: (procedure_id, step_ids)} entries the sheet does not have yet."""
+    versions = read_sheet_df(SHEET_STEP_VERSIONS, expected_cols=STEP_VERSION_COLS)
+    known    = set(versions["step_version"].astype(str).str.strip())
+    new_rows = [{"step_version": v, "procedure_id": proc, "step_ids": "|".join(ids)}
+                for v, (proc, ids) in entries.items() if v not in known]
+    if new_rows:
+        append_sheet_rows(SHEET_STEP_VERSIONS, new_rows, STEP_VERSION_COLS, unique_key="step_version")
+
+
+def expand_wide_scores(wide_df: pd.DataFrame, versions_df: pd.DataFrame) -> pd.DataFrame:
+    """Unpack `case_scores` rows into long SCORE_COLS rows; rows of an unknown step_version are skipped."""
+    step_lists = dict(zip(versions_df["step_version"].astype(str).str.strip(),
+                          versions_df["step_ids"].astype(str).str.split("|")))
+    wide = wide_df.reset_index(drop=True).assign(
+        step_version=wide_df["step_version"].astype(str).str.strip().to_numpy(),
+        ratings=wide_df["ratings"].fillna("").astype(str).to_numpy(),
+    )
+    parts = []
+    for version, grp in wide.groupby("step_version", sort=False):
+        step_ids = step_lists.get(version)
+        if not step_ids:
+            continue
+        n = len(step_ids)
+        codes = np.array([list(r.ljust(n, NO_RATING_CODE)[:n]) for r in grp["ratings"]]).ravel()
+        part = pd.DataFrame({
+            "_row":                np.repeat(grp.index.to_numpy(), n),
+            "case_id":             np.repeat(grp["case_id"].to_numpy(), n),
+            "step_id":             np.tile(step_ids, len(grp)),
+            "rating":              pd.Series(codes).map(CODE_TO_RATING).to_numpy(),
+            "case_complexity":     np.repeat(grp["case_complexity"].to_numpy(), n),
+            "overall_performance": np.repeat(grp["overall_performance"].to_numpy(), n),
+        })
+        parts.append(part[part["rating"].notna()])
+    if not parts:
+        return pd.DataFrame(columns=SCORE_COLS)
+    long = pd.concat(parts, ignore_index=True).sort_values("_row", kind="stable")
+    long["rating_num"] = long["rating"].map(RATING_TO_NUM)
+    return long[SCORE_COLS].reset_index(drop=True)
+
+
+def score_table() -> tuple:
+    """(sheet name, columns) of the score sheet in the configured layout."""
+    if scores_layout() == "wide":
+        return SHEET_CASE_SCORES, WIDE_SCORE_COLS
+    return SHEET_SCORES, SCORE_COLS
+
+
+def read_scores_df(ay_from=None, ay_to=None) -> pd.DataFrame:
+    """Step scores as the long SCORE_COLS frame whatever the layout, retired steps mapped forward (cached 300 s)."""
+    return _cached_read(_read_scores_cached, ay_from, ay_to)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _read_scores_cached(namespace: str, ay_from=None, ay_to=None) -> pd.DataFrame:
+    table, cols = score_table()
+    return _long_scores(_read_partitioned(table, cols, ay_from, ay_to))
+
+
+def _long_scores(stored: pd.DataFrame) -> pd.DataFrame:
+    """Scores as stored in score_table(), as the long SCORE_COLS frame under current step IDs."""
+    if score_table()[0] == SHEET_CASE_SCORES:
+        stored = expand_wide_scores(stored, read_sheet_df(SHEET_STEP_VERSIONS, expected_cols=STEP_VERSION_COLS))
+    return apply_step_aliases(stored)
+
+
+def _partition_pairs(ay_from=None, ay_to=None):
+    """(cases, long scores) of each academic-year archive in turn, then of the live sheets."""
+    table, cols = score_table()
+    tenant_id   = current_tenant().id
+    cases_at    = {year: (sheet, at) for year, sheet, at in _archives(SHEET_CASES, ay_from, ay_to)}
+    scores_at   = {year: (sheet, at) for year, sheet, at in _archives(table, ay_from, ay_to)}
+    for year in sorted(set(cases_at) | set(scores_at)):
+        cases  = (_archived_partition(tenant_id, *cases_at[year], tuple(CASE_COLS))
+                  if year in cases_at else pd.DataFrame(columns=CASE_COLS))
+        scores = (_archived_partition(tenant_id, *scores_at[year], tuple(cols))
+                  if year in scores_at else pd.DataFrame(columns=cols))
+        yield cases, _long_scores(scores)
+    yield read_sheet_df(SHEET_CASES, expected_cols=CASE_COLS), _long_scores(read_sheet_df(table, expected_cols=cols))
+
+
+def _score_keys(scores_df: pd.DataFrame) -> set:
+    return set(zip(norm_id(scores_df["case_id"]), scores_df["step_id"].astype(str).str.strip(),
+                   scores_df["rating"].astype(str)))
+
+
+def _long_to_wide(scores_df: pd.DataFrame, proc_of: dict, order_of: dict) -> tuple:
+    """(wide frame, {step_version: (procedure_id, step_ids)}, deduplicated long rows) for long scores."""
+    scores = scores_df.assign(case_id=norm_id(scores_df["case_id"]),
+                              step_id=scores_df["step_id"].astype(str).str.strip())
+    scores = scores[(scores["case_id"] != "") & (scores["case_id"] != "nan")]
+    case_pos = {c: i for i, c in enumerate(pd.unique(scores["case_id"]))}
+    scores = scores.assign(_case=scores["case_id"].map(case_pos),
+                           _order=scores["step_id"].map(order_of).astype(float).fillna(np.inf))
+    scores = scores.sort_values(["_case", "_order", "step_id"], kind="stable")
+    deduped = scores.drop_duplicates(["case_id", "step_id"], keep="last")
+
+    rows, entries = [], {}
+    for _, grp in deduped.groupby("_case", sort=True):
+        case_id  = grp["case_id"].iloc[0]
+        proc     = proc_of.get(case_id, "")
+        step_ids = grp["step_id"].tolist()
+        version  = step_version(proc, step_ids)
+        entries[version] = (proc, step_ids)
+        rows.append({
+            "case_id":             case_id,
+            "procedure_id":        proc,
+            "step_version":        version,
+            "ratings":             encode_ratings(step_ids, dict(zip(step_ids, grp["rating"]))),
+            "case_complexity":     grp["case_complexity"].iloc[0],
+            "overall_performance": grp["overall_performance"].iloc[0],
+        })
+    return pd.DataFrame(rows, columns=WIDE_SCORE_COLS), entries, deduped
+
+
+def migrate_scores(to: str, dry_run: bool = False, replace: bool = False) -> dict:
+    """Copy the stored scores into the `to` layout ("wide" or "long") and report; `replace` overwrites an old copy."""
+    if to not in ("wide", "long"):
+        raise ValueError(f"Unknown scores layout: {to!r}")
+    source, source_cols = (SHEET_CASE_SCORES, WIDE_SCORE_COLS) if to == "long" else (SHEET_SCORES, SCORE_COLS)
+    target = SHEET_SCORES if to == "long" else SHEET_CASE_SCORES
+    if target == score_table()[0]:
+        raise ValueError(f"{target} holds the live scores (SCORES_LAYOUT = {to!r}); nothing to migrate into.")
+    if dry_run:
+        return _migrate_scores(to, source, source_cols, target, replace, dry_run=True)
+    # Locked from the first read to the last write, so no save lands in between.
+    with locked_tables(source, target, SHEET_PARTITIONS, SHEET_STEP_VERSIONS):
+        return _migrate_scores(to, source, source_cols, target, replace, dry_run=False)
+
+
+def _migrate_scores(to: str, source: str, source_cols: list, target: str, replace: bool, dry_run: bool) -> dict:
+    versions_df = _fetch_sheet_df(SHEET_STEP_VERSIONS, STEP_VERSION_COLS)
+    catalog     = _fetch_sheet_df(SHEET_PARTITIONS, PARTITION_COLS)
+    if not replace and (not _fetch_sheet_df(target).empty or (catalog["table"].astype(str) == target).any()):
+        raise ValueError(f"{target} already holds scores; migrate with replace to overwrite them.")
+    archives    = catalog[catalog["table"].astype(str) == source]
+    # (academic year or None for the live sheet, sheet name, stored rows)
+    parts = [(int(p["academic_year"]), str(p["sheet_name"]), _fetch_sheet_df(str(p["sheet_name"]), source_cols))
+             for _, p in archives.iterrows()]
+    parts.append((None, source, _fetch_sheet_df(source, source_cols)))
+
+    converted = []
+    if to == "long":
+        decodable = set(versions_df["step_version"].astype(str).str.strip())
+        for year, _, wide_df in parts:
+            converted.append((year, expand_wide_scores(wide_df, versions_df)))
+        report = {
+            "cases":            sum(len(df) for _, _, df in parts),
+            "rows_written":     sum(len(df) for _, df in converted),
+            "cells_before":     sum(df.size for _, _, df in parts) + versions_df.size,
+            "cells_after":      sum(len(df) for _, df in converted) * len(SCORE_COLS),
+            "undecodable":      sum(int((~df["step_version"].astype(str).str.strip().isin(decodable)).sum())
+                                    for _, _, df in parts),
+            "archives_migrated": len(parts) - 1,
+        }
+        entries = {}
+    else:
+        cases_df = pd.concat([_fetch_sheet_df(str(p["sheet_name"]), CASE_COLS)
+                              for _, p in catalog[catalog["table"].astype(str) == SHEET_CASES].iterrows()]
+                             + [_fetch_sheet_df(SHEET_CASES, CASE_COLS)], ignore_index=True)
+        steps_df = _fetch_sheet_df(SHEET_STEPS, ["step_id", "procedure_id", "step_order", "step_name"])
+        proc_of  = dict(zip(norm_id(cases_df["case_id"]), cases_df["procedure_id"].astype(str).str.strip()))
+        order_of = dict(zip(steps_df["step_id"].astype(str).str.strip(),
+                            pd.to_numeric(steps_df["step_order"], errors="coerce")))
+        entries, deduped, n_scores = {}, [], 0
+        for year, _, scores_df in parts:
+            wide_df, part_entries, part_deduped = _long_to_wide(scores_df, proc_of, order_of)
+            converted.append((year, wide_df))
+            entries.update(part_entries)
+            deduped.append(part_deduped)
+            n_scores += int((~norm_id(scores_df["case_id"]).isin(["", "nan"])).sum())
+        deduped = pd.concat(deduped, ignore_index=True)
+        new_versions = pd.DataFrame(
+            [{"step_version": v, "procedure_id": p, "step_ids": "|".join(ids)} for v, (p, ids) in entries.items()],
+            columns=STEP_VERSION_COLS,
+        )
+        all_versions = pd.concat([versions_df, new_versions], ignore_index=True).drop_duplicates("step_version")
+        wide_all  = pd.concat([df for _, df in converted], ignore_index=True)
+        encodable = deduped[deduped["rating"].isin(RATING_CODES)]
+        report = {
+            "cases":                len(wide_all),
+            "rows_written":         len(wide_all),
+            "cells_before":         sum(df.size for _, _, df in parts),
+            "cells_after":          wide_all.size + all_versions.size,
+            "step_versions":        len(entries),
+            "duplicates_dropped":   n_scores - len(deduped),
+            "orphan_scores":        int((~deduped["case_id"].isin(proc_of)).sum()),
+            "unrecognised_ratings": len(deduped) - len(encodable),
+            "verified":             _score_keys(expand_wide_scores(wide_all, all_versions)) == _score_keys(encodable),
+            "archives_migrated":    len(parts) - 1,
+        }
+    if dry_run or report.get("verified") is False:
+        return report
+
+    if entries:
+        with strict_reads():
+            register_step_versions(entries)
+    archived_at = datetime.datetime.now().isoformat(timespec="seconds")
+    catalog = catalog[catalog["table"].astype(str) != target]
+    new_rows = []
+    for year, df in converted:
+        if year is None:
+            continue
+        sheet = partition_sheet_name(target, year)
+        write_sheet_df(sheet, df)
+        new_rows.append({"table": target, "academic_year": year, "sheet_name": sheet,
+                         "rows": len(df), "archived_at": archived_at})
+    if new_rows:
+        write_sheet_df(SHEET_PARTITIONS, pd.concat([catalog, pd.DataFrame(new_rows)], ignore_index=True))
+    write_sheet_df(target, converted[-1][1])
+    return report
+
+
+# ─────────────────────────────────────────────
+# ACADEMIC-YEAR PARTITIONS
+# ─────────────────────────────────────────────
+# `cases` and the score sheet are the live partition.  archive_academic_years()
+# moves completed academic years into "<table>_<YYYY>-<YY>" sheets, listed in the
+# `partitions` catalog.  Archives only change when the job re-runs, so each is
+# read once per process; the routed readers stitch them onto the live sheet.
+ACADEMIC_YEAR_START_MONTH = 7  # residency years run July → June
+
+
+def academic_year(d) -> int:
+    """Starting calendar year of the academic year containing `d` (2024 for 2024-25)."""
+    d = pd.Timestamp(d)
+    return d.year - int(d.month < ACADEMIC_YEAR_START_MONTH)
+
+
+def academic_years_of(dates: pd.Series) -> pd.Series:
+    """Vectorised academic_year(); unparseable dates give <NA>."""
+    dt = pd.to_datetime(dates, errors="coerce")
+    return (dt.dt.year - (dt.dt.month < ACADEMIC_YEAR_START_MONTH).astype(int)).astype("Int64")
+
+
+def academic_year_label(year: int) -> str:
+    return f"{year}-{(year + 1) % 100:02d}"
+
+
+def partition_sheet_name(table: str, year: int) -> str:
+    return f"{table}_{academic_year_label(year)}"
+
+
+def _archived_partition(tenant_id: str, sheet_name: str, archived_at: str, expected_cols: tuple) -> pd.DataFrame:
+    """Rows of one archive sheet.  `archived_at` keys out copies from earlier archival runs."""
+    return _tenant_lru("archived_partitions", (sheet_name, archived_at, expected_cols),
+                       lambda: _fetch_sheet_df(sheet_name, list(expected_cols)), max_entries=64, tenant_id=tenant_id)
+
+
+def _archives(table: str, ay_from=None, ay_to=None) -> list:
+    """(academic year, sheet name, archived_at) of each archive of `table` within the bounds, oldest first."""
+    catalog = read_sheet_df(SHEET_PARTITIONS, expected_cols=PARTITION_COLS)
+    catalog = catalog[catalog["table"].astype(str) == table].assign(
+        academic_year=pd.to_numeric(catalog["academic_year"], errors="coerce"))
+    if ay_from is not None:
+        catalog = catalog[catalog["academic_year"] >= ay_from]
+    if ay_to is not None:
+        catalog = catalog[catalog["academic_year"] <= ay_to]
+    return [(p["academic_year"], str(p["sheet_name"]), str(p["archived_at"]))
+            for _, p in catalog.sort_values("academic_year").iterrows()]
+
+
+def _read_partitioned(table: str, expected_cols: list, ay_from=None, ay_to=None) -> pd.DataFrame:
+    """The live sheet (always: backdated cases land there) plus the archives of `table` within the bounds."""
+    frames = [_archived_partition(current_tenant().id, sheet, archived_at, tuple(expected_cols))
+              for _, sheet, archived_at in _archives(table, ay_from, ay_to)]
+    frames.append(read_sheet_df(table, expected_cols=expected_cols))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=expected_cols)
+    return pd.concat(frames, ignore_index=True)  # a copy: archive frames are shared across sessions
+
+
+def read_cases_df(ay_from=None, ay_to=None) -> pd.DataFrame:
+    """Cases from the live sheet and the archived academic years in [ay_from, ay_to] (all when unbounded)."""
+    return _read_partitioned(SHEET_CASES, CASE_COLS, ay_from, ay_to)
+
+
+def archive_academic_years(years=None, dry_run: bool = False) -> list:
+    """Move completed academic years out of the live case and score sheets; one report dict per (table, year)."""
+    with (contextlib.nullcontext() if dry_run else locked_tables(SHEET_CASES, score_table()[0], SHEET_PARTITIONS)):
+        current         = academic_year(datetime.date.today())
+        scores_name, scores_cols = score_table()
+        cases_df        = read_sheet_df(SHEET_CASES, expected_cols=CASE_COLS)
+        scores_df       = read_sheet_df(scores_name, expected_cols=scores_cols)
+        case_year       = academic_years_of(cases_df["date"])
+        year_of_case    = dict(zip(norm_id(cases_df["case_id"]), case_year))
+        score_year      = norm_id(scores_df["case_id"]).map(year_of_case).astype("Int64")
+        if years is None:
+            years = case_year.dropna().unique()
+        years = sorted({int(y) for y in years if int(y) < current})
+
+        catalog = read_sheet_df(SHEET_PARTITIONS, expected_cols=PARTITION_COLS)
+        keep    = {SHEET_CASES: pd.Series(True, index=cases_df.index),
+                   scores_name: pd.Series(True, index=scores_df.index)}
+        report  = []
+        for year in years:
+            for table, df, cols, year_col in ((SHEET_CASES, cases_df, CASE_COLS, case_year),
+                                              (scores_name, scores_df, scores_cols, score_year)):
+                moving = (year_col == year).fillna(False).to_numpy(dtype=bool)
+                if not moving.any():
+                    continue
+                sheet = partition_sheet_name(table, year)
+                listed = (catalog["table"].astype(str) == table) & (catalog["sheet_name"].astype(str) == sheet)
+                if not listed.any():
+                    prior = pd.DataFrame(columns=cols)
+                elif dry_run:  # a preview may use the copy cached for this archival run
+                    prior = _archived_partition(current_tenant().id, sheet,
+                                                str(catalog.loc[listed, "archived_at"].iloc[-1]), tuple(cols))
+                else:
+                    prior = _fetch_sheet_df(sheet, cols)
+                archived = pd.concat([prior, df[moving]], ignore_index=True)
+                archived = archived.assign(case_id=norm_id(archived["case_id"])).drop_duplicates()
+                report.append({"table": table, "academic_year": academic_year_label(year), "sheet": sheet,
+                               "moved": int(moving.sum()), "archived_rows": len(archived)})
+                keep[table] &= ~moving
+                if not dry_run:
+                    write_sheet_df(sheet, archived)
+                    catalog = pd.concat([catalog[~listed], pd.DataFrame([{
+                        "table":         table,
+                        "academic_year": year,
+                        "sheet_name":    sheet,
+                        "rows":          len(archived),
+                        "archived_at":   datetime.datetime.now().isoformat(timespec="seconds"),
+                    }])], ignore_index=True)
+        # Archives and catalog before the trim: an interrupted run leaves rows to fold in, not gaps.
+        if report and not dry_run:
+            write_sheet_df(SHEET_PARTITIONS, catalog)
+            write_sheet_df(SHEET_CASES, cases_df[keep[SHEET_CASES]])
+            write_sheet_df(scores_name, scores_df[keep[scores_name]])
+        return report
+
+
+# ─────────────────────────────────────────────
+# COMPACTION
+# ─────────────────────────────────────────────
+_BLANK_IDS = ("", "nan", "<NA>", "None")
+
+
+def compact_tables(dry_run: bool = False, drop_unknown_steps: bool = False) -> dict:
+    """Rewrite the live case and score sheets without duplicate, orphaned or ID-less rows, and report the fixes."""
+    with (contextlib.nullcontext() if dry_run else locked_tables(SHEET_CASES, score_table()[0])):
+        scores_name, scores_cols = score_table()
+        cases_raw  = read_sheet_df(SHEET_CASES, expected_cols=CASE_COLS)
+        scores_raw = read_sheet_df(scores_name, expected_cols=scores_cols)
+        roster     = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+        _, _, steps_df, atnds_df = load_refs()
+
+        cases  = cases_raw.assign(case_id=norm_id(cases_raw["case_id"]))
+        scores = scores_raw.assign(case_id=norm_id(scores_raw["case_id"]))
+        report = {
+            "cases_before":  len(cases_raw),
+            "scores_before": len(scores_raw),
+            "ids_normalised": int((cases["case_id"] != cases_raw["case_id"].astype(str).fillna("")).sum()
+                                  + (scores["case_id"] != scores_raw["case_id"].astype(str).fillna("")).sum()),
+        }
+
+        by_name = attending_name_index(atnds_df)
+        unified = cases["attending_id"].astype(str).map(lambda aid: canonical_attending_id(aid, by_name))
+        magic   = cases["attending_id"].astype(str).str.startswith("magic_")
+        report["attending_ids_unified"] = int((magic & (unified != cases["attending_id"].astype(str))).sum())
+        cases = cases.assign(attending_id=cases["attending_id"].where(~magic, unified))
+
+        blank_cases, blank_scores = cases["case_id"].isin(_BLANK_IDS), scores["case_id"].isin(_BLANK_IDS)
+        report["blank_ids"] = int(blank_cases.sum() + blank_scores.sum())
+        cases, scores = cases[~blank_cases], scores[~blank_scores]
+
+        dup_cases = cases.duplicated(subset=["case_id"], keep="first")
+        report["duplicate_cases"] = int(dup_cases.sum())
+        cases = cases[~dup_cases]
+
+        score_key = ["case_id", "step_id"] if scores_name == SHEET_SCORES else ["case_id"]
+        if scores_name == SHEET_SCORES:
+            scores = scores.assign(step_id=scores["step_id"].astype(str).str.strip())
+        dup_scores = scores.duplicated(subset=score_key, keep="first")
+        report["duplicate_scores"] = int(dup_scores.sum())
+        scores = scores[~dup_scores]
+
+        # An empty roster means the read went wrong, not that every resident left.
+        emails = set(roster["email"].astype(str).str.strip())
+        orphan_cases = (~cases["resident_email"].astype(str).str.strip().isin(emails)
+                        if emails else pd.Series(False, index=cases.index))
+        report["orphan_cases"] = int(orphan_cases.sum())
+        cases = cases[~orphan_cases]
+
+        archived_ids = set(norm_id(read_cases_df()["case_id"])) - set(norm_id(cases_raw["case_id"]))
+        orphan_scores = ~scores["case_id"].isin(set(cases["case_id"]) | archived_ids)
+        report["orphan_scores"] = int(orphan_scores.sum())
+        scores = scores[~orphan_scores]
+
+        if scores_name == SHEET_SCORES and not steps_df.empty:
+            known   = set(steps_df["step_id"].astype(str).str.strip()) | set(load_step_aliases())
+            unknown = ~scores["step_id"].isin(known)
+            report["unknown_step_scores"] = int(unknown.sum())
+            if drop_unknown_steps:
+                scores = scores[~unknown]
+
+        report["cases_after"]  = len(cases)
+        report["scores_after"] = len(scores)
+        report["cells_saved"]  = cases_raw.size + scores_raw.size - cases.size - scores.size
+        changed = report["ids_normalised"] or report["attending_ids_unified"] or len(cases) != len(cases_raw) or len(scores) != len(scores_raw)
+        if changed and not dry_run:
+            write_sheet_df(SHEET_CASES, cases)
+            write_sheet_df(scores_name, scores)
+            reset_derived_views()  # rows were removed; views only ever advance by additions
+        return report
+
+
+# ─────────────────────────────────────────────
+# CASE ID MIGRATION
+# ─────────────────────────────────────────────
+def _legacy_case_ids(cases_df: pd.DataFrame, known: dict, mapped_at: pd.Timestamp) -> dict:
+    """Repeatable time-ordered IDs, from case date and same-day position, for legacy IDs not in `known`."""
+    ids   = norm_id(cases_df["case_id"])
+    dates = pd.to_datetime(cases_df["date"], errors="coerce").dt.normalize()
+    todo  = ~ids.isin(known) & ~ids.map(is_time_ordered_id) & ~ids.isin(_BLANK_IDS)
+    todo &= ~ids.duplicated()
+    base  = dates.fillna(mapped_at.tz_localize(None))[todo]
+    rank  = base.groupby(base).cumcount()
+    out = {}
+    for old, day, n in zip(ids[todo], base, rank):
+        ms   = int(day.tz_localize("UTC").timestamp() * 1000) + int(n)
+        rand = int.from_bytes(hashlib.sha256(old.encode()).digest()[:10], "big")
+        out[old] = CASE_ID_PREFIX + _b32(max(ms, 0), 10) + _b32(rand, 16)
+    return out
+
+
+def migrate_case_ids(dry_run: bool = False) -> dict:
+    """Replace legacy random case_ids with time-ordered ones in every case and score sheet, and report."""
+    scores_name, scores_cols = score_table()
+    tables = [SHEET_CASES, scores_name]
+    with (contextlib.nullcontext() if dry_run else locked_tables(*tables, SHEET_CASE_ID_MAP)):
+        catalog = read_sheet_df(SHEET_PARTITIONS, expected_cols=PARTITION_COLS)
+        archives = catalog[catalog["table"].astype(str).isin(tables)]
+        sheets = {SHEET_CASES: CASE_COLS, scores_name: scores_cols}
+        sheets.update({str(name): (CASE_COLS if str(table) == SHEET_CASES else scores_cols)
+                       for table, name in zip(archives["table"], archives["sheet_name"])})
+        if dry_run:  # a preview reads through the caches
+            archived_at = dict(zip(archives["sheet_name"].astype(str), archives["archived_at"].astype(str)))
+            frames = {name: (_archived_partition(current_tenant().id, name, archived_at[name], tuple(cols))
+                             if name in archived_at else read_sheet_df(name, expected_cols=cols))
+                      for name, cols in sheets.items()}
+        else:
+            frames = {name: _fetch_sheet_df(name, cols) for name, cols in sheets.items()}
+
+        known     = case_id_map()
+        mapped_at = pd.Timestamp.now(tz="UTC").floor("s")
+        case_frames = [df for name, df in frames.items() if sheets[name] is CASE_COLS]
+        all_cases = pd.concat(case_frames, ignore_index=True) if case_frames else pd.DataFrame(columns=CASE_COLS)
+        new_ids = _legacy_case_ids(all_cases, known, mapped_at)
+        mapping = {**known, **new_ids}
+
+        report = {"case_ids_mapped": len(new_ids), "previously_mapped": len(known), "rows_rewritten": 0,
+                  "unmapped_score_ids": 0, "sheets": []}
+        rewrites = {}
+        for name, df in frames.items():
+            ids = norm_id(df["case_id"])
+            hit = ids.isin(mapping)
+            if sheets[name] is not CASE_COLS:
+                report["unmapped_score_ids"] += int((~hit & ~ids.map(is_time_ordered_id) & ~ids.isin(_BLANK_IDS)).sum())
+            if not hit.any():
+                continue
+            migrated, _ = sort_by_case_id(df.assign(case_id=ids.where(~hit, ids.map(mapping))))
+            rewrites[name] = migrated
+            report["rows_rewritten"] += int(hit.sum())
+            report["sheets"].append(name)
+        if dry_run or not rewrites:
+            return report
+
+        # The map first, so an interrupted run resumes with the same IDs.
+        if new_ids:
+            append_sheet_rows(SHEET_CASE_ID_MAP, [
+                {"old_case_id": old, "case_id": new, "mapped_at": mapped_at.isoformat()}
+                for old, new in new_ids.items()
+            ], CASE_ID_MAP_COLS, unique_key="old_case_id")
+        # Cases last: until then a score's new ID has no case, never the reverse.
+        for name in sorted(rewrites, key=lambda n: sheets[n] is CASE_COLS):
+            write_sheet_df(name, rewrites[name])
+        _tenant_resource("archived_partitions", collections.OrderedDict).clear()
+        reset_derived_views()
+        return report
+
+
+def case_id_map() -> dict:
+    """{legacy case_id: time-ordered case_id} recorded by migrate_case_ids()."""
+    map_df = read_sheet_df(SHEET_CASE_ID_MAP, expected_cols=CASE_ID_MAP_COLS)
+    return dict(zip(norm_id(map_df["old_case_id"]), norm_id(map_df["case_id"])))
+
+
+# ─────────────────────────────────────────────
+# CASE-LOG RECONCILIATION
+# ─────────────────────────────────────────────
+# Header aliases in national case-log exports, matched after lower-casing and
+# turning anything but letters and digits into "_".  Procedure columns are
+# tried in order; the first one that maps wins.
+CASE_LOG_RESIDENT_COLS  = ["resident_email", "email", "resident", "resident_name", "name"]
+CASE_LOG_DATE_COLS      = ["date", "case_date", "procedure_date", "date_of_procedure", "service_date"]
+CASE_LOG_PROCEDURE_COLS = ["procedure_id", "cpt_code", "cpt", "procedure_code", "code",
+                           "procedure", "procedure_name", "cpt_description", "description"]
+CASE_LOG_WINDOW_DAYS    = 3
+
+
+def _case_log_key(values: pd.Series) -> pd.Series:
+    return norm_id(values).str.lower().str.replace(r"\s+", " ", regex=True)
+
+
+def case_log_map() -> dict:
+    """{normalised case-log procedure label: procedure_id}: the case_log_map sheet over procedure IDs and names."""
+    _, procs_df, _, _ = load_refs()
+    map_df = read_sheet_df(SHEET_CASE_LOG_MAP, expected_cols=CASE_LOG_MAP_COLS)
+    pids = procs_df["procedure_id"].astype(str).str.strip()
+    out = dict(zip(_case_log_key(procs_df["procedure_name"]), pids))
+    out.update(zip(_case_log_key(pids), pids))
+    out.update(zip(_case_log_key(map_df["case_log_procedure"]), map_df["procedure_id"].astype(str).str.strip()))
+    return out
+
+
+def save_case_log_map(mapping: dict) -> int:
+    """Record {case-log procedure label: procedure_id}; labels already mapped are kept as they are."""
+    return append_sheet_rows(SHEET_CASE_LOG_MAP, [
+        {"case_log_procedure": str(label).strip(), "procedure_id": pid} for label, pid in mapping.items() if pid
+    ], CASE_LOG_MAP_COLS, unique_key="case_log_procedure")
+
+
+def _resident_index(roster: pd.DataFrame) -> dict:
+    """{lower-cased email, "first last" or "last, first" name: email}; names two residents share are left out."""
+    emails = roster["email"].astype(str).str.strip()
+    names  = _case_log_key(roster["name"])
+    flipped = names.str.replace(r"^(.*\S)\s+(\S+)$", r"\2, \1", regex=True)
+    by_name = pd.concat([pd.DataFrame({"key": names, "email": emails}),
+                         pd.DataFrame({"key": flipped, "email": emails})]).drop_duplicates()
+    by_name = by_name[~by_name["key"].duplicated(keep=False)]
+    return {**dict(zip(by_name["key"], by_name["email"])), **dict(zip(emails.str.lower(), emails))}
+
+
+def _pair_by_date(log: pd.DataFrame, cases: pd.DataFrame, window_days: int) -> pd.DataFrame:
+    """One-to-one (log_row, case_id, case_date) pairs on resident and procedure, nearest dates in the window first."""
+    keys = ["resident_email", "procedure_id"]
+    # merge_asof wants identical key dtypes on both sides.
+    log   = log.astype({k: object for k in keys})
+    cases = cases.astype({k: object for k in keys}).reset_index(drop=True).rename_axis("case_row").reset_index()
+    log   = log.assign(nth=log.groupby(keys + ["date"]).cumcount())
+    cases = cases.assign(nth=cases.groupby(keys + ["case_date"]).cumcount())
+    exact = log.merge(cases, left_on=keys + ["date", "nth"], right_on=keys + ["case_date", "nth"])
+    pairs = [exact[["log_row", "case_row"]]]
+    log_left  = np.ones(int(log["log_row"].max()) + 1 if len(log) else 0, dtype=bool)
+    case_left = np.ones(len(cases), dtype=bool)
+    log_left[exact["log_row"].to_numpy()] = case_left[exact["case_row"].to_numpy()] = False
+    case_ids, case_dates = cases["case_id"].to_numpy(), cases["case_date"].to_numpy()
+    log   = log.sort_values("date", kind="stable")
+    cases = cases.sort_values("case_date", kind="stable")
+    tolerance = pd.Timedelta(days=window_days)
+    while window_days > 0:
+        todo, free = log[log_left[log["log_row"].to_numpy()]], cases[case_left[cases["case_row"].to_numpy()]]
+        if todo.empty or free.empty:
+            break
+        near = pd.merge_asof(todo[["log_row", "date"] + keys], free[["case_row", "case_date"] + keys],
+                             left_on="date", right_on="case_date", by=keys,
+                             direction="nearest", tolerance=tolerance).dropna(subset=["case_row"])
+        if near.empty:
+            break
+        near = (near.assign(case_row=near["case_row"].astype(int), gap=(near["date"] - near["case_date"]).abs())
+                    .sort_values(["gap", "log_row"], kind="stable").drop_duplicates(subset=["case_row"]))
+        pairs.append(near[["log_row", "case_row"]])
+        log_left[near["log_row"].to_numpy()] = case_left[near["case_row"].to_numpy()] = False
+    pairs = pd.concat(pairs, ignore_index=True)
+    rows  = pairs["case_row"].to_numpy(dtype=int)
+    return pd.DataFrame({"log_row": pairs["log_row"].to_numpy(dtype=int),
+                         "case_id": case_ids[rows], "case_date": case_dates[rows]})
+
+
+def reconcile_case_log(log_df: pd.DataFrame, window_days: int = CASE_LOG_WINDOW_DAYS) -> dict:
+    """Match a national case-log export against the passport's cases; returns matched and unmatched frames."""
+    log = log_df.reset_index(drop=True)
+    cols = {re.sub(r"[^0-9a-z]+", "_", str(c).strip().lower()).strip("_"): c for c in log.columns}
+
+    def first(candidates):
+        return next((cols[c] for c in candidates if c in cols), None)
+
+    res_col, date_col = first(CASE_LOG_RESIDENT_COLS), first(CASE_LOG_DATE_COLS)
+    proc_cols = [cols[c] for c in CASE_LOG_PROCEDURE_COLS if c in cols]
+    if res_col is None or date_col is None or not proc_cols:
+        raise ValueError("The case log needs a resident, a date and a procedure column; found "
+                         + ", ".join(map(str, log.columns)))
+
+    roster = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    proc_map = case_log_map()
+    procedure = pd.Series(pd.NA, index=log.index, dtype="object")
+    for col in proc_cols:
+        procedure = procedure.fillna(_case_log_key(log[col]).map(proc_map))
+    # Dates are parsed one by one ("mixed"): exports and sheets mix ISO and locale formats.
+    norm = pd.DataFrame({
+        "log_row":        log.index,
+        "resident_email": _case_log_key(log[res_col]).map(_resident_index(roster)),
+        "procedure_id":   procedure,
+        "date":           pd.to_datetime(log[date_col], errors="coerce", format="mixed").dt.normalize(),
+    })
+    reason = (pd.Series("", index=log.index)
+              .mask(norm["procedure_id"].isna(), "unmapped procedure")
+              .mask(norm["date"].isna(), "unreadable date")
+              .mask(norm["resident_email"].isna(), "unknown resident"))
+    usable = norm[reason == ""]
+
+    cases = pd.DataFrame(columns=CASE_COLS).assign(case_date=pd.Series(dtype="datetime64[ns]"))
+    if not usable.empty:
+        span = (usable["date"].min() - pd.Timedelta(days=window_days),
+                usable["date"].max() + pd.Timedelta(days=window_days))
+        cases = read_cases_df(academic_year(span[0]), academic_year(span[1]))
+        cases = cases.assign(case_id=norm_id(cases["case_id"]),
+                             resident_email=cases["resident_email"].astype(str).str.strip(),
+                             procedure_id=cases["procedure_id"].astype(str).str.strip(),
+                             case_date=pd.to_datetime(cases["date"], errors="coerce", format="mixed").dt.normalize())
+        cases = cases.drop_duplicates(subset=["case_id"], keep="last")
+        cases = cases[cases["resident_email"].isin(set(usable["resident_email"]))
+                      & cases["case_date"].between(*span)]
+
+    pairs = _pair_by_date(usable, cases[["case_id", "resident_email", "procedure_id", "case_date"]], window_days)
+    matched = pairs.merge(norm, on="log_row")
+    matched = matched.assign(days_apart=(matched["date"] - matched["case_date"]).dt.days) \
+                     .rename(columns={"date": "log_date"}).sort_values("log_row", kind="stable")
+
+    reason = reason.mask((reason == "") & ~log.index.isin(pairs["log_row"]), "no passport case")
+    unmatched_log = log.assign(mapped_resident=norm["resident_email"], mapped_procedure=norm["procedure_id"],
+                               mapped_date=norm["date"], reason=reason)[reason != ""]
+    unmatched_cases = cases[~cases["case_id"].isin(pairs["case_id"])].drop(columns="case_date")
+    unmapped = log.loc[norm["procedure_id"].isna(), proc_cols[0]]
+    return {
+        "matched":         matched[["log_row", "resident_email", "procedure_id", "log_date", "case_id",
+                                    "case_date", "days_apart"]].reset_index(drop=True),
+        "unmatched_log":   unmatched_log,
+        "unmatched_cases": unmatched_cases[CASE_COLS].reset_index(drop=True),
+        "unmapped_procedures": sorted(set(norm_id(unmapped)) - {"", "nan"}),
+    }
+
+
+# ─────────────────────────────────────────────
+# BACKUPS  (incremental, local, point-in-time restore)
+# ─────────────────────────────────────────────
+# backup_tables() keeps every core table under BACKUP_DIR/<tenant>/<table>/ as
+# gzip'd JSON: a full snapshot, then one delta per run that saw a change —
+# the positions of the rows removed and the rows added with their positions,
+# so a restore rebuilds the table in its exact row order.  A change after
+# BACKUP_FULL_EVERY deltas or BACKUP_FULL_DAYS days is stored as a new full
+# snapshot instead, which bounds the chain a restore replays.  A run is cheap
+# enough for cron every few minutes:
+#   • nothing written since the last run: one Drive metadata call;
+#   • otherwise one batched read returns the reference tables whole plus the
+#     header and key column of cases and scores, and a second fetches only the
+#     rows appended to those since the last run.
+# Edits to cases or scores that leave their key column as it was (compaction
+# does this) are caught by a full re-read every BACKUP_VERIFY_SECS.
+BACKUP_VERIFY_SECS = 3600
+BACKUP_FULL_EVERY  = 288   # deltas per restore chain (a day of five-minute runs)
+BACKUP_FULL_DAYS   = 7
+BACKUP_LOCK_STALE  = 600   # seconds after which a crashed run's lock file is ignored
+
+
+def backup_dir() -> str:
+    """The current tenant's backup directory (BACKUP_DIR in secrets or the environment, default ./backups)."""
+    try:
+        base = st.secrets.get("BACKUP_DIR", "")
+    except Exception:  # no secrets file
+        base = ""
+    base = str(base or os.environ.get("BACKUP_DIR", "")).strip() or "backups"
+    return os.path.join(base, current_tenant().id)
+
+
+def backed_up_tables() -> tuple:
+    """(tables read whole on every run, append-first tables probed by their key column)."""
+    scores_name, _ = score_table()
+    reference = [SHEET_RESIDENTS, SHEET_ATTENDINGS, SHEET_SPECIALTY, SHEET_PROCEDURES, SHEET_STEPS]
+    if scores_name == SHEET_CASE_SCORES:
+        reference.append(SHEET_STEP_VERSIONS)
+    return reference, [SHEET_CASES, scores_name]
+
+
+def _row_diff(old: list, new: list) -> tuple:
+    """(positions removed from `old`, [[position, row]] added in `new`), matching rows in order by content."""
+    positions: dict = {}
+    for i, row in enumerate(old):
+        positions.setdefault(tuple(row), collections.deque()).append(i)
+    kept, added, last = set(), [], -1
+    for j, row in enumerate(new):
+        queue = positions.get(tuple(row))
+        while queue and queue[0] <= last:
+            queue.popleft()
+        if queue:
+            last = queue.popleft()
+            kept.add(last)
+        else:
+            added.append([j, row])
+    return [i for i in range(len(old)) if i not in kept], added
+
+
+def _apply_row_diff(rows: list, removed: list, added: list) -> list:
+    gone = set(removed)
+    kept = iter([row for i, row in enumerate(rows) if i not in gone])
+    added_at = {j: row for j, row in added}
+    return [added_at[j] if j in added_at else next(kept) for j in range(len(rows) - len(gone) + len(added))]
+
+
+def _sheet_rows(values: list) -> tuple:
+    """(header, rows) from a values range, every row padded to the header width."""
+    header = [str(v) for v in values[0]] if values else []
+    rows = []
+    for row in values[1:]:
+        row = [str(v) for v in row]
+        while len(row) > len(header) and row[-1] == "":
+            row.pop()
+        rows.append(row + [""] * (len(header) - len(row)))
+    return header, rows
+
+
+class BackupStore:
+    """One tenant's backup directory: per table a catalog.jsonl, the snapshot files and the latest rows."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._latest: dict = {}
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.directory, *parts)
+
+    @staticmethod
+    def _dump(path: str, payload: dict) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path + ".tmp", "wb", compresslevel=6) as f:
+            f.write(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextlib.contextmanager
+    def run_lock(self):
+        """Keep two backup runs of the same tenant from interleaving."""
+        path = self._path("backup.lock")
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(path) < BACKUP_LOCK_STALE:
+                raise RuntimeError("Another backup of this program is running.") from None
+            os.remove(path)
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+        try:
+            yield
+        finally:
+            os.remove(path)
+
+    def state(self) -> dict:
+        try:
+            with open(self._path("state.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_state(self, state: dict) -> None:
+        with open(self._path("state.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(self._path("state.json.tmp"), self._path("state.json"))
+
+    def catalog(self, table: str) -> list:
+        try:
+            with open(self._path(table, "catalog.jsonl"), encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def rows_at(self, table: str, at=None):
+        """(header, rows, catalog entry) of `table` as of `at` (UTC; default latest), or None before its first snapshot."""
+        entries = self.catalog(table)
+        if at is not None:
+            at = pd.Timestamp(at)
+            at = at.tz_localize("UTC") if at.tzinfo is None else at.tz_convert("UTC")
+            entries = [e for e in entries if pd.Timestamp(e["taken_at"]) <= at]
+        fulls = [i for i, e in enumerate(entries) if e["kind"] == "full"]
+        if not fulls:
+            return None
+        header, rows = None, None
+        for entry in entries[fulls[-1]:]:
+            snap = self._load(self._path(table, entry["file"]))
+            if entry["kind"] == "full":
+                header, rows = snap["header"], snap["rows"]
+            else:
+                header, rows = snap["header"], _apply_row_diff(rows, snap["removed"], snap["added"])
+        return header, rows, entries[-1]
+
+    def latest(self, table: str):
+        """(header, rows) of the newest snapshot, from current.json.gz unless a run died before updating it."""
+        if table in self._latest:
+            return self._latest[table]
+        entries = self.catalog(table)
+        if not entries:
+            return None
+        try:
+            current = self._load(self._path(table, "current.json.gz"))
+            if current.get("seq") == entries[-1]["seq"]:
+                self._latest[table] = current["header"], current["rows"]
+                return self._latest[table]
+        except FileNotFoundError:
+            pass
+        header, rows, _ = self.rows_at(table)
+        self._latest[table] = header, rows
+        return header, rows
+
+    @staticmethod
+    def _chain_due(entries: list, taken_at: str) -> bool:
+        """True once the chain since the last full snapshot is BACKUP_FULL_EVERY deltas or BACKUP_FULL_DAYS old."""
+        last = max(i for i, e in enumerate(entries) if e["kind"] == "full")
+        age  = pd.Timestamp(taken_at) - pd.Timestamp(entries[last]["taken_at"])
+        return len(entries) - 1 - last >= BACKUP_FULL_EVERY or age >= pd.Timedelta(days=BACKUP_FULL_DAYS)
+
+    def record(self, table: str, header: list, rows: list, taken_at: str, full: bool = False,
+               appended_from: int = None) -> dict:
+        """Store `rows` as a full snapshot or as the delta from the latest one; returns what was written."""
+        entries = self.catalog(table)
+        previous = self.latest(table)
+        if previous is None or full or previous[0] != header:
+            kind, payload, added, removed = "full", {"header": header, "rows": rows}, len(rows), 0
+        else:
+            if appended_from is None:
+                gone, new = _row_diff(previous[1], rows)
+            else:
+                gone, new = [], [[j, rows[j]] for j in range(appended_from, len(rows))]
+            if not gone and not new:
+                return {"snapshot": "unchanged", "rows": len(rows), "added": 0, "removed": 0}
+            if self._chain_due(entries, taken_at):
+                kind, payload, added, removed = "full", {"header": header, "rows": rows}, len(new), len(gone)
+            else:
+                kind, payload, added, removed = "delta", {"header": header, "removed": gone, "added": new}, len(new), len(gone)
+        seq   = (entries[-1]["seq"] if entries else 0) + 1
+        entry = {"seq": seq, "taken_at": taken_at, "kind": kind, "file": f"{seq:06d}-{kind}.json.gz",
+                 "rows": len(rows), "added": added, "removed": removed}
+        # Snapshot, then catalog, then the current copy: latest() rebuilds from the
+        # catalog if a run stops in between, so a change is never recorded twice.
+        self._dump(self._path(table, entry["file"]), {**payload, "taken_at": taken_at})
+        with open(self._path(table, "catalog.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        self._dump(self._path(table, "current.json.gz"), {"seq": seq, "header": header, "rows": rows})
+        self._latest[table] = header, rows
+        return {"snapshot": kind, "rows": len(rows), "added": added, "removed": removed}
+
+
+def backup_tables(full: bool = False) -> list:
+    """Back up every core table of the current tenant into backup_dir(); one report dict per table."""
+    store = BackupStore(backup_dir())
+    with store.run_lock():
+        state = store.state()
+        sheet_key = current_tenant().sheet_key
+        reference, appended = backed_up_tables()
+        taken_at = pd.Timestamp.now(tz="UTC").isoformat()
+        now = time.time()
+        try:
+            http = get_gs_client().http_client
+            modified = http.get_file_drive_metadata(sheet_key)["modifiedTime"]
+            if not full and modified == state.get("modified"):
+                return [{"table": t, "snapshot": "unchanged", "downloaded": "none"} for t in reference + appended]
+
+            titles = {s["properties"]["title"] for s in http.fetch_sheet_metadata(sheet_key)["sheets"]}
+            verified = state.get("verified", {})
+            latest = {t: store.latest(t) for t in appended if t in titles}
+            whole = [t for t in reference if t in titles]
+            probed = [t for t in appended if t in titles and not full and latest[t] is not None
+                      and now - verified.get(t, 0) < BACKUP_VERIFY_SECS]
+            whole += [t for t in appended if t in titles and t not in probed]
+            ranges = ([gspread.utils.absolute_range_name(t) for t in whole if t in reference]
+                      + [gspread.utils.absolute_range_name(t, rng) for t in probed for rng in ("1:1", "A:A")])
+            got = iter(http.values_batch_get(sheet_key, ranges)["valueRanges"] if ranges else [])
+            fetched = {t: _sheet_rows(next(got).get("values", [])) for t in whole if t in reference}
+
+            # Append-first tables: unchanged if header and keys match, just the
+            # new tail if the old keys are a prefix, otherwise read whole.
+            tails, how = {}, {}
+            for t in probed:
+                header = [str(v) for v in (next(got).get("values") or [[]])[0]]
+                keys   = [str(r[0]) if r else "" for r in next(got).get("values", [])[1:]]
+                old_header, old_rows = latest[t]
+                old_keys = [r[0] if r else "" for r in old_rows]
+                if header != old_header or not old_keys or old_keys[-1] == "" or keys[:len(old_keys)] != old_keys:
+                    whole.append(t)
+                elif len(keys) == len(old_keys):
+                    how[t] = "keys"
+                else:
+                    width = gspread.utils.rowcol_to_a1(1, max(len(header), 1)).rstrip("1")
+                    tails[t] = gspread.utils.absolute_range_name(t, f"A{len(old_rows) + 2}:{width}")
+            second = [gspread.utils.absolute_range_name(t) for t in whole if t not in fetched] + list(tails.values())
+            got = iter(http.values_batch_get(sheet_key, second)["valueRanges"] if second else [])
+            for t in [t for t in whole if t not in fetched]:
+                fetched[t] = _sheet_rows(next(got).get("values", []))
+                verified[t] = now
+            for t in tails:
+                header, old_rows = latest[t]
+                fetched[t], how[t] = (header, old_rows + _sheet_rows([header] + next(got).get("values", []))[1]), "tail"
+        except Exception as exc:
+            raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+
+        report = []
+        for t in reference + appended:
+            if how.get(t) == "keys":
+                report.append({"table": t, "snapshot": "unchanged", "rows": len(latest[t][1]),
+                               "added": 0, "removed": 0, "downloaded": "keys"})
+            elif t not in fetched:
+                report.append({"table": t, "snapshot": "missing", "downloaded": "none"})
+            else:
+                header, rows = fetched[t]
+                tail_from = len(latest[t][1]) if how.get(t) == "tail" else None
+                report.append({"table": t, **store.record(t, header, rows, taken_at, full=full, appended_from=tail_from),
+                               "downloaded": how.get(t, "whole")})
+        store.save_state({"modified": modified, "verified": verified, "last_run": taken_at})
+        return report
+
+
+def backup_history(table=None) -> pd.DataFrame:
+    """Snapshots kept for the current tenant (one table or all), oldest first."""
+    store = BackupStore(backup_dir())
+    reference, appended = backed_up_tables()
+    rows = [{"table": t, **entry} for t in ([table] if table else reference + appended) for entry in store.catalog(t)]
+    return pd.DataFrame(rows, columns=["table", "seq", "taken_at", "kind", "rows", "added", "removed", "file"])
+
+
+def restore_table(table: str, at=None, dry_run: bool = False) -> pd.DataFrame:
+    """Rewrite `table` as it was at `at` (UTC; default: the latest backup) and return those rows."""
+    found = BackupStore(backup_dir()).rows_at(table, at)
+    if found is None:
+        raise LookupError(f"No backup of {table}" + (f" from before {at}." if at is not None else "."))
+    header, rows, _ = found
+    df = pd.DataFrame([row[:len(header)] for row in rows], columns=header)
+    if not dry_run:
+        write_sheet_df(table, df)
+        reset_derived_views()   # case and score rewrites don't reset the views themselves
+    return df
+
+
+# ─────────────────────────────────────────────
+# DATA MUTATION HELPERS
+# ─────────────────────────────────────────────
+
+def ensure_resident(email: str, name: str = "", specialty_id=None) -> None:
+    cols = ["email", "name", "specialty_id", "created_at"]
+    df   = read_sheet_df(SHEET_RESIDENTS, expected_cols=cols)
+    if email not in df["email"].values:
+        append_sheet_rows(SHEET_RESIDENTS, [{
+            "email":        email,
+            "name":         name,
+            "specialty_id": specialty_id,
+            "created_at":   datetime.datetime.utcnow().isoformat(),
+        }], cols, unique_key="email")   # also clears cache
+
+
+def ensure_attending(name: str, specialty_id: str, email: str = "") -> None:
+    cols = ["attending_id", "attending_name", "specialty_id", "email"]
+    df   = read_sheet_df(SHEET_ATTENDINGS, expected_cols=cols)
+    if name not in df["attending_name"].values:
+        att_id = "A_" + specialty_id + "_" + name.replace(" ", "_").upper()
+        append_sheet_rows(SHEET_ATTENDINGS, [{
+            "attending_id":   att_id,
+            "attending_name": name,
+            "specialty_id":   specialty_id,
+            "email":          email,
+        }], cols, unique_key="attending_name")
+
+
+def ensure_procedure(proc_id: str, proc_name: str, specialty_id: str, steps_list: list) -> None:
+    proc_cols = ["procedure_id", "procedure_name", "specialty_id"]
+    procs_df  = read_sheet_df(SHEET_PROCEDURES, expected_cols=proc_cols)
+    if proc_id not in procs_df["procedure_id"].values:
+        append_sheet_rows(SHEET_PROCEDURES, [{
+            "procedure_id":   proc_id,
+            "procedure_name": proc_name,
+            "specialty_id":   specialty_id,
+        }], proc_cols, unique_key="procedure_id")
+
+    step_cols = ["step_id", "procedure_id", "step_order", "step_name"]
+    steps_df  = read_sheet_df(SHEET_STEPS, expected_cols=step_cols)
+    if not (steps_df["procedure_id"] == proc_id).any():
+        append_sheet_rows(SHEET_STEPS, [{
+            "step_id":      f"S_{proc_id}_{i+1:02d}",
+            "procedure_id": proc_id,
+            "step_order":   i + 1,
+            "step_name":    step,
+        } for i, step in enumerate(steps_list)], step_cols, unique_key="step_id")
+
+
+def save_case(
+    resident_email: str,
+    date,
+    specialty_id: str,
+    procedure_id: str,
+    attending_id: str,
+    scores_dict: dict,
+    notes: str = "",
+    case_complexity=None,
+    overall_performance=None,
+) -> str:
+    """Persist a case + its step scores; returns the new case_id."""
+    case_id   = new_case_id()
+    if str(attending_id).startswith("magic_"):
+        # Unify magic-link submissions with the roster once, here, instead of on every read.
+        attending_id = canonical_attending_id(attending_id, attending_name_index(read_sheet_df(
+            SHEET_ATTENDINGS, expected_cols=["attending_id", "attending_name", "specialty_id", "email"])))
+
+    case_row  = {
+        "case_id":             case_id,
+        "resident_email":      resident_email,
+        "date":                str(date),
+        "specialty_id":        specialty_id,
+        "procedure_id":        procedure_id,
+        "attending_id":        attending_id,
+        "notes":               notes,
+        "case_complexity":     case_complexity,
+        "overall_performance": overall_performance,
+    }
+    append_sheet_rows(SHEET_CASES, [case_row], CASE_COLS)  # clears cache
+
+    new_rows   = [{
+        "case_id":             case_id,
+        "step_id":             step_id,
+        "rating":              rating,
+        "rating_num":          RATING_TO_NUM.get(rating),
+        "case_complexity":     case_complexity,
+        "overall_performance": overall_performance,
+    } for step_id, rating in scores_dict.items()]
+    if scores_layout() == "wide":
+        step_ids = [str(s) for s in scores_dict]
+        version  = step_version(procedure_id, step_ids)
+        register_step_versions({version: (procedure_id, step_ids)})
+        append_sheet_rows(SHEET_CASE_SCORES, [{
+            "case_id":             case_id,
+            "procedure_id":        procedure_id,
+            "step_version":        version,
+            "ratings":             encode_ratings(step_ids, scores_dict),
+            "case_complexity":     case_complexity,
+            "overall_performance": overall_performance,
+        }], WIDE_SCORE_COLS)  # clears cache
+    else:
+        append_sheet_rows(SHEET_SCORES, new_rows, SCORE_COLS)  # clears cache
+
+    advance_derived_views(case_row, new_rows)
+    return case_id
+
+
+# ─────────────────────────────────────────────
+# STEP TEMPLATES
+# ─────────────────────────────────────────────
+# A step_id names one step for good: revising a procedure keeps the IDs of
+# steps that survive (matched by name, or picked as renamed/merged by the
+# admin) and issues never-used IDs for new ones.  Each revision is appended
+# to `step_history`; `step_aliases` holds the fully resolved retired → current
+# mapping that read_scores_df() applies with one dict lookup per row.
+
+def load_step_aliases() -> dict:
+    aliases = read_sheet_df(SHEET_STEP_ALIASES, expected_cols=STEP_ALIAS_COLS)
+    return dict(zip(aliases["step_id"].astype(str).str.strip(),
+                    aliases["current_step_id"].astype(str).str.strip()))
+
+
+def apply_step_aliases(scores_df: pd.DataFrame) -> pd.DataFrame:
+    """Re-point scores of retired steps at their current step."""
+    aliases = load_step_aliases()
+    if not aliases or scores_df.empty:
+        return scores_df
+    step_ids = scores_df["step_id"].astype(str).str.strip()
+    return scores_df.assign(step_id=step_ids.map(aliases).fillna(step_ids))
+
+
+def _step_number(step_id: str) -> int:
+    match = re.search(r"_(\d+)$", str(step_id))
+    return int(match.group(1)) if match else 0
+
+
+def plan_step_revision(procedure_id: str, current_steps: pd.DataFrame, step_names: list,
+                       merges=None, used_ids=()) -> dict:
+    """Work out a template revision without writing: {"steps", "retired", "aliases", "summary"}."""
+    merges  = merges or {}
+    current = current_steps.assign(
+        step_id=current_steps["step_id"].astype(str).str.strip(),
+        step_order=pd.to_numeric(current_steps["step_order"], errors="coerce"),
+    ).sort_values("step_order")
+    by_name: dict = {}
+    for sid, name in zip(current["step_id"], current["step_name"].astype(str)):
+        by_name.setdefault(name.strip().casefold(), []).append(sid)
+
+    assigned = [None] * len(step_names)
+    for i, name in enumerate(step_names):
+        ids = by_name.get(name.strip().casefold())
+        if ids:
+            assigned[i] = ids.pop(0)
+    unmatched = [sid for sid in current["step_id"] if sid not in assigned]
+    # A dropped step listed in `merges` hands its ID to the name it became, or aliases the step that has it.
+
+    summary = {"kept": sum(a is not None for a in assigned), "renamed": 0, "added": 0,
+               "merged": 0, "retired": 0}
+    aliases = {}
+    for sid in unmatched:
+        target = merges.get(sid)
+        if target not in step_names:
+            continue
+        i = step_names.index(target)
+        if assigned[i] is None:
+            assigned[i] = sid
+            summary["renamed"] += 1
+        else:
+            aliases[sid] = assigned[i]
+            summary["merged"] += 1
+
+    next_number = max([_step_number(s) for s in [*used_ids, *current["step_id"]]] + [0]) + 1
+    for i in range(len(assigned)):
+        if assigned[i] is None:
+            assigned[i] = f"S_{procedure_id}_{next_number:02d}"
+            next_number += 1
+            summary["added"] += 1
+
+    names_of = dict(zip(current["step_id"], current["step_name"]))
+    retired  = [(sid, names_of.get(sid, ""), aliases.get(sid, "")) for sid in unmatched if sid not in assigned]
+    summary["retired"] = sum(1 for _, _, to in retired if not to)
+    steps = pd.DataFrame([{
+        "step_id":      sid,
+        "procedure_id": procedure_id,
+        "step_order":   i + 1,
+        "step_name":    name,
+    } for i, (sid, name) in enumerate(zip(assigned, step_names))])
+    return {"steps": steps, "retired": retired, "aliases": aliases, "summary": summary}
+
+
+def revise_procedure_steps(procedure_id: str, step_names: list, merges=None) -> dict:
+    """Replace a procedure's step template, keeping stable step IDs; returns the summary counts."""
+    with locked_tables(SHEET_STEPS, SHEET_STEP_HISTORY, SHEET_STEP_ALIASES):
+        step_cols = ["step_id", "procedure_id", "step_order", "step_name"]
+        steps_df  = read_sheet_df(SHEET_STEPS, expected_cols=step_cols)
+        history   = read_sheet_df(SHEET_STEP_HISTORY, expected_cols=STEP_HISTORY_COLS)
+        alias_df  = read_sheet_df(SHEET_STEP_ALIASES, expected_cols=STEP_ALIAS_COLS)
+        in_proc   = steps_df["procedure_id"].astype(str).str.strip() == str(procedure_id)
+        current   = steps_df[in_proc]
+
+        # Never hand out an ID that any template or any stored score has used.
+        proc_history = history[history["procedure_id"].astype(str) == str(procedure_id)]
+        prefix       = f"S_{procedure_id}_"
+        scored       = read_scores_df()["step_id"].astype(str)
+        used_ids     = [*proc_history["step_id"].astype(str), *alias_df["step_id"].astype(str),
+                        *scored[scored.str.startswith(prefix)].unique()]
+        plan = plan_step_revision(procedure_id, current, step_names, merges, used_ids)
+
+        now     = datetime.datetime.utcnow().isoformat()
+        version = int(pd.to_numeric(proc_history["template_version"], errors="coerce").max()) if not proc_history.empty else 0
+        new_rows = []
+        if version == 0 and not current.empty:
+            version = 1
+            new_rows += [{**row, "template_version": 1, "maps_to": row["step_id"], "revised_at": now}
+                         for row in current[step_cols].to_dict("records")]
+        version += 1
+        new_rows += [{**row, "template_version": version, "maps_to": row["step_id"], "revised_at": now}
+                     for row in plan["steps"].to_dict("records")]
+        new_rows += [{"procedure_id": procedure_id, "template_version": version, "step_id": sid,
+                      "step_order": "", "step_name": name, "maps_to": to, "revised_at": now}
+                     for sid, name, to in plan["retired"]]
+
+        # Resolve aliases transitively: anything that pointed at a step retired now
+        # follows it to its replacement, or is dropped if the step simply went away.
+        retired_to = {sid: to for sid, _, to in plan["retired"]}
+        resolved   = {}
+        for sid, cur in load_step_aliases().items():
+            cur = retired_to.get(cur, cur)
+            if cur:
+                resolved[sid] = cur
+        resolved.update(plan["aliases"])
+        proc_of  = dict(zip(alias_df["step_id"].astype(str).str.strip(), alias_df["procedure_id"]))
+        alias_df = pd.DataFrame([{"step_id": sid, "procedure_id": proc_of.get(sid, procedure_id), "current_step_id": cur}
+                                 for sid, cur in resolved.items()], columns=STEP_ALIAS_COLS)
+
+        write_sheet_df(SHEET_STEP_HISTORY, pd.concat([history, pd.DataFrame(new_rows)], ignore_index=True))
+        write_sheet_df(SHEET_STEP_ALIASES, alias_df)
+        write_sheet_df(SHEET_STEPS, pd.concat([steps_df[~in_proc], plan["steps"]], ignore_index=True))
+        return plan["summary"]
+
+
+# ─────────────────────────────────────────────
+# DERIVED VIEWS  (built once, advanced per saved case)
+# ─────────────────────────────────────────────
+DERIVED_VIEW_MAX_AGE = 3600  # seconds; a full rebuild also picks up edits made outside the app
+TABLE_VERSION_TTL    = 5     # seconds a spreadsheet's modifiedTime is trusted before asking Drive again
+
+
+def _derived_views() -> dict:
+    """The current tenant's store of incrementally maintained views, kept apart from the read caches."""
+    return _tenant_resource("derived_views", lambda: {"lock": threading.RLock(), "views": {}})
+
+
+def get_derived_view(name: str):
+    """Return the named view, building it from the sheets on first use."""
+    state = _derived_views()
+    with state["lock"]:
+        entry = state["views"].get(name)
+        if entry is None or time.time() - entry["built_at"] > DERIVED_VIEW_MAX_AGE:
+            entry = {"view": DERIVED_VIEWS[name].build(), "built_at": time.time()}
+            state["views"][name] = entry
+        return entry["view"]
+
+
+def table_version() -> str:
+    """When the current tenant's spreadsheet last changed (Drive modifiedTime, asked every TABLE_VERSION_TTL s)."""
+    state = _tenant_resource("table_version", lambda: {"lock": threading.Lock(), "checked": 0.0, "modified": None})
+    with state["lock"]:
+        if time.monotonic() - state["checked"] < TABLE_VERSION_TTL:
+            return state["modified"]
+        try:
+            http = get_gs_client().http_client
+            modified = str(http.get_file_drive_metadata(current_tenant().sheet_key)["modifiedTime"])
+        except Exception as exc:
+            raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
+        changed = state["modified"] not in (None, modified)
+        state["modified"], state["checked"] = modified, time.monotonic()
+    if changed:
+        clear_read_caches()
+        reset_derived_views()
+    return modified
+
+
+def advance_derived_views(case_row: dict, score_rows: list) -> None:
+    """Fold a newly saved case into every view that has already been built."""
+    state = _derived_views()
+    with state["lock"]:
+        for name, entry in list(state["views"].items()):
+            try:
+                entry["view"].add_case(case_row, score_rows)
+            except Exception:
+                # Never fail a save over a derived view — drop it and rebuild on next read.
+                state["views"].pop(name, None)
+
+
+def _view_read(method):
+    """Run a view's read method under the store lock: saves on other sessions advance views in place."""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with _derived_views()["lock"]:
+            return method(self, *args, **kwargs)
+    return locked
+
+
+def reset_derived_views() -> None:
+    state = _derived_views()
+    with state["lock"]:
+        state["views"].clear()
+
+
+def join_scores_cases(cases_df: pd.DataFrame, scores_df: pd.DataFrame,
+                      steps_df: pd.DataFrame, atnds_df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorised scores × cases × steps join, one row per (case_id, step_id)."""
+    cases = cases_df.copy()
+    cases["case_id"] = norm_id(cases["case_id"])
+    cases = cases.drop_duplicates(subset=["case_id"], keep="last")
+
+    scores = scores_df[["case_id", "step_id", "rating"]].copy()
+    scores["case_id"] = norm_id(scores["case_id"])
+    scores["step_id"] = scores["step_id"].astype(str).str.strip()
+    scores = scores.drop_duplicates(subset=["case_id", "step_id"], keep="first")
+    scores["rating_num"] = scores["rating"].map(RATING_TO_NUM).astype(float)
+
+    atnds_lookup = dict(zip(atnds_df["attending_id"].astype(str), atnds_df["attending_name"].astype(str)))
+    att_ids = cases["attending_id"].astype(str)
+    cases["attending_name"] = att_ids.map(
+        {aid: attending_display_name(aid, atnds_lookup) for aid in att_ids.unique()}
+    )
+    cases["date"] = pd.to_datetime(cases["date"], errors="coerce")
+
+    steps = steps_df[["step_id", "step_name", "step_order"]].copy()
+    steps["step_id"] = steps["step_id"].astype(str).str.strip()
+    steps = steps.drop_duplicates(subset=["step_id"])
+
+    joined = scores.merge(
+        cases[["case_id", "resident_email", "date", "procedure_id", "attending_id",
+               "attending_name", "case_complexity", "overall_performance"]],
+        on="case_id", how="inner",
+    )
+    return joined.merge(steps, on="step_id", how="left")
+
+
+def cohort_aggregates(joined: pd.DataFrame) -> dict:
+    """Per-(procedure, step) cohort statistics from a joined frame."""
+    keys  = ["procedure_id", "step_id"]
+    rated = joined[joined["rating_num"] >= 0]
+
+    procedures = joined.groupby("procedure_id").agg(
+        cases=("case_id", "nunique"),
+        residents=("resident_email", "nunique"),
+        attendings=("attending_name", "nunique"),
+    ).reset_index()
+
+    g = rated.groupby(keys)["rating_num"]
+    pct = g.quantile([0.25, 0.5, 0.75, 0.9]).unstack().reindex(columns=[0.25, 0.5, 0.75, 0.9])
+    pct.columns = ["p25", "median", "p75", "p90"]
+    steps = pd.concat([
+        g.size().rename("ratings"),
+        rated.groupby(keys)["resident_email"].nunique().rename("residents"),
+        pct,
+    ], axis=1)
+
+    # Time to first "Auto": case number and days since the resident's first case
+    # of that procedure, taken at the earliest Auto rating per (resident, step).
+    seq = (joined[["case_id", "resident_email", "procedure_id", "date"]]
+           .drop_duplicates(subset=["case_id"])
+           .sort_values("date", kind="stable"))
+    seq_keys = ["resident_email", "procedure_id"]
+    seq["case_no"] = seq.groupby(seq_keys).cumcount() + 1
+    seq["days_in"] = (seq["date"] - seq.groupby(seq_keys)["date"].transform("min")).dt.days
+    auto = joined.loc[joined["rating"] == "Auto", ["case_id", "resident_email"] + keys].merge(
+        seq[["case_id", "case_no", "days_in"]], on="case_id"
+    )
+    first_auto = auto.groupby(["resident_email"] + keys)[["case_no", "days_in"]].min().reset_index()
+    steps = steps.join(first_auto.groupby(keys).agg(
+        reached_auto=("resident_email", "nunique"),
+        median_cases_to_auto=("case_no", "median"),
+        median_days_to_auto=("days_in", "median"),
+    ), how="left")
+    steps["reached_auto"] = steps["reached_auto"].fillna(0).astype(int)
+    steps["pct_reached_auto"] = steps["reached_auto"] / steps["residents"]
+
+    step_meta = joined[["step_id", "step_name", "step_order"]].drop_duplicates(subset=["step_id"])
+    steps = steps.reset_index().merge(step_meta, on="step_id", how="left")
+
+    by_attending = rated.groupby(keys + ["attending_name"])["rating_num"].agg(
+        ratings="size", mean="mean", median="median",
+    ).reset_index()
+    by_complexity = rated.groupby(keys + ["case_complexity"])["rating_num"].agg(
+        ratings="size", mean="mean", median="median",
+    ).reset_index()
+
+    return {
+        "procedures":    procedures,
+        "steps":         steps,
+        "by_attending":  by_attending,
+        "by_complexity": by_complexity,
+    }
+
+
+class AnalyticsCube:
+    """Program-wide aggregates over the scores × cases join; a saved case re-aggregates only its procedure."""
+
+    def __init__(self, joined: pd.DataFrame, steps_df: pd.DataFrame, atnds_df: pd.DataFrame):
+        self.joined   = joined
+        self.steps_df = steps_df
+        self.atnds_df = atnds_df
+        self.tables: dict = {}
+        self._refresh(joined["procedure_id"].dropna().unique().tolist())
+
+    @classmethod
+    def build(cls):
+        cases_df  = read_cases_df()
+        scores_df = read_scores_df()
+        _, _, steps_df, atnds_df = load_refs()
+        return cls(join_scores_cases(cases_df, scores_df, steps_df, atnds_df), steps_df, atnds_df)
+
+    def add_case(self, case_row: dict, score_rows: list) -> None:
+        new = join_scores_cases(
+            pd.DataFrame([case_row]), pd.DataFrame(score_rows, columns=SCORE_COLS),
+            self.steps_df, self.atnds_df,
+        )
+        self.joined = pd.concat([self.joined, new], ignore_index=True)
+        self._refresh([case_row["procedure_id"]])
+
+    def _refresh(self, procedure_ids: list) -> None:
+        fresh = cohort_aggregates(self.joined[self.joined["procedure_id"].isin(procedure_ids)])
+        for name, df in fresh.items():
+            old = self.tables.get(name)
+            if old is not None:
+                kept = old[~old["procedure_id"].isin(procedure_ids)]
+                df = pd.concat([kept, df], ignore_index=True) if not kept.empty else df
+            self.tables[name] = df
+
+
+_TOKEN_RE  = re.compile(r"[a-z0-9]+")
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+
+
+def tokenize(text: str) -> list:
+    """Lower-case alphanumeric terms; shared by indexing and querying."""
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+class CommentIndex:
+    """Inverted index over cases.notes with BM25 ranking."""
+
+    K1, B = 1.2, 0.75
+
+    def __init__(self, atnds_df: pd.DataFrame):
+        self.atnds_lookup = dict(zip(atnds_df["attending_id"].astype(str), atnds_df["attending_name"].astype(str)))
+        self.postings: dict = {}
+        self.docs: dict = {}
+        self.total_len = 0
+
+    @classmethod
+    def build(cls):
+        cases_df = read_cases_df()
+        _, _, _, atnds_df = load_refs()
+        index = cls(atnds_df)
+        cases_df = cases_df.assign(case_id=norm_id(cases_df["case_id"]))
+        for rec in cases_df.to_dict("records"):
+            index.add(rec)
+        return index
+
+    def add_case(self, case_row: dict, score_rows: list) -> None:
+        self.add(case_row)
+
+    def add(self, case_row: dict) -> None:
+        case_id = _clean_id(case_row.get("case_id", ""))
+        notes   = case_row.get("notes")
+        if case_id in self.docs:
+            self.remove(case_id)         # duplicate rows: last write wins
+        if not case_id or case_id == "nan" or not isinstance(notes, str) or not notes.strip():
+            return
+        terms = tokenize(notes)
+        self.docs[case_id] = {
+            "case_id":        case_id,
+            "resident_email": str(case_row.get("resident_email", "")).strip(),
+            "procedure_id":   str(case_row.get("procedure_id", "")),
+            "attending_name": attending_display_name(str(case_row.get("attending_id", "")), self.atnds_lookup),
+            "date":           pd.to_datetime(case_row.get("date"), errors="coerce"),
+            "notes":          notes,
+            "text":           f" {' '.join(terms)} ",   # normalised, for phrase matching
+            "length":         len(terms),
+        }
+        self.total_len += len(terms)
+        for term in terms:
+            posting = self.postings.setdefault(term, {})
+            posting[case_id] = posting.get(case_id, 0) + 1
+
+    def remove(self, case_id: str) -> None:
+        doc = self.docs.pop(case_id, None)
+        if doc is None:
+            return
+        self.total_len -= doc["length"]
+        for term in set(doc["text"].split()):
+            posting = self.postings.get(term, {})
+            posting.pop(case_id, None)
+            if not posting:
+                self.postings.pop(term, None)
+
+    @_view_read
+    def search(self, query: str = "", residents=None, procedure_ids=None, attendings=None,
+               date_from=None, date_to=None) -> pd.DataFrame:
+        """Ranked matches with optional filters; quoted phrases match verbatim, no query lists all newest first."""
+        phrases = [" ".join(tokenize(p)) for p in _PHRASE_RE.findall(query)]
+        terms   = list(dict.fromkeys(tokenize(query)))
+
+        if terms:
+            n_docs  = max(len(self.docs), 1)
+            avg_len = self.total_len / n_docs if self.docs else 1.0
+            scores: dict = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for case_id, tf in posting.items():
+                    norm = self.K1 * (1 - self.B + self.B * self.docs[case_id]["length"] / avg_len)
+                    scores[case_id] = scores.get(case_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        else:
+            scores = dict.fromkeys(self.docs, 0.0)
+
+        rows = []
+        for case_id, score in scores.items():
+            doc = self.docs[case_id]
+            if residents and doc["resident_email"] not in residents:
+                continue
+            if procedure_ids and doc["procedure_id"] not in procedure_ids:
+                continue
+            if attendings and doc["attending_name"] not in attendings:
+                continue
+            if date_from is not None and not (doc["date"] >= pd.Timestamp(date_from)):
+                continue
+            if date_to is not None and not (doc["date"] <= pd.Timestamp(date_to)):
+                continue
+            if phrases and not all(f" {p} " in doc["text"] for p in phrases):
+                continue
+            rows.append({**doc, "score": score})
+
+        cols = ["case_id", "resident_email", "procedure_id", "attending_name", "date", "notes", "score"]
+        if not rows:
+            return pd.DataFrame(columns=cols)
+        return (pd.DataFrame(rows)[cols]
+                  .sort_values(["score", "date"], ascending=[False, False], na_position="last")
+                  .reset_index(drop=True))
+
+
+class AttendingIndex:
+    """Canonical attending → the cases they evaluated."""
+
+    FIELDS = ["case_id", "resident_email", "date", "procedure_id",
+              "case_complexity", "overall_performance", "notes"]
+
+    def __init__(self, atnds_df: pd.DataFrame):
+        self.by_name  = attending_name_index(atnds_df)
+        self.names    = dict(zip(atnds_df["attending_id"].astype(str).str.strip(),
+                                 atnds_df["attending_name"].astype(str)))
+        self.cases: dict = {}   # attending key → {case_id: record}
+
+    @classmethod
+    def build(cls):
+        cases_df = read_cases_df()
+        _, _, _, atnds_df = load_refs()
+        index = cls(atnds_df)
+        cases_df = cases_df.assign(case_id=norm_id(cases_df["case_id"]))
+        for rec in cases_df.to_dict("records"):
+            index.add(rec)
+        return index
+
+    def add_case(self, case_row: dict, score_rows: list) -> None:
+        self.add(case_row)
+
+    def add(self, case_row: dict) -> None:
+        case_id = _clean_id(case_row.get("case_id", ""))
+        raw_id  = str(case_row.get("attending_id", "")).strip()
+        if not case_id or raw_id in _BLANK_IDS:
+            return
+        key = canonical_attending_id(raw_id, self.by_name)
+        self.names.setdefault(key, attending_display_name(key, self.names))
+        record = {f: case_row.get(f) for f in self.FIELDS}
+        record["case_id"] = case_id
+        self.cases.setdefault(key, {})[case_id] = record
+
+    @_view_read
+    def attendings(self) -> pd.DataFrame:
+        """attending_key, attending_name, evaluations — busiest first."""
+        rows = [{"attending_key": k, "attending_name": self.names.get(k, k), "evaluations": len(v)}
+                for k, v in self.cases.items()]
+        return (pd.DataFrame(rows, columns=["attending_key", "attending_name", "evaluations"])
+                  .sort_values(["evaluations", "attending_name"], ascending=[False, True], ignore_index=True))
+
+    @_view_read
+    def evaluations(self, attending_key: str) -> pd.DataFrame:
+        return pd.DataFrame(list(self.cases.get(attending_key, {}).values()), columns=self.FIELDS)
+
+
+class PassportSummaries:
+    """Per (resident, procedure, step): latest meaningful rating, best rating, attempts."""
+
+    def __init__(self):
+        self.steps: dict = {}   # (resident, procedure_id) → {step_id: record}
+        self.cases: dict = {}   # (resident, procedure_id) → logged cases
+
+    @classmethod
+    def build(cls):
+        cases_df  = read_cases_df()
+        scores_df = read_scores_df()
+        view = cls()
+        # Dates are parsed once here, not per case in add_case, each in its own format
+        # as add_case would (sheets mix ISO and locale dates).
+        dates = pd.to_datetime(cases_df["date"], errors="coerce", format="mixed")
+        cases, _ = sort_by_case_id(cases_df.assign(case_id=norm_id(cases_df["case_id"]), date=dates)
+                                           .drop_duplicates(subset=["case_id"], keep="last"))
+        scores = (scores_df.assign(case_id=norm_id(scores_df["case_id"]),
+                                   step_id=scores_df["step_id"].astype(str).str.strip())
+                           .drop_duplicates(subset=["case_id", "step_id"], keep="first"))
+        by_case = {}
+        # Object arrays: iterating Arrow-backed columns value by value is slow.
+        for cid, step_id, rating in zip(*(scores[c].to_numpy(dtype=object) for c in ("case_id", "step_id", "rating"))):
+            by_case.setdefault(cid, []).append({"step_id": step_id, "rating": rating})
+        for rec in cases.astype(object).to_dict("records"):
+            view.add_case(rec, by_case.get(rec["case_id"], []))
+        return view
+
+    def add_case(self, case_row: dict, score_rows: list) -> None:
+        key  = (str(case_row.get("resident_email", "")).strip(), str(case_row.get("procedure_id", "")).strip())
+        date = case_row.get("date")
+        if not isinstance(date, pd.Timestamp):
+            date = pd.to_datetime(date, errors="coerce")
+        self.cases[key] = self.cases.get(key, 0) + 1
+        steps = self.steps.setdefault(key, {})
+        for row in score_rows:
+            rating = row.get("rating")
+            if not isinstance(rating, str) or not rating:
+                continue
+            rec = steps.setdefault(str(row.get("step_id", "")).strip(),
+                                   {"recent": None, "recent_date": pd.NaT, "best": None, "attempts": 0})
+            if rec["best"] is None or RATING_TO_NUM.get(rating, -1) > RATING_TO_NUM.get(rec["best"], -1):
+                rec["best"] = rating
+            if rating != "Not Assessed":
+                rec["attempts"] += 1
+                # Undated cases sort last in the date-descending pivot, so they count as oldest.
+                if pd.isna(rec["recent_date"]) or (not pd.isna(date) and date >= rec["recent_date"]):
+                    rec["recent"], rec["recent_date"] = rating, date
+
+    @_view_read
+    def summary_rows(self, resident: str, procedure_id: str, steps: list,
+                     labels=("📌 Most Recent", "🏆 Best")) -> pd.DataFrame:
+        """passport_summary_rows() from the view; `steps` is [(step_id, pivot column)]."""
+        recs  = self.steps.get((str(resident).strip(), str(procedure_id).strip()), {})
+        _mr   = {"date": "", "attending_name": labels[0], "case_complexity": pd.NA, "overall_performance": pd.NA}
+        _best = {"date": "", "attending_name": labels[1], "case_complexity": pd.NA, "overall_performance": pd.NA}
+        for step_id, col in steps:
+            rec = recs.get(step_id, {})
+            _mr[col]   = rec.get("recent") or pd.NA
+            _best[col] = rec.get("best") or pd.NA
+        return pd.DataFrame([_mr, _best])
+
+    @_view_read
+    def records(self, resident=None, procedure_id=None) -> pd.DataFrame:
+        """One row per rated (resident, procedure, step), optionally for one resident or procedure."""
+        rows = [
+            {"resident_email": res, "procedure_id": proc, "cases": self.cases.get((res, proc), 0), "step_id": sid,
+             "most_recent": rec["recent"], "best": rec["best"], "attempts": rec["attempts"]}
+            for (res, proc), recs in self.steps.items()
+            if (resident is None or res == str(resident).strip())
+            and (procedure_id is None or proc == str(procedure_id).strip())
+            for sid, rec in recs.items()
+        ]
+        return pd.DataFrame(rows, columns=["resident_email", "procedure_id", "cases", "step_id",
+                                           "most_recent", "best", "attempts"])
+
+    @_view_read
+    def overview(self, resident: str, steps_df: pd.DataFrame, procs_map: dict) -> list:
+        """[(procedure name, cases, [(step name, most recent, best, attempts)])] for each logged procedure."""
+        resident = str(resident).strip()
+        steps = steps_df.assign(step_order=pd.to_numeric(steps_df["step_order"], errors="coerce"),
+                                procedure_id=steps_df["procedure_id"].astype(str).str.strip(),
+                                step_id=steps_df["step_id"].astype(str).str.strip()).sort_values("step_order")
+        out = []
+        for (res, proc), n_cases in self.cases.items():
+            if res != resident:
+                continue
+            recs = self.steps.get((res, proc), {})
+            proc_steps = steps[steps["procedure_id"] == proc]
+            cells = [(name, recs.get(sid, {}).get("recent"), recs.get(sid, {}).get("best"),
+                      recs.get(sid, {}).get("attempts", 0))
+                     for sid, name in zip(proc_steps["step_id"], proc_steps["step_name"].astype(str))]
+            out.append((procs_map.get(proc, proc), n_cases, cells))
+        return sorted(out, key=lambda section: section[0])
+
+
+# Readiness: a recency- and complexity-weighted mean rating, 0–100 (Auto = 100).
+# A rating's weight halves every READINESS_HALF_LIFE_DAYS before the newest one
+# and scales with case complexity.  Weights are kept relative to a fixed epoch
+# (w·2^(days since epoch / half-life)), so a case folds in with two additions
+# in any order, backdated or not, and the ratio never needs a rescan.
+READINESS_HALF_LIFE_DAYS = 120
+READINESS_EPOCH          = pd.Timestamp("2020-01-01")
+READINESS_THRESHOLD      = 80    # ≈ a steady "Back up"
+READINESS_MIN_EVIDENCE   = 3.0   # weight of three Moderate cases rated today
+READINESS_COMPLEXITY_WEIGHT = {"Straight Forward": 0.5, "Moderate": 1.0, "Complex": 1.5}
+NUM_TO_RATING = {n: r for r, n in RATING_TO_NUM.items()}
+
+
+def readiness_rating(score) -> str:
+    """The rating nearest a readiness score — its heatmap color."""
+    return NUM_TO_RATING.get(int(round(float(score) / 20))) if pd.notna(score) else None
+
+
+class ReadinessIndex:
+    """Per (resident, procedure, step): weighted rating sums behind the readiness score."""
+
+    def __init__(self):
+        self.steps: dict = {}  # (resident, procedure_id, step_id) → [Σ w·x, Σ w, ratings, last date]
+
+    @classmethod
+    def build(cls):
+        cases_df  = read_cases_df()
+        scores_df = read_scores_df()
+        view = cls()
+        # Dates are parsed once here, not per case in add_case.
+        cases = (cases_df.assign(case_id=norm_id(cases_df["case_id"]),
+                                 date=pd.to_datetime(cases_df["date"], errors="coerce", format="mixed"))
+                         .drop_duplicates(subset=["case_id"], keep="last"))
+        scores = (scores_df.assign(case_id=norm_id(scores_df["case_id"]),
+                                   step_id=scores_df["step_id"].astype(str).str.strip())
+                           .drop_duplicates(subset=["case_id", "step_id"], keep="first"))
+        by_case = {}
+        # Object arrays: iterating Arrow-backed columns value by value is slow.
+        for cid, step_id, rating in zip(*(scores[c].to_numpy(dtype=object) for c in ("case_id", "step_id", "rating"))):
+            by_case.setdefault(cid, []).append({"step_id": step_id, "rating": rating})
+        for rec in cases.astype(object).to_dict("records"):
+            view.add_case(rec, by_case.get(rec["case_id"], []))
+        return view
+
+    def add_case(self, case_row: dict, score_rows: list) -> None:
+        date = case_row.get("date")
+        if not isinstance(date, pd.Timestamp):
+            date = pd.to_datetime(date, errors="coerce")
+        if pd.isna(date):
+            return
+        days   = (date.normalize() - READINESS_EPOCH).days
+        weight = READINESS_COMPLEXITY_WEIGHT.get(case_row.get("case_complexity"), 1.0) \
+            * 2.0 ** (days / READINESS_HALF_LIFE_DAYS)
+        resident  = str(case_row.get("resident_email", "")).strip()
+        procedure = str(case_row.get("procedure_id", "")).strip()
+        for row in score_rows:
+            num = RATING_TO_NUM.get(row.get("rating"), -1)
+            if num < 0:
+                continue
+            rec = self.steps.setdefault((resident, procedure, str(row.get("step_id", "")).strip()),
+                                        [0.0, 0.0, 0, pd.NaT])
+            rec[0] += weight * num * 20
+            rec[1] += weight
+            rec[2] += 1
+            rec[3] = date if pd.isna(rec[3]) or date > rec[3] else rec[3]
+
+    @_view_read
+    def summary_row(self, resident: str, procedure_id: str, steps: list, label: str = "🎯 Readiness") -> pd.DataFrame:
+        """One heatmap summary row of readiness scores; `steps` is [(step_id, pivot column)]."""
+        key = (str(resident).strip(), str(procedure_id).strip())
+        row = {"date": "", "attending_name": label, "case_complexity": pd.NA, "overall_performance": pd.NA}
+        for step_id, col in steps:
+            rec = self.steps.get(key + (step_id,))
+            row[col] = rec[0] / rec[1] if rec else pd.NA
+        return pd.DataFrame([row])
+
+    @_view_read
+    def table(self, procedure_id=None, resident=None) -> pd.DataFrame:
+        """Every (resident, procedure, step) with a rating: score, evidence, ratings, last rated, ready."""
+        today = 2.0 ** ((pd.Timestamp.today().normalize() - READINESS_EPOCH).days / READINESS_HALF_LIFE_DAYS)
+        rows = []
+        for (email, procedure, step_id), rec in self.steps.items():
+            if (procedure_id is not None and procedure != str(procedure_id)) or \
+                    (resident is not None and email != str(resident).strip()):
+                continue
+            score, evidence = rec[0] / rec[1], rec[1] / today
+            rows.append({"resident_email": email, "procedure_id": procedure, "step_id": step_id,
+                         "readiness": score, "evidence": evidence, "ratings": rec[2], "last_rated": rec[3],
+                         "ready": score >= READINESS_THRESHOLD and evidence >= READINESS_MIN_EVIDENCE})
+        return pd.DataFrame(rows, columns=["resident_email", "procedure_id", "step_id", "readiness",
+                                           "evidence", "ratings", "last_rated", "ready"])
+
+
+DERIVED_VIEWS = {
+    "analytics":  AnalyticsCube,
+    "comments":   CommentIndex,
+    "attendings": AttendingIndex,
+    "summaries":  PassportSummaries,
+    "readiness":  ReadinessIndex,
+}
+
+
+# ─────────────────────────────────────────────
+# PASSPORT HELPERS  (cumulative join, pivot, summary rows)
+# ─────────────────────────────────────────────
+PIVOT_META_COLS     = ["date", "attending_name", "case_id", "case_complexity", "overall_performance"]
+NEVER_ATTEMPTED_HEX = "#E0E0E0"
+
+
+def resident_passport_rows(cases_df: pd.DataFrame, scores_df: pd.DataFrame, steps_df: pd.DataFrame,
+                           atnds_df: pd.DataFrame, resident: str) -> pd.DataFrame:
+    """One resident's scores joined to case and step metadata, one row per (case, step)."""
+    atnds_lookup = {
+        str(r.get("attending_id", "")): str(r.get("attending_name", ""))
+        for _, r in atnds_df.iterrows()
+    }
+
+    # case_id → case metadata for this resident only; duplicates are last-write-wins.
+    resident_cases: dict = {}
+    for _, row in cases_df.iterrows():
+        if str(row.get("resident_email", "")).strip() != str(resident).strip():
+            continue
+        cid = _clean_id(row.get("case_id", ""))
+        if not cid or cid == "nan":
+            continue
+        aid = str(row.get("attending_id", ""))
+        resident_cases[cid] = {
+            "case_id":             cid,
+            "date":                str(row.get("date", "")),
+            "case_procedure_id":   str(row.get("procedure_id", "")),
+            "attending_name":      attending_display_name(aid, atnds_lookup),
+            "case_complexity":     row.get("case_complexity"),
+            "overall_performance": row.get("overall_performance"),
+        }
+    if not resident_cases:
+        return pd.DataFrame()
+
+    steps_lookup: dict = {}
+    for _, row in steps_df.iterrows():
+        sid = str(row.get("step_id", "")).strip()
+        if not sid or sid == "nan":
+            continue
+        steps_lookup[sid] = {
+            "step_procedure_id": str(row.get("procedure_id", "")),
+            "step_name":         str(row.get("step_name", "")),
+            "step_order":        row.get("step_order", 0),
+        }
+
+    # Walk every score row; look up case + step with dict gets — no merge needed.
+    seen_case_step: set = set()   # deduplicate (case_id, step_id) pairs
+    merged_rows: list = []
+    for _, row in scores_df.iterrows():
+        cid = _clean_id(row.get("case_id", ""))
+        if cid not in resident_cases:
+            continue
+        sid = str(row.get("step_id", "")).strip()
+        if not sid or sid == "nan":
+            continue
+        key = (cid, sid)
+        if key in seen_case_step:
+            continue
+        seen_case_step.add(key)
+        step_meta = steps_lookup.get(sid, {})
+        merged_rows.append({
+            "case_id":             cid,
+            "step_id":             sid,
+            "rating":              str(row.get("rating", "")),
+            "rating_num":          row.get("rating_num"),
+            **resident_cases[cid],
+            "step_procedure_id":   step_meta.get("step_procedure_id", ""),
+            "step_name":           step_meta.get("step_name", ""),
+            "step_order":          step_meta.get("step_order", 0),
+        })
+    return pd.DataFrame(merged_rows)
+
+
+def procedure_pivot(proc_data: pd.DataFrame, steps_df: pd.DataFrame, procedure_id: str):
+    """Heatmap pivot for one procedure: (pivot, ordered step names), a row per case, a column per step."""
+    ordered_steps = (
+        steps_df[steps_df["procedure_id"] == procedure_id]
+        .sort_values("step_order")["step_name"]
+        .tolist()
+    )
+    pivot = proc_data.pivot_table(
+        index=PIVOT_META_COLS,
+        columns="step_name",
+        values="rating",
+        aggfunc="first",
+    ).reset_index()
+
+    for step in ordered_steps:
+        if step not in pivot.columns:
+            pivot[step] = pd.NA
+    return pivot[PIVOT_META_COLS + ordered_steps], ordered_steps
+
+
+def passport_summary_rows(pivot_sorted: pd.DataFrame, ordered_steps: list,
+                          labels=("📌 Most Recent", "🏆 Best")) -> pd.DataFrame:
+    """The Most Recent and Best rows shown above the case rows of a date-descending heatmap pivot."""
+    _mr   = {"date": "", "attending_name": labels[0], "case_complexity": pd.NA, "overall_performance": pd.NA}
+    _best = {"date": "", "attending_name": labels[1], "case_complexity": pd.NA, "overall_performance": pd.NA}
+    for _s in ordered_steps:
+        _vals = pivot_sorted[_s].dropna()
+        _meaningful = _vals[_vals != "Not Assessed"]
+        _mr[_s] = _meaningful.iloc[0] if not _meaningful.empty else pd.NA
+        _best[_s] = max(_vals.tolist(), key=lambda v: RATING_TO_NUM.get(v, -1)) if not _vals.empty else pd.NA
+    return pd.DataFrame([_mr, _best])
+
+
+def resident_passport_sections(merged: pd.DataFrame, steps_df: pd.DataFrame, procs_map: dict) -> list:
+    """(procedure name, pivot, ordered_steps) for every procedure the resident has logged."""
+    sections = []
+    proc_ids = merged["case_procedure_id"].dropna().unique()
+    for proc_id in sorted(proc_ids, key=lambda x: procs_map.get(x, x)):
+        pivot, ordered_steps = procedure_pivot(
+            merged[merged["case_procedure_id"] == proc_id], steps_df, proc_id
+        )
+        sections.append((procs_map.get(proc_id, proc_id), pivot, ordered_steps))
+    return sections
+
+
+# ─────────────────────────────────────────────
+# PASSPORT EXPORT  (server-rendered PDF / PNG)
+# ─────────────────────────────────────────────
+PASSPORT_ROWS_PER_PAGE = 40
+
+
+def _passport_grid(pivot: pd.DataFrame, ordered_steps: list):
+    """Rows to draw (summary rows first, then cases newest-first) and their cell colours."""
+    pivot_sorted = pivot.sort_values("date", ascending=False)
+    summary = passport_summary_rows(pivot_sorted, ordered_steps, labels=("Most Recent", "Best"))
+    rows = pd.concat([summary, pivot_sorted.drop(columns=["case_id"])], ignore_index=True)
+
+    ratings = rows[ordered_steps]
+    colors  = ratings.map(lambda v: RATING_HEX.get(v, NEVER_ATTEMPTED_HEX))
+    data    = ratings.iloc[2:]
+    for s in ordered_steps:
+        if not (data[s].notna() & (data[s] != "Not Assessed")).any():
+            colors.loc[:1, s] = NEVER_ATTEMPTED_HEX
+            colors.loc[ratings[s] == "Not Assessed", s] = NEVER_ATTEMPTED_HEX
+
+    colors.insert(0, "overall_performance",
+                  rows["overall_performance"].astype(str).str.split("-").str[0].str.strip()
+                  .map(O_SCORE_HEX).fillna("#FFFFFF"))
+    colors.insert(0, "case_complexity", rows["case_complexity"].map(COMPLEXITY_HEX).fillna("#FFFFFF"))
+    return rows, colors
+
+
+def passport_figures(title: str, pivot: pd.DataFrame, ordered_steps: list, subtitle: str = "",
+                     rows_per_page=PASSPORT_ROWS_PER_PAGE) -> list:
+    """Draw one procedure's heatmap and legends as matplotlib Figures, one per page (or one with None)."""
+    rows, colors = _passport_grid(pivot, ordered_steps)
+    summary, cases = rows.iloc[:2], rows.iloc[2:]
+    summary_c, cases_c = colors.iloc[:2], colors.iloc[2:]
+    per_page = rows_per_page or max(len(cases), 1)
+    chunks = [slice(i, i + per_page) for i in range(0, max(len(cases), 1), per_page)]
+
+    hex_rgb = {h: matplotlib.colors.to_rgb(h) for h in pd.unique(colors.values.ravel())}
+    headers = ["Case Complexity", "Overall Performance"] + [
+        s if len(s) <= 42 else s[:41] + "…" for s in ordered_steps
+    ]
+    n_cols = len(headers)
+    unit, row_h = 0.3, 0.24                           # inches per cell column / row
+    meta_units  = 9.5                                 # Date + Attending columns, in cell units
+    header_h, top_h, legend_h = 2.0, 0.6, 1.0
+
+    figures = []
+    for page_no, chunk in enumerate(chunks, start=1):
+        page_rows   = pd.concat([summary, cases.iloc[chunk]])
+        page_colors = pd.concat([summary_c, cases_c.iloc[chunk]])
+        n_rows  = len(page_rows)
+        grid_w  = (meta_units + n_cols) * unit
+        grid_h  = n_rows * row_h
+        fig_w   = max(grid_w + 0.8, 8.5)
+        fig_h   = top_h + header_h + grid_h + legend_h
+        fig = Figure(figsize=(fig_w, fig_h))
+        ax  = fig.add_axes([0.4 / fig_w, (legend_h) / fig_h, grid_w / fig_w, grid_h / fig_h])
+
+        rgb = np.array([[hex_rgb[h] for h in r] for r in page_colors.values.tolist()])
+        ax.imshow(rgb, extent=(0, n_cols, n_rows, 0), aspect="auto", interpolation="nearest")
+        ax.set_xlim(-meta_units, n_cols)
+        ax.set_ylim(n_rows, 0)
+        ax.axis("off")
+
+        ax.hlines(range(n_rows + 1), -meta_units, n_cols, colors="#bbbbbb", linewidth=0.4)
+        ax.vlines(range(n_cols + 1), 0, n_rows, colors="#bbbbbb", linewidth=0.4)
+        ax.hlines([0, 2, n_rows], -meta_units, n_cols, colors="#555555", linewidth=1.2)
+        ax.vlines([-meta_units, 0, n_cols], 0, n_rows, colors="#555555", linewidth=1.2)
+
+        for label, x in (("Date", -meta_units + 0.2), ("Attending", -6.3)):
+            ax.text(x, -0.2, label, fontsize=7, fontweight="bold", va="bottom", clip_on=False)
+        for j, hdr in enumerate(headers):
+            ax.text(j + 0.5, -0.2, hdr, rotation=90, fontsize=6.5, ha="center", va="bottom", clip_on=False)
+
+        for i, (_, r) in enumerate(page_rows.iterrows()):
+            if i < 2:
+                ax.text(-0.2, i + 0.5, r["attending_name"], fontsize=7, fontweight="bold",
+                        ha="right", va="center")
+                continue
+            ax.text(-meta_units + 0.2, i + 0.5, fmt_date(r["date"]), fontsize=6.5, va="center")
+            ax.text(-6.3, i + 0.5, str(r["attending_name"])[:34], fontsize=6.5, va="center")
+
+        page_tag = f"   (page {page_no} of {len(chunks)})" if len(chunks) > 1 else ""
+        fig.text(0.4 / fig_w, 1 - 0.25 / fig_h, f"{title} — Progress Heatmap{page_tag}",
+                 fontsize=12, fontweight="bold", va="top")
+        if subtitle:
+            fig.text(0.4 / fig_w, 1 - 0.5 / fig_h, subtitle, fontsize=8, color="#555555", va="top")
+
+        rating_handles = [
+            matplotlib.patches.Patch(facecolor=v, edgecolor="#aaaaaa" if k == "Not Assessed" else v, label=k)
+            for k, v in RATING_HEX.items()
+        ] + [matplotlib.patches.Patch(facecolor=NEVER_ATTEMPTED_HEX, label="Never Attempted")]
+        complexity_handles = [matplotlib.patches.Patch(facecolor=v, label=k) for k, v in COMPLEXITY_HEX.items()]
+        fig.legend(handles=rating_handles, title="Ratings", loc="lower left", ncol=4, fontsize=6.5,
+                   title_fontsize=7, frameon=False, bbox_to_anchor=(0.3 / fig_w, 0.02))
+        fig.legend(handles=complexity_handles, title="Case Complexity", loc="lower right", ncol=1,
+                   fontsize=6.5, title_fontsize=7, frameon=False, bbox_to_anchor=(1 - 0.3 / fig_w, 0.02))
+        figures.append(fig)
+    return figures
+
+
+def passport_pdf(sections: list, subtitle: str = "") -> bytes:
+    """Paginated PDF of every (title, pivot, ordered_steps) section, one procedure after another."""
+    buf = io.BytesIO()
+    with matplotlib.backends.backend_pdf.PdfPages(buf) as pdf:
+        for title, pivot, ordered_steps in sections:
+            for fig in passport_figures(title, pivot, ordered_steps, subtitle=subtitle):
+                pdf.savefig(fig)
+    return buf.getvalue()
+
+
+def passport_png(title: str, pivot: pd.DataFrame, ordered_steps: list, subtitle: str = "",
+                 dpi: int = 200) -> bytes:
+    """Single high-resolution PNG of one procedure's full heatmap and legends."""
+    fig = passport_figures(title, pivot, ordered_steps, subtitle=subtitle, rows_per_page=None)[0]
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=dpi)
+    return buf.getvalue()
+
+
+def passport_export(tenant_id: str, resident: str, data_version: str, fmt: str, sections: list,
+                    subtitle: str = "") -> bytes:
+    """Cached PDF/PNG export keyed by resident, content version and format, 64 per tenant."""
+    def build():
+        if fmt == "png":
+            title, pivot, ordered_steps = sections[0]
+            return passport_png(title, pivot, ordered_steps, subtitle=subtitle)
+        return passport_pdf(sections, subtitle=subtitle)
+    return _tenant_lru("passport_exports", (resident, data_version, fmt, subtitle), build,
+                       max_entries=64, tenant_id=tenant_id)
+
+
+# ─────────────────────────────────────────────
+# LEARNING CURVES
+# ─────────────────────────────────────────────
+
+def learning_curve_frames(proc_data: pd.DataFrame, ordered_steps: list, window: int = 3):
+    """(steps_wide, overall): per-step rolling means over rated cases and rolling overall performance."""
+    df = proc_data[["case_id", "date", "step_name", "rating"]].copy()
+    df["date"]       = pd.to_datetime(df["date"], errors="coerce")
+    df["rating_num"] = df["rating"].map(RATING_TO_NUM).astype(float)
+    df.loc[df["rating_num"] < 0, "rating_num"] = np.nan
+
+    wide = (df.pivot_table(index=["date", "case_id"], columns="step_name",
+                           values="rating_num", aggfunc="first", dropna=False)
+              .reindex(columns=ordered_steps)
+              .sort_index())
+    # Roll over each step's own rated cases, then re-align onto the case timeline.
+    steps_wide = wide.apply(lambda col: col.dropna().rolling(window, min_periods=1).mean()
+                            .reindex(col.index))
+
+    cases = (proc_data[["case_id", "date", "overall_performance"]]
+             .drop_duplicates(subset=["case_id"])
+             .assign(date=lambda d: pd.to_datetime(d["date"], errors="coerce"))
+             .sort_values(["date", "case_id"]))
+    o_num = pd.to_numeric(cases["overall_performance"].astype(str).str.extract(r"^\s*(\d)")[0],
+                          errors="coerce")
+    overall = pd.DataFrame({
+        "date":    cases["date"].values,
+        "score":   o_num.values,
+        "rolling": o_num.rolling(window, min_periods=1).mean().values,
+    })
+    return steps_wide, overall
+
+
+def learning_curve_png(tenant_id: str, resident: str, procedure_id: str, data_version: str, window: int,
+                       proc_data: pd.DataFrame, ordered_steps: list, title: str = "") -> bytes:
+    """Render the learning-curve chart to PNG bytes (cached per resident, procedure, version and window)."""
+    return _tenant_lru("learning_curves", (resident, procedure_id, data_version, window, title),
+                       lambda: _render_learning_curve(procedure_id, window, proc_data, ordered_steps, title),
+                       max_entries=256, tenant_id=tenant_id)
+
+
+def _render_learning_curve(procedure_id: str, window: int, proc_data: pd.DataFrame, ordered_steps: list,
+                           title: str) -> bytes:
+    steps_wide, overall = learning_curve_frames(proc_data, ordered_steps, window)
+    dates = steps_wide.index.get_level_values("date")
+
+    fig = Figure(figsize=(11, 7.5), dpi=110, constrained_layout=True)
+    ax_steps, ax_o = fig.subplots(2, 1, sharex=True, gridspec_kw={"height_ratios": [3, 1.3]})
+
+    colors = [matplotlib.colormaps["tab20"](i % 20) for i in range(len(ordered_steps))]
+    for i, step in enumerate(ordered_steps):
+        series = steps_wide[step]
+        mask = series.notna().values
+        if not mask.any():
+            continue
+        ax_steps.plot(dates[mask], series.values[mask], marker="o", markersize=3,
+                      linewidth=1.6, color=colors[i], label=f"{i + 1}. {step}")
+    _scale = [r for r in RATING_OPTIONS if RATING_TO_NUM[r] >= 0]
+    ax_steps.set_yticks([RATING_TO_NUM[r] for r in _scale], _scale)
+    ax_steps.set_ylim(-0.3, 5.3)
+    ax_steps.set_ylabel(f"Rolling rating ({window} cases)")
+    ax_steps.grid(axis="y", alpha=0.3)
+    if ax_steps.lines:
+        ax_steps.legend(loc="upper left", bbox_to_anchor=(1.01, 1.0), fontsize=7, frameon=False)
+    ax_steps.set_title(title or procedure_id, loc="left", fontsize=12, fontweight="bold")
+
+    o_mask = overall["score"].notna().values
+    ax_o.scatter(overall["date"][o_mask], overall["score"][o_mask], s=14, color="#9E9E9E",
+                 label="Case score")
+    ax_o.plot(overall["date"][o_mask], overall["rolling"][o_mask], color="#33CC33",
+              linewidth=2, label=f"Rolling ({window} cases)")
+    ax_o.set_yticks([1, 2, 3, 4, 5])
+    ax_o.set_ylim(0.6, 5.4)
+    ax_o.set_ylabel("Overall performance")
+    ax_o.grid(axis="y", alpha=0.3)
+    ax_o.legend(loc="upper left", bbox_to_anchor=(1.01, 1.0), fontsize=7, frameon=False)
+    fig.autofmt_xdate()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+# ─────────────────────────────────────────────
+# EXCEL EXPORT
+# ─────────────────────────────────────────────
+EXCEL_RATING_FILL = {k: v.lstrip("#") for k, v in RATING_HEX.items() if k not in ("Not Assessed",)}
+EXCEL_RATING_FILL["Not Assessed"] = "E0E0E0"  # light gray in Excel
+
+
+def write_cumulative_sheet(writer: pd.ExcelWriter, pivot: pd.DataFrame, ordered_steps: list,
+                           sheet_name: str = "Cumulative") -> None:
+    """Write one procedure's pivot to `writer` with step cells filled in rating colours."""
+    # Rename pivot columns for readability; fix 1: date as MM-DD-YYYY
+    pivot_excel = pivot.copy()
+    pivot_excel["date"] = pivot_excel["date"].apply(fmt_date)
+    pivot_excel = pivot_excel.rename(columns={
+        "date":                "Date",
+        "attending_name":      "Attending",
+        "case_id":             "Case ID",
+        "case_complexity":     "Case Complexity",
+        "overall_performance": "Overall Performance",
+    })
+    pivot_excel.to_excel(writer, index=False, sheet_name=sheet_name)
+    ws_xl = writer.sheets[sheet_name]
+
+    start_col = 6
+    for xl_row in ws_xl.iter_rows(
+        min_row=2, max_row=ws_xl.max_row,
+        min_col=start_col, max_col=5 + len(ordered_steps),
+    ):
+        for cell in xl_row:
+            val = cell.value
+            if val in EXCEL_RATING_FILL:
+                cell.fill = PatternFill(
+                    start_color=EXCEL_RATING_FILL[val],
+                    end_color=EXCEL_RATING_FILL[val],
+                    fill_type="solid",
+                )
+                cell.font = Font(color="FFFFFF" if val in ("Not Yet", "Auto") else "000000")
+
+
+def cumulative_workbook(sections: list) -> bytes:
+    """Excel workbook with one styled sheet per (sheet_name, pivot, ordered_steps) section."""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for sheet_name, pivot, ordered_steps in sections:
+            write_cumulative_sheet(writer, pivot, ordered_steps, sheet_name=sheet_name)
+    return output.getvalue()
+
+
+def _sheet_title(name: str) -> str:
+    """Excel-safe worksheet title (max 31 chars, no []:*?/\\)."""
+    return "".join("_" if ch in '[]:*?/\\' else ch for ch in str(name))[:31] or "Sheet"
+
+
+def resident_workbook(cases_df: pd.DataFrame, scores_df: pd.DataFrame, steps_df: pd.DataFrame,
+                      atnds_df: pd.DataFrame, procs_map: dict, resident: str):
+    """A resident's cumulative workbook — one styled sheet per procedure — or None if no data."""
+    merged = resident_passport_rows(cases_df, scores_df, steps_df, atnds_df, resident)
+    if merged.empty:
+        return None
+    sections = [
+        (_sheet_title(title), pivot, ordered_steps)
+        for title, pivot, ordered_steps in resident_passport_sections(merged, steps_df, procs_map)
+    ]
+    return cumulative_workbook(sections)
+
+
+def resident_passport_document(cases_df: pd.DataFrame, scores_df: pd.DataFrame, steps_df: pd.DataFrame,
+                               atnds_df: pd.DataFrame, procs_map: dict, resident: str, subtitle: str = ""):
+    """A resident's passport PDF — every procedure, one after another — or None if no data."""
+    merged = resident_passport_rows(cases_df, scores_df, steps_df, atnds_df, resident)
+    if merged.empty:
+        return None
+    return passport_pdf(resident_passport_sections(merged, steps_df, procs_map), subtitle=subtitle or resident)
+
+
+def cohort_workbook(tenant_id: str, residents=None, since=None, until=None) -> bytes:
+    """Program-wide workbook: a sheet per procedure, a row per resident, Most Recent and Best per step."""
+    # The tenant is explicit: a deferred download runs outside the script thread that set it.
+    with use_tenant(tenant_id):
+        return _cohort_workbook(residents, since, until)
+
+
+def _cohort_workbook(residents, since, until) -> bytes:
+    # One academic-year partition at a time, folded into a per (procedure, resident) summary.
+    _, procs_df, steps_df, atnds_df = load_refs()
+    roster = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    names  = dict(zip(roster["email"].astype(str).str.strip(), roster["name"].astype(str)))
+    bounds = [academic_year(d) if d is not None else None for d in (since, until)]
+    wanted = None if residents is None else {str(r).strip() for r in residents}
+    procs_map = dict(zip(procs_df["procedure_id"].astype(str).str.strip(), procs_df["procedure_name"].astype(str)))
+
+    # (procedure_id, resident) → (case ids, {step_id: {"recent", "when", "best"}}); "when" orders
+    # ratings by (date, case_id) with undated cases last, as the date sort on the pages does.
+    summary: dict = {}
+    for cases_df, scores_df in _partition_pairs(*bounds):
+        joined = join_scores_cases(cases_df, scores_df, steps_df, atnds_df)
+        keep = joined["rating"].isin(RATING_TO_NUM)
+        if wanted is not None:
+            keep &= joined["resident_email"].astype(str).str.strip().isin(wanted)
+        if since is not None:
+            keep &= joined["date"] >= pd.Timestamp(since)
+        if until is not None:
+            keep &= joined["date"] < pd.Timestamp(until) + pd.Timedelta(days=1)
+        joined = joined[keep]
+        dates = joined["date"].to_numpy(dtype="datetime64[ns]")
+        stamp = np.where(np.isnat(dates), np.iinfo(np.int64).max, dates.astype(np.int64))
+        columns = [joined[c].astype(str).str.strip().to_numpy(dtype=object) for c in ("procedure_id", "resident_email")]
+        columns += [joined[c].to_numpy(dtype=object) for c in ("case_id", "step_id", "rating")]
+        del joined
+        for p, res, cid, sid, value, ns in zip(*columns, stamp.tolist()):
+            entry = summary.get((p, res))
+            if entry is None:
+                entry = summary[(p, res)] = (set(), {})
+            entry[0].add(cid)
+            rec = entry[1].get(sid)
+            if rec is None:
+                rec = entry[1][sid] = {"recent": None, "when": None, "best": None}
+            if rec["best"] is None or RATING_TO_NUM[value] > RATING_TO_NUM[rec["best"]]:
+                rec["best"] = value
+            if value != "Not Assessed" and (rec["when"] is None or (ns, cid) >= rec["when"]):
+                rec["recent"], rec["when"] = value, (ns, cid)
+
+    steps = steps_df.assign(procedure_id=steps_df["procedure_id"].astype(str).str.strip(),
+                            step_id=steps_df["step_id"].astype(str).str.strip(),
+                            step_order=pd.to_numeric(steps_df["step_order"], errors="coerce"))
+    steps = steps.sort_values("step_order", kind="stable")
+    steps_of = {pid: list(zip(grp["step_id"], grp["step_name"].astype(str)))
+                for pid, grp in steps.groupby("procedure_id", sort=False)}
+
+    wb = Workbook(write_only=True)
+    fills = {r: PatternFill(start_color=c, end_color=c, fill_type="solid") for r, c in EXCEL_RATING_FILL.items()}
+    fonts = {r: Font(color="FFFFFF" if r in ("Not Yet", "Auto") else "000000") for r in EXCEL_RATING_FILL}
+    bold  = Font(bold=True)
+    titles: set = set()
+    ws = proc = None
+
+    def header(cells: list) -> list:
+        out = []
+        for value in cells:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = bold
+            out.append(cell)
+        return out
+
+    def rating(value) -> WriteOnlyCell:
+        cell = WriteOnlyCell(ws, value=value)
+        if value in fills:
+            cell.fill, cell.font = fills[value], fonts[value]
+        return cell
+
+    def order(key: tuple) -> tuple:
+        p, res = key
+        return procs_map.get(p, p), p, names.get(res, res), res
+
+    for p, res in sorted(summary, key=order):
+        if p != proc:
+            proc = p
+            title = base = _sheet_title(procs_map.get(p, p))
+            n = 1
+            while title.lower() in titles:
+                n += 1
+                title = f"{base[:31 - len(str(n)) - 1]} {n}"
+            titles.add(title.lower())
+            ws = wb.create_sheet(title)
+            ws.freeze_panes = "D3"
+            ws.column_dimensions["A"].width, ws.column_dimensions["B"].width = 24, 30
+            pairs = steps_of.get(p, [])
+            ws.append(header(["", "", ""] + [v for _, name in pairs for v in (name, "")]))
+            ws.append(header(["Resident", "Email", "Cases"] + ["Most Recent", "Best"] * len(pairs)))
+        case_ids, recs = summary[(p, res)]
+        row = [names.get(res, res), res, len(case_ids)]
+        for sid, _ in steps_of.get(p, []):
+            rec = recs.get(sid, {})
+            row += [rating(rec.get("recent")), rating(rec.get("best"))]
+        ws.append(row)
+    if ws is None:
+        ws = wb.create_sheet("Cohort")
+        ws.append(["No rated cases for this selection."])
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
@@ -0,0 +1,235 @@
+"""Concurrent-session load test against the offline Sheets stand-in.
+
+    python passport_cli.py loadtest --residents 20 --attendings 10
+
+Drives headless app sessions (Streamlit's AppTest) on parallel threads: each
+resident logs in, saves cases and opens the cumulative dashboard; each
+attending submits through a magic link.  Reports per-step latency
+percentiles and Sheets calls, and checks every submission landed on the
+sheet exactly once with its scores.
+
+Parallel AppTest runs need a few of Streamlit's private test-harness
+internals (see _parallel_apptests), so only this module imports them.
+"""
+import concurrent.futures
+import contextlib
+import os
+import random
+import time
+from unittest import mock
+
+import numpy as np
+from streamlit import logger as st_logger
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+from streamlit.testing.v1.util import patch_config_options
+
+import passport_core as core
+import passport_local_sheets as local_sheets
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "procedure_passport.py")
+
+
+def _widget(widgets, label: str = None, key: str = None):
+    for w in widgets:
+        if (label is None or w.label == label) and (key is None or w.key == key):
+            return w
+    raise LookupError(f"no widget {label or key!r} on this page")
+
+
+class _LoadSession:
+    """One headless app session; each timed step is one browser round trip."""
+
+    def __init__(self, timings: dict, timeout: float, query_params=None, state=None):
+        self.at, self.timings = AppTest.from_file(APP_FILE, default_timeout=timeout), timings
+        for k, v in (query_params or {}).items():
+            self.at.query_params[k] = v
+        for k, v in (state or {}).items():
+            self.at.session_state[k] = v
+
+    def step(self, name: str, action=None, expect_page: str = None):
+        start = time.perf_counter()
+        (action() if action else self.at).run()
+        self.timings.setdefault(name, []).append(time.perf_counter() - start)
+        if self.at.exception:
+            raise RuntimeError(f"{name}: {self.at.exception[0].value}")
+        if expect_page and self.at.session_state["page"] != expect_page:
+            errors = [e.value for e in self.at.error] + [w.value for w in self.at.warning]
+            raise RuntimeError(f"{name}: still on {self.at.session_state['page']!r} {errors[:1]}")
+
+    def page(self) -> str:
+        return self.at.session_state["page"]
+
+
+@contextlib.contextmanager
+def _parallel_apptests():
+    """Let AppTest sessions run on parallel threads.
+
+    Each AppTest run installs its own mock Runtime and removes it when done,
+    so a run finishing on one thread pulls the runtime from under the others.
+    While this is active, a cleared runtime falls back to the last one seen,
+    and the global.appTest option each run sets (and resets when done) stays
+    on, or widgets of the runs still going lose their test hooks.  Runs also
+    share one compiled copy of the app instead of parsing it each time
+    (parallel ast.parse calls are not safe on every Python version).
+    """
+    last = {}
+    scripts = ScriptCache()
+    scripts.get_bytecode(APP_FILE)
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+        if "runtime" not in last:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last["runtime"]
+
+    with mock.patch.object(Runtime, "instance", classmethod(instance)), \
+         mock.patch.object(Runtime, "exists", classmethod(lambda cls: cls._instance is not None or bool(last))), \
+         mock.patch.object(app_test, "ScriptCache", lambda: scripts), \
+         mock.patch.object(local_script_runner, "ScriptCache", lambda: scripts), \
+         patch_config_options({"global.appTest": True}):
+        yield
+
+
+def _fill_assessment(at, rng, marker: str, prefix: str) -> None:
+    _widget(at.selectbox, "Case Complexity").select("Moderate")
+    for box in at.selectbox:
+        if box.key and box.key.startswith(prefix):
+            box.select(rng.choice(core.RATING_OPTIONS[1:]))
+    _widget(at.selectbox, "Overall Performance Rating").select(core.O_SCORE_OPTIONS[-1])
+    _widget(at.text_area).input(marker)
+
+
+def _resident_flow(user: int, args, refs: dict, timings: dict, submitted: dict) -> None:
+    rng = random.Random(user)
+    s = _LoadSession(timings, args.timeout)
+    s.step("open_login")
+    _widget(s.at.text_input).input(refs["residents"][user])
+    s.step("login", _widget(s.at.button, "Login →").click, expect_page="home")
+    for n in range(args.rounds):
+        s.step("home_to_start", _widget(s.at.button, "Start Assessment").click, expect_page="start")
+        s.step("start_to_assessment", _widget(s.at.button, "Start Assessment →").click, expect_page="assessment")
+        marker = f"loadtest r{user}-{n}"
+        _fill_assessment(s.at, rng, marker, "score_")
+        s.step("finish_and_save", _widget(s.at.button, "🏁 Finish & Save →").click, expect_page="dashboard")
+        submitted[marker] = s.at.session_state["current_case_id"]
+        s.step("dashboard_to_home", _widget(s.at.button, key="sb_home").click, expect_page="home")
+        s.step("cumulative_view", _widget(s.at.button, "View Dashboard").click, expect_page="cumulative")
+        s.step("cumulative_to_home", _widget(s.at.button, key="sb_home").click, expect_page="home")
+
+
+def _attending_flow(user: int, args, refs: dict, timings: dict, submitted: dict) -> None:
+    rng = random.Random(10_000 + user)
+    for n in range(args.rounds):
+        s = _LoadSession(timings, args.timeout, query_params={
+            "mode": "attending", "resident": rng.choice(refs["residents"]),
+            "procedure_id": refs["procedure_id"], "specialty_id": refs["specialty_id"],
+            "attending_name": refs["attending_name"].replace(" ", "_"),
+        })
+        s.step("open_magic_link", expect_page="attending_assessment")
+        marker = f"loadtest a{user}-{n}"
+        _fill_assessment(s.at, rng, marker, "att_score_")
+        s.step("attending_submit", _widget(s.at.button, "✅ Submit Evaluation").click,
+               expect_page="attending_confirmation")
+        submitted[marker] = s.at.session_state["attending_submission"]["case_id"]
+
+
+def _percentiles(samples: list) -> dict:
+    ms = np.asarray(samples) * 1000
+    return {"n": len(ms), "p50": np.percentile(ms, 50), "p90": np.percentile(ms, 90),
+            "p95": np.percentile(ms, 95), "p99": np.percentile(ms, 99), "max": ms.max()}
+
+
+def run(args) -> int:
+    """Run the load test `passport_cli.py loadtest` describes; returns the exit status."""
+    os.environ["SHEETS_BACKEND"] = "local"
+    if args.seed_dir:
+        os.environ["LOCAL_SHEETS_DIR"] = args.seed_dir
+    if core.current_tenant().backend != "local":
+        print("SHEETS_BACKEND is set in secrets; refusing to load-test the real sheet.")
+        return 2
+    workbook = local_sheets.local_workbook(core.current_tenant().local_dir)
+
+    # Virtual users on the first specialty that has a procedure with steps and an attending.
+    _, procs, steps, atnds = core.load_refs()
+    st_logger.set_log_level("error")  # parsing Streamlit's config above reset it
+    with_steps = procs[procs["procedure_id"].isin(steps["procedure_id"])
+                       & procs["specialty_id"].isin(atnds["specialty_id"])]
+    if with_steps.empty:
+        print("The seed data has no procedure with steps and an attending.")
+        return 1
+    proc = with_steps.iloc[0]
+    refs = {
+        "specialty_id":   str(proc["specialty_id"]),
+        "procedure_id":   str(proc["procedure_id"]),
+        "attending_name": str(atnds.loc[atnds["specialty_id"] == proc["specialty_id"], "attending_name"].iloc[0]),
+        "residents":      [f"loadtest-{i:03d}@example.org" for i in range(max(args.residents, 1))],
+    }
+    for i, email in enumerate(refs["residents"]):
+        core.ensure_resident(email, f"Load Test {i:03d}", refs["specialty_id"])
+    cases_before = len(workbook.table(core.SHEET_CASES))
+
+    workbook.latency = args.latency_ms / 1000
+    workbook.reset_counters()
+    flows = [(_resident_flow, i) for i in range(args.residents)] + [(_attending_flow, i) for i in range(args.attendings)]
+    if not flows:
+        print("Nothing to run: use --residents and/or --attendings.")
+        return 1
+
+    def run(flow, user):
+        timings, submitted = {}, {}
+        try:
+            flow(user, args, refs, timings, submitted)
+            return timings, submitted, None
+        except Exception as exc:  # one failed session must not hide the others' numbers
+            return timings, submitted, f"{flow.__name__.strip('_')}[{user}]: {exc}"
+
+    t0 = time.perf_counter()
+    with _parallel_apptests(), concurrent.futures.ThreadPoolExecutor(max_workers=len(flows)) as pool:
+        results = list(pool.map(lambda f: run(*f), flows))
+    wall = time.perf_counter() - t0
+    calls = workbook.api_calls()
+
+    timings, submitted, failures = {}, {}, []
+    for t, sub_, error in results:
+        for name, samples in t.items():
+            timings.setdefault(name, []).extend(samples)
+        submitted.update(sub_)
+        if error:
+            failures.append(error)
+
+    # Every submission must be on the sheet exactly once, with its scores.
+    cases  = workbook.table(core.SHEET_CASES)
+    header = cases[0] if cases else []
+    notes  = [row[header.index("notes")] if len(row) > header.index("notes") else "" for row in cases[1:]]
+    on_sheet = {m: notes.count(m) for m in submitted}
+    lost = sorted(m for m, n in on_sheet.items() if n == 0)
+    dups = sorted(m for m, n in on_sheet.items() if n > 1)
+    scores = workbook.table(core.score_table()[0])
+    scored = {row[0] for row in scores[1:] if row}
+    unscored = sorted(m for m, cid in submitted.items() if cid not in scored)
+
+    saves = len(submitted)
+    runs  = sum(len(v) for v in timings.values())
+    print(f"{args.residents} residents + {args.attendings} attendings, {args.rounds} round(s) each, "
+          f"{args.latency_ms:g} ms simulated Sheets latency")
+    print(f"wall {wall:.1f}s — {saves} cases saved ({saves / wall:.2f}/s), {runs} page runs ({runs / wall:.1f}/s)\n")
+    width = max((len(k) for k in timings), default=4)
+    print(f"{'step':<{width}}  {'n':>5}  {'p50':>7}  {'p90':>7}  {'p95':>7}  {'p99':>7}  {'max':>7}  (ms)")
+    for name, samples in timings.items():
+        p = _percentiles(samples)
+        print(f"{name:<{width}}  {p['n']:>5}  {p['p50']:>7.0f}  {p['p90']:>7.0f}  {p['p95']:>7.0f}  "
+              f"{p['p99']:>7.0f}  {p['max']:>7.0f}")
+    per_case = f", {calls.get('write', 0) / saves:.1f} writes per saved case" if saves else ""
+    print(f"\nSheets API: {calls.get('read', 0)} reads, {calls.get('write', 0)} writes{per_case}")
+    print("  " + ", ".join(f"{op} {n}" for op, n in sorted(calls.items()) if op not in ("read", "write")))
+    print("\n" + core.write_metrics().to_string(index=False))
+    print(f"\ncases: {cases_before} before, {len(cases)} after; {saves} submitted, "
+          f"{len(lost)} lost, {len(dups)} duplicated, {len(unscored)} without scores")
+    for m in lost[:5] + dups[:5] + unscored[:5]:
+        print(f"  {m}")
+    for f in failures:
+        print(f"FAILED {f}")
+    return 1 if lost or dups or unscored or failures else 0
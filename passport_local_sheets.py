@@ -0,0 +1,294 @@
+"""Offline stand-in for the Google Sheets API — load tests and local development.
+
+LocalSheetsHTTPClient answers the Sheets v4 REST calls gspread makes from an
+in-memory workbook seeded with the CSV files in LOCAL_SHEETS_DIR, so gspread,
+gspread_dataframe and the app's own write path run unchanged.  The Drive file
+metadata call (modifiedTime) is answered too.  Every request is counted, and
+an optional per-request latency mimics Google's round trips.
+
+Select it with SHEETS_BACKEND = "local" (secrets or the environment).  The
+workbook lives in process memory and is shared by every session in it.
+"""
+import collections
+import csv
+import datetime
+import glob
+import os
+import re
+import threading
+import time
+from json import dumps
+from urllib.parse import unquote
+
+import gspread
+import requests
+
+SHEETS_BASE = gspread.urls.SPREADSHEETS_API_V4_BASE_URL + "/"
+DRIVE_FILES = gspread.urls.DRIVE_FILES_API_V3_URL + "/"
+DEFAULT_ROWS, DEFAULT_COLS = 1000, 26
+_NUMBER = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+
+def user_entered_value(value):
+    """What Sheets stores for a USER_ENTERED value: numbers and booleans are parsed."""
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith("'"):
+            return value[1:]
+        if _NUMBER.match(text):
+            number = float(text)
+            return int(number) if number.is_integer() and abs(number) < 1e15 else number
+        if text.upper() in ("TRUE", "FALSE"):
+            return text.upper() == "TRUE"
+    return "" if value is None else value
+
+
+def _formatted(value) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() and abs(value) < 1e15 else f"{value:.10g}".upper()
+    return str(value)
+
+
+class LocalSheet:
+    """One worksheet: a grid of stored cell values ("" is empty)."""
+
+    def __init__(self, sheet_id: int, title: str, index: int, rows=None):
+        self.id, self.title, self.index = sheet_id, title, index
+        self.cells = [list(r) for r in rows or []]
+        self.row_count = max(DEFAULT_ROWS, len(self.cells))
+        self.col_count = max([DEFAULT_COLS] + [len(r) for r in self.cells])
+
+    def properties(self) -> dict:
+        return {"sheetId": self.id, "title": self.title, "index": self.index, "sheetType": "GRID",
+                "gridProperties": {"rowCount": self.row_count, "columnCount": self.col_count}}
+
+    def last_row(self) -> int:
+        for i in range(len(self.cells), 0, -1):
+            if any(v != "" for v in self.cells[i - 1]):
+                return i
+        return 0
+
+    def read(self, grid: dict, render: str, by_columns: bool = False) -> list:
+        r0, c0 = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+        r1 = min(grid.get("endRowIndex", self.row_count), self.last_row())
+        c1 = grid.get("endColumnIndex", self.col_count)
+        rows = [[(v if render == "UNFORMATTED_VALUE" else _formatted(v)) for v in self.cells[r][c0:c1]]
+                for r in range(r0, r1)]
+        if by_columns:
+            width = max((len(r) for r in rows), default=0)
+            rows = [[r[c] if c < len(r) else "" for r in rows] for c in range(width)]
+        for row in rows:
+            while row and row[-1] == "":
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def write(self, row0: int, col0: int, values: list, user_entered: bool) -> None:
+        for i, row in enumerate(values):
+            r = row0 + i
+            while len(self.cells) <= r:
+                self.cells.append([])
+            line = self.cells[r]
+            for j, value in enumerate(row):
+                c = col0 + j
+                if len(line) <= c:
+                    line.extend([""] * (c + 1 - len(line)))
+                line[c] = user_entered_value(value) if user_entered else ("" if value is None else value)
+        self.row_count = max(self.row_count, len(self.cells))
+        self.col_count = max([self.col_count] + [len(r) for r in self.cells])
+
+    def clear(self, grid: dict) -> None:
+        r0, c0 = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+        for line in self.cells[r0:grid.get("endRowIndex", len(self.cells))]:
+            for c in range(c0, min(grid.get("endColumnIndex", len(line)), len(line))):
+                line[c] = ""
+
+    def resize(self, rows=None, cols=None) -> None:
+        if rows is not None:
+            self.row_count = rows = int(rows)
+            del self.cells[rows:]
+        if cols is not None:
+            self.col_count = cols = int(cols)
+            for line in self.cells:
+                del line[cols:]
+
+
+class LocalWorkbook:
+    """An in-memory spreadsheet plus request counters and simulated latency."""
+
+    def __init__(self, directory: str = ""):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.sheets = {}
+        self.latency = 0.0
+        self.calls = collections.Counter()
+        self.modified = time.time()
+        for path in sorted(glob.glob(os.path.join(directory, "*.csv"))) if directory else []:
+            with open(path, newline="", encoding="utf-8") as f:
+                self.add_sheet(os.path.splitext(os.path.basename(path))[0],
+                               [[user_entered_value(v) for v in row] for row in csv.reader(f)])
+
+    def add_sheet(self, title: str, rows=None, grid=None) -> LocalSheet:
+        sheet = LocalSheet(max([s.id for s in self.sheets.values()], default=0) + 1, title, len(self.sheets), rows)
+        if grid:
+            sheet.resize(grid.get("rowCount"), grid.get("columnCount"))
+        self.sheets[title] = sheet
+        return sheet
+
+    def api_calls(self) -> dict:
+        """Requests served so far, as {"read": n, "write": n, <operation>: n, ...}."""
+        with self.lock:
+            return dict(self.calls)
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.calls.clear()
+
+    def table(self, title: str) -> list:
+        """A sheet's rows as displayed (header first), bypassing the API and its counters."""
+        with self.lock:
+            sheet = self.sheets.get(title)
+            return sheet.read({}, "FORMATTED_VALUE") if sheet else []
+
+    # ── request dispatch ─────────────────────────────────
+    def drive_metadata(self) -> dict:
+        with self.lock:
+            self.calls["read"] += 1
+            self.calls["drive"] += 1
+            modified = datetime.datetime.fromtimestamp(self.modified, datetime.timezone.utc)
+        return {"id": "local", "name": "Procedure Passport (local)",
+                "modifiedTime": modified.isoformat(timespec="milliseconds").replace("+00:00", "Z")}
+
+    def handle(self, method: str, url: str, params: dict, body: dict):
+        if url.startswith(DRIVE_FILES):
+            return self.drive_metadata()
+        spreadsheet, _, rest = url[len(SHEETS_BASE):].partition("/")
+        method = method.lower()
+        if ":" in spreadsheet:  # {id}:batchUpdate
+            op = spreadsheet.partition(":")[2]
+        elif not rest:
+            op = "metadata"
+        elif rest.startswith("values:"):
+            op = rest[len("values:"):]
+        elif rest.startswith("values/"):
+            # The range is percent-encoded, so a literal ":" can only start the action.
+            encoded, _, action = rest[len("values/"):].partition(":")
+            name = unquote(encoded)
+            op = action or ("update" if method == "put" else "get")
+        else:
+            op = rest
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls["read" if method == "get" else "write"] += 1
+            self.calls[op] += 1
+            if method != "get":
+                self.modified = time.time()
+            if op == "metadata":
+                return {"spreadsheetId": "local",
+                        "properties": {"title": "Procedure Passport (local)", "locale": "en_US"},
+                        "sheets": [{"properties": s.properties()} for s in self.sheets.values()]}
+            if op == "batchUpdate":
+                return {"spreadsheetId": "local", "replies": [self._update(r) for r in body["requests"]]}
+            if op == "get":
+                return self._get(name, params)
+            if op == "batchGet":
+                ranges = params.get("ranges", [])
+                return {"spreadsheetId": "local",
+                        "valueRanges": [self._get(r, params) for r in ([ranges] if isinstance(ranges, str) else ranges)]}
+            if op == "update":
+                sheet, grid = self._range(name)
+                sheet.write(grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0), body.get("values", []),
+                            params.get("valueInputOption") == "USER_ENTERED")
+                return {"spreadsheetId": "local", "updatedRange": name}
+            if op == "append":
+                sheet, _ = self._range(name)
+                start = sheet.last_row()
+                sheet.write(start, 0, body.get("values", []), params.get("valueInputOption") == "USER_ENTERED")
+                return {"spreadsheetId": "local", "updates": {"updatedRows": len(body.get("values", []))}}
+            if op in ("clear", "batchClear"):
+                for rng in body.get("ranges", []) if op == "batchClear" else [name]:
+                    sheet, grid = self._range(rng)
+                    sheet.clear(grid)
+                return {"spreadsheetId": "local"}
+        raise ValueError(f"local Sheets stand-in does not implement {method.upper()} {url}")
+
+    def _range(self, name: str):
+        title, _, a1 = name.rpartition("!") if "!" in name else (name, "", "")
+        title = title.strip("'").replace("''", "'")
+        if title not in self.sheets:
+            raise KeyError(title)
+        return self.sheets[title], (gspread.utils.a1_range_to_grid_range(a1) if a1 else {})
+
+    def _get(self, name: str, params: dict) -> dict:
+        sheet, grid = self._range(name)
+        render = params.get("valueRenderOption") or "FORMATTED_VALUE"
+        by_columns = params.get("majorDimension") == "COLUMNS"
+        out = {"range": name, "majorDimension": "COLUMNS" if by_columns else "ROWS"}
+        values = sheet.read(grid, render, by_columns)
+        if values:
+            out["values"] = values
+        return out
+
+    def _update(self, request: dict) -> dict:
+        if "addSheet" in request:
+            props = request["addSheet"].get("properties", {})
+            sheet = self.add_sheet(props["title"], grid=props.get("gridProperties"))
+            return {"addSheet": {"properties": sheet.properties()}}
+        if "updateSheetProperties" in request:
+            props = request["updateSheetProperties"]["properties"]
+            sheet = next(s for s in self.sheets.values() if s.id == props["sheetId"])
+            grid = props.get("gridProperties", {})
+            sheet.resize(grid.get("rowCount"), grid.get("columnCount"))
+            return {}
+        if "deleteSheet" in request:
+            sid = request["deleteSheet"]["sheetId"]
+            self.sheets = {t: s for t, s in self.sheets.items() if s.id != sid}
+            return {}
+        raise ValueError(f"local Sheets stand-in does not implement {sorted(request)}")
+
+
+_WORKBOOKS: dict = {}
+_WORKBOOKS_LOCK = threading.Lock()
+
+
+def local_workbook(directory: str) -> LocalWorkbook:
+    """The process-wide workbook seeded from `directory` (created on first use)."""
+    directory = os.path.abspath(directory)
+    with _WORKBOOKS_LOCK:
+        if directory not in _WORKBOOKS:
+            _WORKBOOKS[directory] = LocalWorkbook(directory)
+        return _WORKBOOKS[directory]
+
+
+class LocalSheetsHTTPClient(gspread.http_client.HTTPClient):
+    """gspread HTTP client served by a LocalWorkbook instead of Google."""
+
+    workbook: LocalWorkbook = None
+
+    def __init__(self, auth=None, session=None):
+        self.auth, self.session, self.timeout = auth, None, None
+
+    def request(self, method: str, endpoint: str, params=None, data=None, json=None,
+                files=None, headers=None) -> requests.Response:
+        response = requests.Response()
+        response.url = endpoint
+        try:
+            payload, response.status_code = self.workbook.handle(method, endpoint, dict(params or {}), json or {}), 200
+        except KeyError as exc:
+            payload, response.status_code = {"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                                       "message": f"Unable to parse range: {exc}"}}, 400
+        response._content = dumps(payload).encode()
+        if response.ok:
+            return response
+        raise gspread.exceptions.APIError(response)
+
+
+def local_client(directory: str) -> gspread.Client:
+    """A gspread Client backed by the process-wide workbook for `directory`."""
+    http_client = type("BoundLocalSheetsHTTPClient", (LocalSheetsHTTPClient,),
+                       {"workbook": local_workbook(directory)})
+    return gspread.Client(auth=None, http_client=http_client)
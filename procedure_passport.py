@@ -1,17 +1,30 @@
 import streamlit as st
 import time
 import pandas as pd
-import uuid
 import datetime
 import io
-import base64
-import json
 import html
-import gspread
-from gspread_dataframe import get_as_dataframe, set_with_dataframe
-from google.oauth2.service_account import Credentials
+import functools
 import numpy as np
 
+from passport_core import (
+    RATING_OPTIONS, RATING_HEX, NEVER_ATTEMPTED_HEX, RATING_COLOR, COMPLEXITY_HEX, O_SCORE_HEX, O_SCORE_OPTIONS,
+    SHEET_RESIDENTS, SHEET_ATTENDINGS, SHEET_PROCEDURES, SHEET_STEPS,
+    SHEET_SPECIALTY,
+    fmt_date, norm_id, frame_version, attending_display_name, sort_by_date, date_window,
+    read_sheet_df, append_sheet_rows, rewrite_sheet, write_metrics, load_refs, load_procedure, read_scores_df, read_cases_df,
+    academic_year, archive_academic_years, compact_tables, migrate_case_ids,
+    reconcile_case_log, save_case_log_map, CASE_LOG_WINDOW_DAYS,
+    backup_tables, backup_history, backed_up_tables, restore_table,
+    event_journal, journal_status, record_journal_baseline, checkpoint_journal,
+    ensure_resident, ensure_attending, ensure_procedure, save_case,
+    plan_step_revision, revise_procedure_steps,
+    get_derived_view, reset_derived_views, readiness_rating, READINESS_THRESHOLD, READINESS_MIN_EVIDENCE,
+    shared_cache, sync_shared_cache, sheets_breaker, clear_read_caches, WriteConflict,
+    DEFAULT_TENANT, tenants, default_tenant_id, current_tenant, set_tenant, tenant_for_email,
+    resident_passport_rows, procedure_pivot, resident_passport_sections,
+    passport_export, learning_curve_png, cumulative_workbook, cohort_workbook,
+)
 
 st.set_page_config(
     page_title="Procedure Passport",
@@ -19,6 +32,26 @@ st.set_page_config(
     layout="wide",
 )
 
+# ─────────────────────────────────────────────
+# TENANT  (which program's spreadsheet this session uses)
+# ─────────────────────────────────────────────
+# ?tenant=<id> picks the program before login; otherwise login routes by email
+# (see tenant_for_email).  A logged-in session keeps its program.
+_tenant_param = st.query_params.get("tenant")
+if _tenant_param and not st.session_state.get("resident"):
+    if _tenant_param not in tenants():
+        st.error("❌ This link points to an unknown program.")
+        st.stop()
+    st.session_state["tenant"] = _tenant_param
+set_tenant(st.session_state.get("tenant") or default_tenant_id())
+
+# Pick up writes made by other replicas on this host (no-op without SHARED_CACHE_PATH).
+sync_shared_cache()
+
+if sheets_breaker().is_open():
+    st.warning("⚠️ Google Sheets is not responding — showing the last data loaded. "
+               "Saving will work again once it recovers.")
+
 # ─────────────────────────────────────────────
 # QUERY PARAMS  (magic link routing)
 # ─────────────────────────────────────────────
@@ -49,6 +82,7 @@ _defaults: dict = {
     "notes":                   "",
     "current_case_id":         None,
     "attending_submission":    None,   # filled after magic-link submit
+    "attending_key":           None,   # set when an attending logs in
 }
 for _k, _v in _defaults.items():
     if _k not in st.session_state:
@@ -57,265 +91,14 @@ for _k, _v in _defaults.items():
 # ─────────────────────────────────────────────
 # CONFIG
 # ─────────────────────────────────────────────
-ADMINS = ["pjenkins9@gmail.com"]
-
-RATING_OPTIONS = ["Not Assessed", "Shown/Told", "Not Yet", "Steer", "Prompt", "Back up", "Auto"]
-RATING_TO_NUM  = {
-    "Not Assessed": -1,
-    "Shown/Told":    0,
-    "Not Yet":       1,
-    "Steer":         2,
-    "Prompt":        3,
-    "Back up":       4,
-    "Auto":          5,
-}
-RATING_HEX = {
-    "Not Assessed": "#F0F0F0",  # white/empty — explicitly rated as not assessed
-    "Shown/Told":   "#9E9E9E",  # dark gray — explicitly shown or told
-    "Not Yet":      "#5B8DB8",
-    "Steer":        "#FF944D",
-    "Prompt":       "#FFD633",
-    "Back up":      "#99E699",
-    "Auto":         "#33CC33",
-}
-RATING_COLOR = {
-    k: f"background-color:{v}; color:{'white' if k in ('Not Yet','Auto') else 'black'};"
-    for k, v in RATING_HEX.items()
-}
-
-def fmt_date(d):
-    """Format a date value as MM-DD-YYYY; pass through non-date strings unchanged."""
-    try:
-        if pd.isna(d):
-            return ""
-    except TypeError:
-        pass
-    try:
-        return pd.Timestamp(d).strftime("%m-%d-%Y")
-    except Exception:
-        return str(d)
-
+def _tenant_admins() -> list:
+    tenant = current_tenant()
+    return tenant.admins or (["pjenkins9@gmail.com"] if tenant.id == DEFAULT_TENANT else [])
 
-def _norm_id(series: pd.Series) -> pd.Series:
-    """Normalise a case_id Series to clean strings regardless of pandas version.
-
-    pandas 3.x can infer all-digit hex IDs as float64, making astype(str)
-    produce "123456789012.0" while the other sheet retains "123456789012".
-    The three-step chain below is safe for every dtype:
-      float64  123456789012.0  → "123456789012.0" → strip → remove .0 → "123456789012"
-      int64    123456789012    → "123456789012"   → strip → no-op      → "123456789012"
-      object   "abc123def456"  → "abc123def456"   → strip → no-op      → "abc123def456"
-    """
-    return (series.astype(str)
-                  .str.strip()
-                  .str.replace(r"\.0$", "", regex=True))
 
+ADMINS = _tenant_admins()
 
-COMPLEXITY_HEX = {
-    "Straight Forward": "#C8E6C9",
-    "Moderate":         "#FFF59D",
-    "Complex":          "#FFAB91",
-}
-O_SCORE_HEX = {
-    "1": "#378ADD",
-    "2": "#FF944D",
-    "3": "#FFD633",
-    "4": "#99E699",
-    "5": "#33CC33",
-}
-O_SCORE_OPTIONS = [
-    "— Make a selection —",
-    "1 - Not Yet",
-    "2 - Steer",
-    "3 - Prompt",
-    "4 - Backup",
-    "5 - Auto",
-]
-
-SHEET_RESIDENTS  = "residents"
-SHEET_ATTENDINGS = "attendings"
-SHEET_PROCEDURES = "procedures"
-SHEET_STEPS      = "steps"
-SHEET_CASES      = "cases"
-SHEET_SCORES     = "scores"
-SHEET_SPECIALTY  = "specialties"
-
-# ─────────────────────────────────────────────
-# GOOGLE SHEETS HELPERS
-# ─────────────────────────────────────────────
-
-@st.cache_resource(show_spinner=False)
-def get_gs_client():
-    """Authorized gspread client — cached for the entire app session."""
-    svc_json = json.loads(base64.b64decode(st.secrets["GOOGLE_SVC_B64"]).decode())
-    creds = Credentials.from_service_account_info(
-        svc_json,
-        scopes=[
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ],
-    )
-    return gspread.authorize(creds)
-
-
-def get_sheet(sheet_name: str):
-    """Return a gspread worksheet, creating it if missing."""
-    try:
-        gc = get_gs_client()
-        sh = gc.open_by_key(st.secrets["GOOGLE_SHEET_KEY"])
-        try:
-            return sh.worksheet(sheet_name)
-        except gspread.exceptions.WorksheetNotFound:
-            return sh.add_worksheet(title=sheet_name, rows="500", cols="26")
-    except Exception as exc:
-        raise ConnectionError(f"Cannot reach Google Sheets: {exc}") from exc
-
-
-@st.cache_data(ttl=300, show_spinner=False)
-def read_sheet_df(sheet_name: str, expected_cols=None) -> pd.DataFrame:
-    """Cached worksheet read (300 s TTL).  Returns empty DF if sheet is blank."""
-    ws  = get_sheet(sheet_name)
-    df  = get_as_dataframe(ws, evaluate_formulas=True, header=0)
-    df  = df.dropna(how="all")
-    if df.empty and expected_cols:
-        return pd.DataFrame(columns=expected_cols)
-    if expected_cols:
-        for col in expected_cols:
-            if col not in df.columns:
-                df[col] = pd.NA
-        df = df[expected_cols]
-    return df
-
-
-def write_sheet_df(sheet_name: str, df: pd.DataFrame) -> None:
-    """Overwrite a worksheet then clear all cached reads so the UI stays fresh."""
-    ws = get_sheet(sheet_name)
-    ws.clear()
-    set_with_dataframe(ws, df, include_index=False, include_column_header=True)
-    st.cache_data.clear()  # invalidate all read caches after every write
-
-
-@st.cache_data(ttl=300, show_spinner=False)
-def load_refs():
-    """Load all reference tables in one shot (cached 300 s)."""
-    def _safe(name, cols):
-        try:
-            return read_sheet_df(name, expected_cols=cols)
-        except Exception:
-            return pd.DataFrame(columns=cols)
-
-    spec_df  = _safe(SHEET_SPECIALTY,  ["specialty_id",  "specialty_name"])
-    proc_df  = _safe(SHEET_PROCEDURES, ["procedure_id",  "procedure_name", "specialty_id"])
-    steps_df = _safe(SHEET_STEPS,      ["step_id",       "procedure_id",   "step_order", "step_name"])
-    atnd_df  = _safe(SHEET_ATTENDINGS, ["attending_id",  "attending_name", "specialty_id", "email"])
-    return spec_df, proc_df, steps_df, atnd_df
-
-
-# ─────────────────────────────────────────────
-# DATA MUTATION HELPERS
-# ─────────────────────────────────────────────
-
-def ensure_resident(email: str, name: str = "", specialty_id=None) -> None:
-    cols = ["email", "name", "specialty_id", "created_at"]
-    df   = read_sheet_df(SHEET_RESIDENTS, expected_cols=cols)
-    if email not in df["email"].values:
-        df = pd.concat([df, pd.DataFrame([{
-            "email":        email,
-            "name":         name,
-            "specialty_id": specialty_id,
-            "created_at":   datetime.datetime.utcnow().isoformat(),
-        }])], ignore_index=True)
-        write_sheet_df(SHEET_RESIDENTS, df)   # also clears cache
-
-
-def ensure_attending(name: str, specialty_id: str, email: str = "") -> None:
-    cols = ["attending_id", "attending_name", "specialty_id", "email"]
-    df   = read_sheet_df(SHEET_ATTENDINGS, expected_cols=cols)
-    if name not in df["attending_name"].values:
-        att_id = "A_" + specialty_id + "_" + name.replace(" ", "_").upper()
-        df = pd.concat([df, pd.DataFrame([{
-            "attending_id":   att_id,
-            "attending_name": name,
-            "specialty_id":   specialty_id,
-            "email":          email,
-        }])], ignore_index=True)
-        write_sheet_df(SHEET_ATTENDINGS, df)
-
-
-def ensure_procedure(proc_id: str, proc_name: str, specialty_id: str, steps_list: list) -> None:
-    proc_cols = ["procedure_id", "procedure_name", "specialty_id"]
-    procs_df  = read_sheet_df(SHEET_PROCEDURES, expected_cols=proc_cols)
-    if proc_id not in procs_df["procedure_id"].values:
-        procs_df = pd.concat([procs_df, pd.DataFrame([{
-            "procedure_id":   proc_id,
-            "procedure_name": proc_name,
-            "specialty_id":   specialty_id,
-        }])], ignore_index=True)
-        write_sheet_df(SHEET_PROCEDURES, procs_df)
-
-    step_cols = ["step_id", "procedure_id", "step_order", "step_name"]
-    steps_df  = read_sheet_df(SHEET_STEPS, expected_cols=step_cols)
-    if not (steps_df["procedure_id"] == proc_id).any():
-        new_steps = pd.DataFrame([{
-            "step_id":      f"S_{proc_id}_{i+1:02d}",
-            "procedure_id": proc_id,
-            "step_order":   i + 1,
-            "step_name":    step,
-        } for i, step in enumerate(steps_list)])
-        steps_df = pd.concat([steps_df, new_steps], ignore_index=True)
-        write_sheet_df(SHEET_STEPS, steps_df)
-
-
-def save_case(
-    resident_email: str,
-    date,
-    specialty_id: str,
-    procedure_id: str,
-    attending_id: str,
-    scores_dict: dict,
-    notes: str = "",
-    case_complexity=None,
-    overall_performance=None,
-) -> str:
-    """Persist a case + its step scores; returns the new case_id."""
-    case_id   = uuid.uuid4().hex[:12]
-
-    case_cols = ["case_id", "resident_email", "date", "specialty_id",
-                 "procedure_id", "attending_id", "notes",
-                 "case_complexity", "overall_performance"]
-    cases_df  = read_sheet_df(SHEET_CASES, expected_cols=case_cols)
-    cases_df  = pd.concat([cases_df, pd.DataFrame([{
-        "case_id":             case_id,
-        "resident_email":      resident_email,
-        "date":                str(date),
-        "specialty_id":        specialty_id,
-        "procedure_id":        procedure_id,
-        "attending_id":        attending_id,
-        "notes":               notes,
-        "case_complexity":     case_complexity,
-        "overall_performance": overall_performance,
-    }])], ignore_index=True)
-    write_sheet_df(SHEET_CASES, cases_df)  # clears cache
-
-    score_cols = ["case_id", "step_id", "rating", "rating_num",
-                  "case_complexity", "overall_performance"]
-    scores_df  = read_sheet_df(SHEET_SCORES, expected_cols=score_cols)
-    # Normalise existing case_ids before concat so the written sheet is consistent.
-    if not scores_df.empty:
-        scores_df["case_id"] = _norm_id(scores_df["case_id"])
-    new_rows   = [{
-        "case_id":             case_id,
-        "step_id":             step_id,
-        "rating":              rating,
-        "rating_num":          RATING_TO_NUM.get(rating),
-        "case_complexity":     case_complexity,
-        "overall_performance": overall_performance,
-    } for step_id, rating in scores_dict.items()]
-    scores_df  = pd.concat([scores_df, pd.DataFrame(new_rows)], ignore_index=True)
-    write_sheet_df(SHEET_SCORES, scores_df)  # clears cache
-
-    return case_id
-
+HEATMAP_PAGE_SIZE = 25   # case rows per heatmap page
 
 # ─────────────────────────────────────────────
 # STYLING HELPERS
@@ -325,16 +108,61 @@ def style_df(df: pd.DataFrame, col: str):
     return df.style.map(lambda v: RATING_COLOR.get(v, ""), subset=[col])
 
 
-def attending_display_name(attending_id: str, atnds_lookup: dict) -> str:
-    """Resolve a display name from an attending_id, including magic_ IDs."""
-    if attending_id in atnds_lookup:
-        return atnds_lookup[attending_id]
-    if isinstance(attending_id, str) and attending_id.startswith("magic_"):
-        return attending_id[len("magic_"):].replace("_", " ")
-    return attending_id or "Unknown"
+COMMENTS_TABLE_CSS = """
+<style>
+.comments-tbl {width:100%;border-collapse:collapse;font-size:0.88rem;}
+.comments-tbl th {background:var(--secondary-background-color);padding:8px 10px;
+    text-align:left;border-bottom:2px solid #ccc;font-weight:600;}
+.comments-tbl td {padding:8px 10px;vertical-align:top;border-bottom:1px solid var(--secondary-background-color);}
+.comments-tbl td.date-col {white-space:nowrap;}
+.comments-tbl td.comments-col {white-space:pre-wrap;word-break:break-word;min-width:260px;}
+</style>"""
+
+
+def comments_table_html(df: pd.DataFrame, columns: list) -> str:
+    """HTML table with a wrapped Comments column; rows are built in a list and joined once."""
+    _cls = {"Date": " class='date-col'", "Comments": " class='comments-col'"}
+    head = "".join(f"<th>{html.escape(c)}</th>" for c in columns)
+    body = [
+        "<tr>" + "".join(
+            f"<td{_cls.get(c, '')}>{html.escape(str(v)).replace(chr(10), '<br>')}</td>"
+            for c, v in zip(columns, values)
+        ) + "</tr>"
+        for values in df[columns].itertuples(index=False, name=None)
+    ]
+    return f"<table class='comments-tbl'><thead><tr>{head}</tr></thead><tbody>{''.join(body)}</tbody></table>"
+
+
+def passport_overview_html(sections: list) -> str:
+    """One row per procedure, one colored cell per step (most recent rating)."""
+    rows = []
+    for proc_name, n_cases, cells in sections:
+        tds = "".join(
+            f"<td title='{html.escape(f'{name} — best: {best or chr(8212)}, attempts: {attempts}')}' "
+            f"style='background:{RATING_HEX.get(recent, NEVER_ATTEMPTED_HEX)};width:22px;"
+            f"border:1px solid #fff;'></td>"
+            for name, recent, best, attempts in cells
+        )
+        rows.append(f"<tr><td style='padding:4px 10px 4px 0;white-space:nowrap;'>{html.escape(proc_name)}"
+                    f" <span style='color:#888;'>({n_cases})</span></td>{tds}</tr>")
+    return f"<table style='border-collapse:collapse;font-size:0.85rem;'>{''.join(rows)}</table>"
+
+
+def paginate(df: pd.DataFrame, key: str, page_size: int = 25) -> pd.DataFrame:
+    """Return one page of `df`, with a page picker when there is more than one page."""
+    n_pages = max(1, -(-len(df) // page_size))
+    if n_pages == 1:
+        return df
+    page_no = st.number_input(
+        f"Page (1–{n_pages}, {len(df)} rows)", min_value=1, max_value=n_pages, value=1, step=1, key=key,
+    )
+    return df.iloc[(page_no - 1) * page_size: page_no * page_size]
 
 
 def show_gs_error(exc: Exception) -> None:
+    if isinstance(exc, WriteConflict):
+        st.error(f"⚠️ **The sheet was being changed elsewhere, so nothing was saved.** Try again.\n\n_Details: {exc}_")
+        return
     st.error(
         "⚠️ **Could not reach Google Sheets.** "
         "Check your network connection or try refreshing the page.\n\n"
@@ -354,11 +182,22 @@ def go_to(page: str) -> None:
 # SIDEBAR
 # ─────────────────────────────────────────────
 st.sidebar.title("🩺 Procedure Passport")
+if len(tenants()) > 1:
+    st.sidebar.caption(current_tenant().name)
 
 _logged_in = st.session_state.get("resident")
 if _logged_in in ADMINS:
     if st.sidebar.button("⚙️ Admin Panel"):
         go_to("admin")
+    if st.sidebar.button("📈 Program Analytics", key="sb_analytics"):
+        go_to("analytics")
+    if st.sidebar.button("🔎 Feedback Search", key="sb_feedback_search"):
+        go_to("feedback_search")
+    if st.sidebar.button("🩺 Attending Evaluations", key="sb_attending_dashboard"):
+        go_to("attending_dashboard")
+elif _logged_in and st.session_state.get("attending_key"):
+    if st.sidebar.button("🩺 My Evaluations", key="sb_attending_dashboard"):
+        go_to("attending_dashboard")
 
 if _logged_in and st.session_state["page"] not in ("login", "attending_assessment", "attending_confirmation"):
     st.sidebar.markdown(f"👤 **{st.session_state.get('resident_name', '')}**")
@@ -367,11 +206,12 @@ if _logged_in and st.session_state["page"] not in ("login", "attending_assessmen
     if st.sidebar.button("🚪 Logout"):
         for _k in list(st.session_state.keys()):
             del st.session_state[_k]
-        st.cache_data.clear()
+        clear_read_caches()
         st.rerun()
 
 # ── Sidebar nav shortcuts (shown when logged in on relevant pages) ──
-if _logged_in and st.session_state["page"] not in ("login", "attending_assessment", "attending_confirmation"):
+if (_logged_in and not st.session_state.get("attending_key")
+        and st.session_state["page"] not in ("login", "attending_assessment", "attending_confirmation")):
     st.sidebar.markdown("---")
     if st.sidebar.button("➕ Start Assessment", key="sb_start"):
         st.session_state["page"] = "start"
@@ -479,6 +319,12 @@ if page == "login":
                 st.error("Please enter your email address.")
             else:
                 try:
+                    if not _tenant_param:
+                        _tenant_id = tenant_for_email(email)
+                        if _tenant_id:
+                            st.session_state["tenant"] = _tenant_id
+                            set_tenant(_tenant_id)
+                            ADMINS = _tenant_admins()
                     residents = read_sheet_df(
                         SHEET_RESIDENTS,
                         expected_cols=["email", "name", "specialty_id", "created_at"],
@@ -498,6 +344,20 @@ if page == "login":
                         )
                         st.rerun()
                     else:
+                        attendings = read_sheet_df(
+                            SHEET_ATTENDINGS,
+                            expected_cols=["attending_id", "attending_name", "specialty_id", "email"],
+                        )
+                        _att = attendings[attendings["email"].astype(str).str.strip().str.casefold()
+                                          == email.strip().casefold()]
+                        if not _att.empty:
+                            st.session_state.update(
+                                resident=email,
+                                resident_name=_att["attending_name"].iloc[0],
+                                attending_key=str(_att["attending_id"].iloc[0]).strip(),
+                                page="attending_dashboard",
+                            )
+                            st.rerun()
                         st.error("❌ Email not recognised. Ask an admin to add you.")
                 except ConnectionError as exc:
                     show_gs_error(exc)
@@ -512,7 +372,10 @@ elif page == "admin":
         go_to("home")
 
     if st.button("🔄 Reload Data"):
-        st.cache_data.clear()
+        if shared_cache():
+            shared_cache().invalidate()
+        clear_read_caches()
+        reset_derived_views()
         st.rerun()
 
     # ── Specialties ──────────────────────────────────────
@@ -529,12 +392,9 @@ elif page == "admin":
                     if new_spec_id in specialties["specialty_id"].values:
                         st.warning("That ID already exists.")
                     else:
-                        specialties = pd.concat(
-                            [specialties, pd.DataFrame([{"specialty_id": new_spec_id,
-                                                          "specialty_name": new_spec_name}])],
-                            ignore_index=True,
-                        )
-                        write_sheet_df(SHEET_SPECIALTY, specialties)
+                        append_sheet_rows(SHEET_SPECIALTY,
+                                          [{"specialty_id": new_spec_id, "specialty_name": new_spec_name}],
+                                          ["specialty_id", "specialty_name"], unique_key="specialty_id")
                         st.success(f"✅ Added {new_spec_name}")
                         time.sleep(0.5)
                         st.rerun()
@@ -574,8 +434,9 @@ elif page == "admin":
             with st.expander("🗑️ Delete Resident"):
                 del_email = st.selectbox("Select resident to delete", residents["email"], key="del_res")
                 if st.button("Delete", key="btn_del_res"):
-                    updated = residents[residents["email"] != del_email].reset_index(drop=True)
-                    write_sheet_df(SHEET_RESIDENTS, updated)
+                    rewrite_sheet(SHEET_RESIDENTS,
+                                  lambda df: df[df["email"] != del_email].reset_index(drop=True),
+                                  ["email", "name", "specialty_id", "created_at"])
                     st.success(f"Deleted {del_email}")
                     time.sleep(0.5)
                     st.rerun()
@@ -612,8 +473,9 @@ elif page == "admin":
             with st.expander("🗑️ Delete Attending"):
                 del_att = st.selectbox("Select attending to delete", attendings["attending_name"], key="del_att")
                 if st.button("Delete", key="btn_del_att"):
-                    updated = attendings[attendings["attending_name"] != del_att].reset_index(drop=True)
-                    write_sheet_df(SHEET_ATTENDINGS, updated)
+                    rewrite_sheet(SHEET_ATTENDINGS,
+                                  lambda df: df[df["attending_name"] != del_att].reset_index(drop=True),
+                                  ["attending_id", "attending_name", "specialty_id", "email"])
                     st.success(f"Deleted {del_att}")
                     time.sleep(0.5)
                     st.rerun()
@@ -656,28 +518,295 @@ elif page == "admin":
                 new_steps_ra = st.text_area("Updated steps (blank = keep current)", key="edit_proc_steps")
                 new_edit_stp = [s.strip() for s in new_steps_ra.split("\n") if s.strip()]
 
+                # Steps whose name no longer appears: ask whether each was renamed or
+                # merged into a new step, so its past ratings follow it.
+                _merges = {}
+                if new_edit_stp:
+                    _cur_steps = read_sheet_df(
+                        SHEET_STEPS, expected_cols=["step_id", "procedure_id", "step_order", "step_name"]
+                    )
+                    _cur_steps = _cur_steps[_cur_steps["procedure_id"] == sel_proc_id]
+                    _plan = plan_step_revision(sel_proc_id, _cur_steps, new_edit_stp)
+                    if _plan["retired"]:
+                        st.caption("These steps are not in the new list. Pick the step each one became "
+                                   "to keep its history, or leave it removed.")
+                    for _sid, _sname, _ in _plan["retired"]:
+                        _to = st.selectbox(f"“{_sname}” is now…", ["— removed —"] + new_edit_stp,
+                                           key=f"edit_proc_map_{_sid}")
+                        if _to != "— removed —":
+                            _merges[_sid] = _to
+
                 if st.button("Update Procedure", key="btn_upd_proc"):
-                    procs_df.loc[procs_df["procedure_id"] == sel_proc_id, "procedure_name"] = new_pname
-                    write_sheet_df(SHEET_PROCEDURES, procs_df)
-                    if new_edit_stp:
-                        steps_df = read_sheet_df(
-                            SHEET_STEPS, expected_cols=["step_id", "procedure_id", "step_order", "step_name"]
-                        )
-                        steps_df = steps_df[steps_df["procedure_id"] != sel_proc_id]
-                        updated_steps = pd.DataFrame([{
-                            "step_id":      f"S_{sel_proc_id}_{i+1:02d}",
-                            "procedure_id": sel_proc_id,
-                            "step_order":   i + 1,
-                            "step_name":    s,
-                        } for i, s in enumerate(new_edit_stp)])
-                        steps_df = pd.concat([steps_df, updated_steps], ignore_index=True)
-                        write_sheet_df(SHEET_STEPS, steps_df)
-                    st.success(f"✅ Updated '{new_pname}'")
+                    rewrite_sheet(SHEET_PROCEDURES,
+                                  lambda df: df.assign(procedure_name=df["procedure_name"].mask(
+                                      df["procedure_id"] == sel_proc_id, new_pname)),
+                                  ["procedure_id", "procedure_name", "specialty_id"])
+                    _summary = revise_procedure_steps(sel_proc_id, new_edit_stp, _merges) if new_edit_stp else None
+                    st.success(f"✅ Updated '{new_pname}'" + (
+                        "" if _summary is None else " — " + ", ".join(f"{n} {k}" for k, n in _summary.items() if n)
+                    ))
                     time.sleep(0.5)
                     st.rerun()
     except ConnectionError as exc:
         show_gs_error(exc)
 
+    st.markdown("---")
+
+    # ── Academic-year archives ───────────────────────────
+    st.subheader("Academic-Year Archives")
+    st.caption("Moves cases and scores from completed academic years (July–June) into "
+               "per-year archive sheets. Every page still shows the full history.")
+    try:
+        # The dry run reads both live sheets, so it only runs when asked for.
+        if st.button("🔍 Preview Archival", key="btn_archive_preview"):
+            st.session_state["archive_preview"] = archive_academic_years(dry_run=True)
+        _archive_preview = st.session_state.get("archive_preview")
+        if _archive_preview is not None and not _archive_preview:
+            st.info("Nothing to archive — the live sheets only hold the current academic year.")
+        elif _archive_preview:
+            st.dataframe(pd.DataFrame(_archive_preview), width="stretch", hide_index=True)
+            if st.button("🗄️ Archive Completed Years", key="btn_archive_years"):
+                with st.spinner("Archiving…"):
+                    archive_academic_years()
+                st.session_state.pop("archive_preview", None)
+                st.success("✅ Archived.")
+                time.sleep(0.5)
+                st.rerun()
+    except ConnectionError as exc:
+        show_gs_error(exc)
+
+    st.markdown("---")
+
+    # ── Data compaction ──────────────────────────────────
+    st.subheader("Data Compaction")
+    st.caption("Rewrites the live cases and scores sheets without duplicate rows, float-mangled IDs, "
+               "cases of deleted residents or scores whose case is gone.")
+    try:
+        _drop_unknown = st.checkbox(
+            "Also drop scores for steps no longer in any procedure", key="compact_drop_unknown",
+            help="These are the only record of ratings made before a procedure's steps were edited.",
+        )
+        # Previews are kept per checkbox setting, so toggling it asks for a new one.
+        _compact_previews = st.session_state.setdefault("compact_preview", {})
+        if st.button("🔍 Preview Compaction", key="btn_compact_preview"):
+            _compact_previews[_drop_unknown] = compact_tables(dry_run=True, drop_unknown_steps=_drop_unknown)
+        _compact_preview = _compact_previews.get(_drop_unknown)
+        if _compact_preview is not None:
+            st.dataframe(pd.DataFrame(list(_compact_preview.items()), columns=["", "rows"]),
+                         width="stretch", hide_index=True)
+            if st.button("🧹 Compact Tables", key="btn_compact"):
+                with st.spinner("Compacting…"):
+                    compact_tables(drop_unknown_steps=_drop_unknown)
+                st.session_state.pop("compact_preview", None)
+                st.success("✅ Tables compacted.")
+                time.sleep(0.5)
+                st.rerun()
+    except ConnectionError as exc:
+        show_gs_error(exc)
+
+    st.markdown("---")
+
+    # ── Case IDs ─────────────────────────────────────────
+    st.subheader("Case IDs")
+    st.caption("Cases saved before time-ordered IDs keep a random case ID. Migrating gives each a "
+               "time-ordered ID from its case date and records the old ID in the case_id_map sheet.")
+    try:
+        if st.button("🔍 Preview Case ID Migration", key="btn_migrate_ids_preview"):
+            st.session_state["case_ids_preview"] = migrate_case_ids(dry_run=True)
+        _ids_preview = st.session_state.get("case_ids_preview")
+        if _ids_preview is not None and not _ids_preview["rows_rewritten"]:
+            st.info("Every case already has a time-ordered ID.")
+        elif _ids_preview is not None:
+            st.dataframe(pd.DataFrame([(k, ", ".join(v) if isinstance(v, list) else str(v))
+                                       for k, v in _ids_preview.items()], columns=["", "rows"]),
+                         width="stretch", hide_index=True)
+            if st.button("🔢 Migrate Case IDs", key="btn_migrate_ids"):
+                with st.spinner("Migrating case IDs…"):
+                    migrate_case_ids()
+                st.session_state.pop("case_ids_preview", None)
+                st.success("✅ Case IDs migrated.")
+                time.sleep(0.5)
+                st.rerun()
+    except ConnectionError as exc:
+        show_gs_error(exc)
+
+    st.markdown("---")
+
+    # ── Cohort workbook ──────────────────────────────────
+    st.subheader("Cohort Workbook")
+    st.caption("One Excel workbook for a class: a sheet per procedure, a row per resident, and the Most "
+               "Recent and Best rating for every step in the passport colours. Built when downloaded.")
+    try:
+        _cohort_roster = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+        _cohort_res = st.multiselect("Residents (all when empty)", sorted(_cohort_roster["email"].astype(str).str.strip()),
+                                     key="cohort_residents")
+        _cohort_dates = st.date_input("Case dates (all when empty)", value=(), key="cohort_dates")
+        _cohort_since = _cohort_dates[0] if len(_cohort_dates) > 0 else None
+        _cohort_until = _cohort_dates[1] if len(_cohort_dates) > 1 else _cohort_since
+        st.download_button(
+            label="📊 Download Cohort Workbook",
+            data=functools.partial(cohort_workbook, current_tenant().id, _cohort_res or None,
+                                   _cohort_since, _cohort_until),
+            file_name="cohort_passport.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            key="dl_cohort_workbook",
+        )
+    except ConnectionError as exc:
+        show_gs_error(exc)
+
+    st.markdown("---")
+
+    # ── Case-log reconciliation ──────────────────────────
+    st.subheader("Case-Log Reconciliation")
+    st.caption("Upload a national case-log CSV export to find logged cases without a passport evaluation, "
+               "and evaluations missing from the case log. Rows match on resident, procedure and a case "
+               "date within the window; case-log procedure codes are mapped in the case_log_map sheet.")
+    _log_file = st.file_uploader("Case-log export (CSV)", type=["csv"], key="case_log_upload")
+    _log_window = st.number_input("Date window (days)", min_value=0, max_value=30,
+                                  value=CASE_LOG_WINDOW_DAYS, key="case_log_window")
+    if _log_file is not None:
+        try:
+            _log_df = pd.read_csv(io.BytesIO(_log_file.getvalue()), dtype=str, keep_default_na=False)
+            _rec = reconcile_case_log(_log_df, int(_log_window))
+        except (ValueError, pd.errors.ParserError) as exc:
+            st.error(f"❌ Could not read the case log: {exc}")
+        except ConnectionError as exc:
+            show_gs_error(exc)
+        else:
+            _sections = [("Logged, no passport case", "case_log_unmatched", _rec["unmatched_log"]),
+                         ("Passport cases not logged", "passport_unmatched", _rec["unmatched_cases"]),
+                         ("Matched", "case_log_matched", _rec["matched"])]
+            st.dataframe(pd.DataFrame([(label, len(df)) for label, _, df in _sections], columns=["", "rows"]),
+                         width="stretch", hide_index=True)
+
+            if _rec["unmapped_procedures"]:
+                st.warning(f"{len(_rec['unmapped_procedures'])} case-log procedure(s) are not mapped to a "
+                           "passport procedure yet.")
+                _, _map_procs, _, _ = load_refs()
+                _map_edit = st.data_editor(
+                    pd.DataFrame({"case_log_procedure": _rec["unmapped_procedures"], "procedure_id": None}),
+                    column_config={"procedure_id": st.column_config.SelectboxColumn(
+                        "Passport procedure", options=sorted(_map_procs["procedure_id"].astype(str).str.strip()))},
+                    disabled=["case_log_procedure"], hide_index=True, width="stretch", key="case_log_map_editor")
+                if st.button("💾 Save Mapping", key="btn_case_log_map"):
+                    try:
+                        saved = save_case_log_map(dict(zip(_map_edit["case_log_procedure"], _map_edit["procedure_id"])))
+                        clear_read_caches()
+                        st.success(f"✅ Mapped {saved} procedure(s).")
+                        time.sleep(0.5)
+                        st.rerun()
+                    except ConnectionError as exc:
+                        show_gs_error(exc)
+
+            for _label, _name, _df in _sections:
+                with st.expander(f"{_label} ({len(_df)})", expanded=_name != "case_log_matched" and not _df.empty):
+                    st.dataframe(_df, width="stretch", hide_index=True)
+                    st.download_button("⬇️ Download CSV", _df.to_csv(index=False).encode(),
+                                       file_name=f"{_name}.csv", mime="text/csv", key=f"dl_{_name}")
+
+    st.markdown("---")
+
+    # ── Backups ──────────────────────────────────────────
+    st.subheader("Backups")
+    st.caption("Compressed local copies of every table, kept as a full snapshot plus the rows changed "
+               "since. Run `passport_cli.py backup` from cron every few minutes; any table can be "
+               "restored as it was at a given time (UTC).")
+    if st.button("💾 Back Up Now", key="btn_backup"):
+        try:
+            with st.spinner("Backing up…"):
+                _backup = backup_tables()
+            st.session_state.pop("backup_history", None)
+            st.success(f"✅ Backed up; {sum(r['snapshot'] in ('full', 'delta') for r in _backup)} table(s) changed.")
+            time.sleep(0.5)
+            st.rerun()
+        except RuntimeError as exc:
+            st.warning(str(exc))
+        except ConnectionError as exc:
+            show_gs_error(exc)
+    # The catalogs grow with every run and a restore preview replays a chain of
+    # snapshots, so both are only read when asked for.
+    if st.button("🗂️ Show Backups", key="btn_backup_history"):
+        st.session_state["backup_history"] = backup_history()
+        st.session_state.pop("restore_preview", None)
+    _history = st.session_state.get("backup_history")
+    if _history is not None and _history.empty:
+        st.info("No backups yet.")
+    elif _history is not None:
+        st.dataframe(_history.groupby("table", sort=False).tail(1)[["table", "taken_at", "kind", "rows", "added", "removed"]],
+                     width="stretch", hide_index=True)
+        _reference, _appended = backed_up_tables()
+        _rcols = st.columns(3)
+        _restore_table = _rcols[0].selectbox("Table", _reference + _appended, key="restore_table")
+        _restore_day = _rcols[1].date_input("As of (UTC)", value=datetime.date.today(), key="restore_day")
+        _restore_time = _rcols[2].time_input("Time (UTC)", value=datetime.time(23, 59), key="restore_time")
+        _restore_at = pd.Timestamp(datetime.datetime.combine(_restore_day, _restore_time))
+        # Previews are kept per table and time, so changing either asks for a new one.
+        _restore_previews = st.session_state.setdefault("restore_preview", {})
+        if st.button("🔍 Preview Restore", key="btn_restore_preview"):
+            try:
+                _restore_previews[(_restore_table, _restore_at)] = restore_table(_restore_table, _restore_at, dry_run=True)
+            except LookupError as exc:
+                st.info(str(exc))
+        _restore_preview = _restore_previews.get((_restore_table, _restore_at))
+        if _restore_preview is not None:
+            st.caption(f"{_restore_table} as of {_restore_at:%Y-%m-%d %H:%M} UTC: {len(_restore_preview)} rows.")
+            with st.expander("Preview"):
+                st.dataframe(_restore_preview, width="stretch", hide_index=True)
+            if st.button("⏪ Restore Table", key="btn_restore_table"):
+                try:
+                    with st.spinner("Restoring…"):
+                        restore_table(_restore_table, _restore_at)
+                    st.session_state.pop("restore_preview", None)
+                    st.success(f"✅ {_restore_table} restored.")
+                    time.sleep(0.5)
+                    st.rerun()
+                except ConnectionError as exc:
+                    show_gs_error(exc)
+
+    st.markdown("---")
+
+    # ── Event journal ────────────────────────────────────
+    st.subheader("Event Journal")
+    st.caption("Every table write is also recorded as an event in an append-only journal, so tables and "
+               "derived views can be rebuilt by replay (`passport_cli.py journal replay`). Record a baseline "
+               "after editing sheets outside the app.")
+    if event_journal() is None:
+        st.info("No journal configured — set JOURNAL_PATH in secrets to start one.")
+    else:
+        _journal = journal_status()
+        if _journal.empty:
+            st.info("The journal is empty; record a baseline to start it.")
+        else:
+            st.dataframe(_journal, width="stretch", hide_index=True)
+        _jcols = st.columns(2)
+        with _jcols[0]:
+            if st.button("📸 Record Baseline", key="btn_journal_baseline"):
+                try:
+                    with st.spinner("Recording every sheet…"):
+                        record_journal_baseline()
+                    st.success("✅ Baseline recorded.")
+                    time.sleep(0.5)
+                    st.rerun()
+                except ConnectionError as exc:
+                    show_gs_error(exc)
+        with _jcols[1]:
+            if not _journal.empty and st.button("🧷 Checkpoint Now", key="btn_journal_checkpoint"):
+                with st.spinner("Checkpointing…"):
+                    _seq = checkpoint_journal()
+                st.success(f"✅ Checkpoint at event {_seq}.")
+
+    st.markdown("---")
+
+    # ── Write metrics ────────────────────────────────────
+    st.subheader("Write Metrics")
+    st.caption("Writes made by this server process since it started. Each table is written by one "
+               "session at a time; lock wait is time spent queued behind other sessions.")
+    _metrics = write_metrics()
+    if _metrics.empty:
+        st.info("No writes yet.")
+    else:
+        st.dataframe(_metrics, width="stretch", hide_index=True)
+
     st.markdown("---")
     col1, col2 = st.columns(2)
     with col1:
@@ -688,6 +817,267 @@ elif page == "admin":
             go_to("home")
 
 
+# ════════════════════════════════════════════════════════════
+# PAGE: PROGRAM ANALYTICS (admin)
+# ════════════════════════════════════════════════════════════
+elif page == "analytics":
+    st.title("📈 Program Analytics")
+    if st.session_state.get("resident") not in ADMINS:
+        st.error("Program analytics are only available to admins.")
+        st.stop()
+    _top_cols_an = st.columns([1, 1, 4])
+    with _top_cols_an[0]:
+        if st.button("⚙️ Admin Panel", key="analytics_admin_top"):
+            go_to("admin")
+    with _top_cols_an[1]:
+        if st.button("🔄 Rebuild", key="analytics_rebuild"):
+            reset_derived_views()
+            st.rerun()
+
+    try:
+        cube = get_derived_view("analytics")
+        _, procs_df, _, _ = load_refs()
+    except ConnectionError as exc:
+        show_gs_error(exc)
+        st.stop()
+
+    proc_summary = cube.tables.get("procedures")
+    if proc_summary is None or proc_summary.empty:
+        st.info("No assessment data yet.")
+        st.stop()
+
+    procs_map = dict(zip(procs_df["procedure_id"].astype(str), procs_df["procedure_name"].astype(str)))
+    selected_proc = st.selectbox(
+        "Procedure",
+        options=sorted(proc_summary["procedure_id"].tolist(), key=lambda x: procs_map.get(x, x)),
+        format_func=lambda x: procs_map.get(x, x),
+        key="analytics_proc",
+    )
+
+    _p = proc_summary[proc_summary["procedure_id"] == selected_proc].iloc[0]
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Cases", int(_p["cases"]))
+    m2.metric("Residents", int(_p["residents"]))
+    m3.metric("Attendings", int(_p["attendings"]))
+
+    steps_tbl = cube.tables["steps"]
+    steps_tbl = steps_tbl[steps_tbl["procedure_id"] == selected_proc].copy()
+    steps_tbl["step_order"] = pd.to_numeric(steps_tbl["step_order"], errors="coerce")
+    steps_tbl = steps_tbl.sort_values("step_order")
+    _step_label = dict(zip(steps_tbl["step_id"], steps_tbl["step_name"].fillna(steps_tbl["step_id"])))
+
+    st.markdown("#### Autonomy by Step")
+    st.caption(
+        "Ratings on the 0–5 scale (Shown/Told = 0 … Auto = 5); 'Not Assessed' is excluded. "
+        "Time to first Auto counts the resident's cases of this procedure up to their first Auto on the step."
+    )
+    st.dataframe(
+        steps_tbl.rename(columns={
+            "step_name":            "Step",
+            "ratings":              "Ratings",
+            "residents":            "Residents",
+            "p25":                  "P25",
+            "median":               "Median",
+            "p75":                  "P75",
+            "p90":                  "P90",
+            "pct_reached_auto":     "% Reached Auto",
+            "median_cases_to_auto": "Median Cases to Auto",
+            "median_days_to_auto":  "Median Days to Auto",
+        })[["Step", "Ratings", "Residents", "P25", "Median", "P75", "P90",
+            "% Reached Auto", "Median Cases to Auto", "Median Days to Auto"]]
+        .style.format({"% Reached Auto": "{:.0%}", "P25": "{:.1f}", "Median": "{:.1f}",
+                       "P75": "{:.1f}", "P90": "{:.1f}", "Median Cases to Auto": "{:.0f}",
+                       "Median Days to Auto": "{:.0f}"}, na_rep="—"),
+        width="stretch",
+        hide_index=True,
+    )
+
+    def _mean_matrix(df: pd.DataFrame, col: str) -> pd.DataFrame:
+        """Step × `col` matrix of mean rating for the selected procedure."""
+        df = df[df["procedure_id"] == selected_proc]
+        mat = df.pivot_table(index="step_id", columns=col, values="mean", aggfunc="first")
+        mat = mat.reindex([s for s in steps_tbl["step_id"] if s in mat.index])
+        mat.index = [_step_label.get(s, s) for s in mat.index]
+        return mat
+
+    st.markdown("#### Mean Rating by Attending")
+    st.dataframe(_mean_matrix(cube.tables["by_attending"], "attending_name").style.format("{:.1f}", na_rep="—"),
+                 width="stretch")
+
+    st.markdown("#### Mean Rating by Case Complexity")
+    _cx = _mean_matrix(cube.tables["by_complexity"], "case_complexity")
+    _cx = _cx[[c for c in COMPLEXITY_HEX if c in _cx.columns] + [c for c in _cx.columns if c not in COMPLEXITY_HEX]]
+    st.dataframe(_cx.style.format("{:.1f}", na_rep="—"), width="stretch")
+
+    st.markdown("#### Readiness for Autonomy")
+    st.caption(
+        f"Readiness is each resident's mean rating on a step, 0–100 (Auto = 100), weighting recent and complex "
+        f"cases more. Evidence is that weight as of today in Moderate cases; a step is ready at a readiness of "
+        f"{READINESS_THRESHOLD}+ on {READINESS_MIN_EVIDENCE:g}+ evidence. Click a column to sort."
+    )
+    try:
+        _ready = get_derived_view("readiness").table(selected_proc)
+        residents_df = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    except ConnectionError as exc:
+        show_gs_error(exc)
+        st.stop()
+    if _ready.empty:
+        st.info("No ratings for this procedure yet.")
+    else:
+        _res_names = dict(zip(residents_df["email"].astype(str), residents_df["name"].astype(str)))
+        _step_rank = {s: i for i, s in enumerate(steps_tbl["step_id"])}
+        _ready = _ready.assign(_rank=_ready["step_id"].map(_step_rank)).sort_values(["resident_email", "_rank"])
+        st.dataframe(
+            pd.DataFrame({
+                "Resident":   _ready["resident_email"].map(lambda e: _res_names.get(e, e)),
+                "Step":       _ready["step_id"].map(lambda s: _step_label.get(s, s)),
+                "Readiness":  _ready["readiness"],
+                "Evidence":   _ready["evidence"],
+                "Ratings":    _ready["ratings"],
+                "Last Rated": _ready["last_rated"].dt.date,
+                "Ready":      _ready["ready"],
+            }).style.format({"Readiness": "{:.0f}", "Evidence": "{:.1f}"}, na_rep="—"),
+            width="stretch",
+            hide_index=True,
+        )
+
+
+# ════════════════════════════════════════════════════════════
+# PAGE: FEEDBACK SEARCH (admin)
+# ════════════════════════════════════════════════════════════
+elif page == "feedback_search":
+    st.title("🔎 Feedback Search")
+    if st.session_state.get("resident") not in ADMINS:
+        st.error("Feedback search is only available to admins.")
+        st.stop()
+    if st.button("⚙️ Admin Panel", key="search_admin_top"):
+        go_to("admin")
+
+    try:
+        comment_index = get_derived_view("comments")
+        _, procs_df, _, _ = load_refs()
+        residents_df = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    except ConnectionError as exc:
+        show_gs_error(exc)
+        st.stop()
+
+    procs_map = dict(zip(procs_df["procedure_id"].astype(str), procs_df["procedure_name"].astype(str)))
+    res_names = dict(zip(residents_df["email"].astype(str), residents_df["name"].astype(str)))
+    _docs = comment_index.docs.values()
+
+    query = st.text_input("Search attending comments", placeholder='e.g. hemostasis or "port placement"',
+                          key="fs_query")
+    f1, f2, f3, f4 = st.columns(4)
+    with f1:
+        sel_res = st.multiselect("Resident", sorted({d["resident_email"] for d in _docs}),
+                                 format_func=lambda e: res_names.get(e, e), key="fs_res")
+    with f2:
+        sel_proc = st.multiselect("Procedure", sorted({d["procedure_id"] for d in _docs},
+                                                      key=lambda x: procs_map.get(x, x)),
+                                  format_func=lambda x: procs_map.get(x, x), key="fs_proc")
+    with f3:
+        sel_att = st.multiselect("Attending", sorted({d["attending_name"] for d in _docs}), key="fs_att")
+    with f4:
+        date_range = st.date_input("Date range", value=(), key="fs_dates")
+
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to   = date_range[1] if len(date_range) > 1 else None
+    results = comment_index.search(query, residents=set(sel_res), procedure_ids=set(sel_proc),
+                                   attendings=set(sel_att), date_from=date_from, date_to=date_to)
+
+    st.caption(f"{len(results)} matching comment(s)" + (" — best matches first." if query.strip() else "."))
+    if results.empty:
+        st.info("No comments match these filters.")
+        st.stop()
+
+    results = results.assign(
+        Date=results["date"].apply(fmt_date),
+        Resident=results["resident_email"].map(lambda e: res_names.get(e, e)),
+        Procedure=results["procedure_id"].map(lambda x: procs_map.get(x, x)),
+        Attending=results["attending_name"],
+        Comments=results["notes"],
+    )
+    _cols = ["Date", "Resident", "Procedure", "Attending", "Comments"]
+    st.markdown(COMMENTS_TABLE_CSS, unsafe_allow_html=True)
+    st.markdown(comments_table_html(paginate(results, key="fs_page"), _cols), unsafe_allow_html=True)
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        results[_cols].to_excel(writer, index=False, sheet_name="Feedback")
+    st.download_button(
+        label="📥 Download results as Excel",
+        data=output.getvalue(),
+        file_name="feedback_search.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
+
+
+# ════════════════════════════════════════════════════════════
+# PAGE: ATTENDING EVALUATIONS (attendings see their own; admins pick one)
+# ════════════════════════════════════════════════════════════
+elif page == "attending_dashboard":
+    _is_admin = st.session_state.get("resident") in ADMINS
+    _own_key  = st.session_state.get("attending_key")
+    if not (_is_admin or _own_key):
+        st.error("Not logged in as an attending.")
+        st.stop()
+
+    try:
+        att_index = get_derived_view("attendings")
+        _, procs_df, _, _ = load_refs()
+        residents_df = read_sheet_df(SHEET_RESIDENTS, expected_cols=["email", "name", "specialty_id", "created_at"])
+    except ConnectionError as exc:
+        show_gs_error(exc)
+        st.stop()
+
+    if _is_admin:
+        st.title("🩺 Attending Evaluations")
+        if st.button("⚙️ Admin Panel", key="attdash_admin_top"):
+            go_to("admin")
+        _roster = att_index.attendings()
+        if _roster.empty:
+            st.info("No evaluations recorded yet.")
+            st.stop()
+        _labels = dict(zip(_roster["attending_key"],
+                           _roster["attending_name"] + " (" + _roster["evaluations"].astype(str) + ")"))
+        att_key = st.selectbox("Attending", list(_labels), format_func=_labels.get, key="attdash_attending")
+    else:
+        st.title("🩺 My Evaluations")
+        att_key = _own_key
+
+    evals = att_index.evaluations(att_key)
+    if evals.empty:
+        st.info("No evaluations submitted yet.")
+        st.stop()
+
+    procs_map = dict(zip(procs_df["procedure_id"].astype(str), procs_df["procedure_name"].astype(str)))
+    res_names = dict(zip(residents_df["email"].astype(str), residents_df["name"].astype(str)))
+    evals = evals.assign(
+        Resident=evals["resident_email"].map(lambda e: res_names.get(str(e), e)),
+        Procedure=evals["procedure_id"].map(lambda x: procs_map.get(str(x), x)),
+    )
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Evaluations", len(evals))
+    m2.metric("Residents", evals["resident_email"].nunique())
+    m3.metric("Procedures", evals["procedure_id"].nunique())
+
+    sel_res = st.multiselect("Resident", sorted(evals["Resident"].astype(str).unique()), key="attdash_res")
+    if sel_res:
+        evals = evals[evals["Resident"].isin(sel_res)]
+
+    evals, _ = sort_by_date(evals)
+    evals = evals.iloc[::-1].assign(
+        Date=lambda d: d["date"].apply(fmt_date),
+        Complexity=lambda d: d["case_complexity"].fillna(""),
+        Overall=lambda d: d["overall_performance"].fillna(""),
+        Comments=lambda d: d["notes"].fillna(""),
+    )
+    _cols = ["Date", "Resident", "Procedure", "Complexity", "Overall", "Comments"]
+    st.markdown(COMMENTS_TABLE_CSS, unsafe_allow_html=True)
+    st.markdown(comments_table_html(paginate(evals, key="attdash_page"), _cols), unsafe_allow_html=True)
+
+
 # ════════════════════════════════════════════════════════════
 # PAGE: HOME
 # ════════════════════════════════════════════════════════════
@@ -722,6 +1112,21 @@ elif page == "home":
             go_to("comments")
         st.markdown("</div>", unsafe_allow_html=True)
 
+    # ── All-procedures overview (from the summaries view; no score reads) ──
+    try:
+        _, _ov_procs, _ov_steps, _ = load_refs()
+        _overview = get_derived_view("summaries").overview(
+            st.session_state["resident"], _ov_steps,
+            dict(zip(_ov_procs["procedure_id"].astype(str), _ov_procs["procedure_name"].astype(str))),
+        )
+    except ConnectionError as exc:
+        show_gs_error(exc)
+        _overview = []
+    if _overview:
+        st.markdown("### 🗺️ Passport Overview")
+        st.caption("Most recent rating per step; hover a cell for the step, best rating and attempts.")
+        st.markdown(passport_overview_html(_overview), unsafe_allow_html=True)
+
 
 # ════════════════════════════════════════════════════════════
 # PAGE: START CASE
@@ -792,6 +1197,7 @@ elif page == "start":
             f"&procedure_id={st.session_state['procedure_id']}"
             f"&specialty_id={specialty_id}"
             f"&attending_name={safe_att}"
+            + (f"&tenant={current_tenant().id}" if len(tenants()) > 1 else "")
         )
         with st.expander("🔗 Magic Link for Attending (click to expand)", expanded=False):
             st.markdown(
@@ -983,13 +1389,10 @@ elif page == "comments":
             go_to("home")
         st.stop()
 
+    _date_range = st.date_input("Date range", value=(), key="comments_dates")
     try:
-        cases_df = read_sheet_df(
-            SHEET_CASES,
-            expected_cols=["case_id", "resident_email", "date", "specialty_id",
-                           "procedure_id", "attending_id", "notes",
-                           "case_complexity", "overall_performance"],
-        )
+        # Only the academic-year archives the range touches are read.
+        cases_df = read_cases_df(*[academic_year(d) for d in _date_range])
         procs_df = read_sheet_df(SHEET_PROCEDURES, expected_cols=["procedure_id", "procedure_name", "specialty_id"])
         atnds_df = read_sheet_df(SHEET_ATTENDINGS, expected_cols=["attending_id", "attending_name", "specialty_id", "email"])
     except ConnectionError as exc:
@@ -999,7 +1402,7 @@ elif page == "comments":
         st.stop()
 
     # Normalise case_id then deduplicate to prevent fan-out from duplicate rows.
-    cases_df["case_id"] = _norm_id(cases_df["case_id"])
+    cases_df["case_id"] = norm_id(cases_df["case_id"])
     cases_df = cases_df.drop_duplicates(subset=["case_id"])
 
     res_cases = cases_df[cases_df["resident_email"] == resident].copy()
@@ -1028,11 +1431,13 @@ elif page == "comments":
             "notes":          "Comments",
         })
         # Fix 1: format dates as MM-DD-YYYY — sort by datetime first, then format
-        merged["_date_sort"] = pd.to_datetime(merged["Date"], errors="coerce")
-        merged = merged[["Date", "Procedure", "Attending", "Comments", "_date_sort"]].sort_values("_date_sort", ascending=False).drop(columns=["_date_sort"])
+        # Date-sorted index: a date range resolves to a row slice by binary search.
+        merged, _comment_dates = sort_by_date(merged, "Date")
+        merged = merged[["Date", "Procedure", "Attending", "Comments", "case_id"]]
         merged["Date"] = merged["Date"].apply(fmt_date)
+        merged = merged.iloc[date_window(_comment_dates, *_date_range)].iloc[::-1]   # newest first
 
-        st.caption("💡 Tip: To screenshot the full table — on mobile use print preview; on desktop use File > Print (Cmd+P / Ctrl+P), then adjust the scale percentage down until all columns fit on one page before screenshotting.")
+        st.caption("💡 Tip: The table shows one page at a time — use Download as Excel below for every matching comment.")
 
         # Fix 8: procedure filter dropdown
         _proc_opts = ["All Procedures"] + sorted(merged["Procedure"].dropna().unique().tolist())
@@ -1040,31 +1445,21 @@ elif page == "comments":
         if _proc_filter != "All Procedures":
             merged = merged[merged["Procedure"] == _proc_filter]
 
+        _comment_query = st.text_input("Search comments", placeholder='e.g. hemostasis or "port placement"',
+                                       key="comments_search")
+        if _comment_query.strip():
+            try:
+                _hits = get_derived_view("comments").search(_comment_query, residents={resident})["case_id"]
+            except ConnectionError as exc:
+                show_gs_error(exc)
+                st.stop()
+            merged = merged.set_index("case_id").reindex([c for c in _hits if c in set(merged["case_id"])]).reset_index()
+        merged = merged.drop(columns=["case_id"])
+
         # Fix 8: render with wrapped Comments column using HTML table
-        st.markdown("""
-<style>
-.comments-tbl {width:100%;border-collapse:collapse;font-size:0.88rem;}
-.comments-tbl th {background:var(--secondary-background-color);padding:8px 10px;
-    text-align:left;border-bottom:2px solid #ccc;font-weight:600;}
-.comments-tbl td {padding:8px 10px;vertical-align:top;border-bottom:1px solid var(--secondary-background-color);}
-.comments-tbl td.date-col {white-space:nowrap;}
-.comments-tbl td.comments-col {white-space:pre-wrap;word-break:break-word;min-width:260px;}
-</style>""", unsafe_allow_html=True)
-
-        _rows_html = ""
-        for _, r in merged.reset_index(drop=True).iterrows():
-            _rows_html += (
-                f"<tr>"
-                f"<td class='date-col'>{html.escape(str(r['Date']))}</td>"
-                f"<td>{html.escape(str(r['Procedure']))}</td>"
-                f"<td>{html.escape(str(r['Attending']))}</td>"
-                f"<td class='comments-col'>{html.escape(str(r['Comments'])).replace(chr(10), '<br>')}</td>"
-                f"</tr>"
-            )
+        st.markdown(COMMENTS_TABLE_CSS, unsafe_allow_html=True)
         st.markdown(
-            "<table class='comments-tbl'>"
-            "<thead><tr><th>Date</th><th>Procedure</th><th>Attending</th><th>Comments</th></tr></thead>"
-            f"<tbody>{_rows_html}</tbody></table>",
+            comments_table_html(paginate(merged, key="comments_page"), ["Date", "Procedure", "Attending", "Comments"]),
             unsafe_allow_html=True,
         )
 
@@ -1098,12 +1493,8 @@ elif page == "cumulative":
         st.stop()
 
     try:
-        cases_df  = read_sheet_df(SHEET_CASES,  expected_cols=["case_id", "resident_email", "date",
-                                                                "specialty_id", "procedure_id",
-                                                                "attending_id", "notes",
-                                                                "case_complexity", "overall_performance"])
-        scores_df = read_sheet_df(SHEET_SCORES, expected_cols=["case_id", "step_id", "rating", "rating_num",
-                                                                "case_complexity", "overall_performance"])
+        cases_df  = read_cases_df()
+        scores_df = read_scores_df()
         steps_df  = read_sheet_df(SHEET_STEPS,  expected_cols=["step_id", "procedure_id", "step_order", "step_name"])
         procs_df  = read_sheet_df(SHEET_PROCEDURES, expected_cols=["procedure_id", "procedure_name", "specialty_id"])
         atnds_df  = read_sheet_df(SHEET_ATTENDINGS, expected_cols=["attending_id", "attending_name", "specialty_id", "email"])
@@ -1113,100 +1504,25 @@ elif page == "cumulative":
             go_to("home")
         st.stop()
 
-    # ── Pure-Python join pipeline (pandas-version-agnostic) ───────────────────
-    # Every case_id is coerced to a clean string at read time using native Python
-    # str() so no pandas dtype inference can silently break the join.
-
-    def _clean_id(val) -> str:
-        """str(x).strip() then remove a trailing .0 left by float→str conversion."""
-        s = str(val).strip()
-        return s[:-2] if s.endswith(".0") else s
-
-    # Build a dict of case_id → case-metadata for this resident only.
-    # Duplicates are handled by last-write-wins (same result as drop_duplicates).
-    atnds_lookup = {
-        str(r.get("attending_id", "")): str(r.get("attending_name", ""))
-        for _, r in atnds_df.iterrows()
-    }
     procs_map = {
         str(r.get("procedure_id", "")): str(r.get("procedure_name", ""))
         for _, r in procs_df.iterrows()
     }
 
-    resident_cases: dict = {}  # clean_case_id → metadata dict
-    for _, row in cases_df.iterrows():
-        if str(row.get("resident_email", "")).strip() != str(resident).strip():
-            continue
-        cid = _clean_id(row.get("case_id", ""))
-        if not cid or cid == "nan":
-            continue
-        aid = str(row.get("attending_id", ""))
-        resident_cases[cid] = {
-            "case_id":             cid,
-            "date":                str(row.get("date", "")),
-            "case_procedure_id":   str(row.get("procedure_id", "")),
-            "attending_name":      attending_display_name(aid, atnds_lookup),
-            "case_complexity":     row.get("case_complexity"),
-            "overall_performance": row.get("overall_performance"),
-        }
-
-    if not resident_cases:
+    _res_emails = cases_df["resident_email"].astype(str).str.strip()
+    if not (_res_emails == str(resident).strip()).any():
         st.info("No cases logged yet.")
         if st.button("⬅️ Back to Home"):
             go_to("home")
         st.stop()
 
-    # Build a dict of step_id → step-metadata.
-    steps_lookup: dict = {}
-    for _, row in steps_df.iterrows():
-        sid = str(row.get("step_id", "")).strip()
-        if not sid or sid == "nan":
-            continue
-        steps_lookup[sid] = {
-            "step_procedure_id": str(row.get("procedure_id", "")),
-            "step_name":         str(row.get("step_name", "")),
-            "step_order":        row.get("step_order", 0),
-        }
-
-    # Walk every score row; look up case + step with dict gets — no merge needed.
-    seen_case_step: set = set()   # deduplicate (case_id, step_id) pairs
-    merged_rows: list = []
-    for _, row in scores_df.iterrows():
-        cid = _clean_id(row.get("case_id", ""))
-        if cid not in resident_cases:
-            continue
-        sid = str(row.get("step_id", "")).strip()
-        if not sid or sid == "nan":
-            continue
-        key = (cid, sid)
-        if key in seen_case_step:
-            continue
-        seen_case_step.add(key)
-        step_meta = steps_lookup.get(sid, {})
-        merged_rows.append({
-            "case_id":             cid,
-            "step_id":             sid,
-            "rating":              str(row.get("rating", "")),
-            "rating_num":          row.get("rating_num"),
-            **resident_cases[cid],
-            "step_procedure_id":   step_meta.get("step_procedure_id", ""),
-            "step_name":           step_meta.get("step_name", ""),
-            "step_order":          step_meta.get("step_order", 0),
-        })
-
-
-
-    if not merged_rows:
+    merged = resident_passport_rows(cases_df, scores_df, steps_df, atnds_df, resident)
+    if merged.empty:
         st.info("No assessment data yet.")
         if st.button("⬅️ Back to Home"):
             go_to("home")
         st.stop()
 
-    merged = pd.DataFrame(merged_rows)
-    # Alias so the rest of the page (which references case_procedure_id) works unchanged.
-    if "case_procedure_id" not in merged.columns:
-        merged["case_procedure_id"] = ""
-
     # ── Procedure selector ────────────────────────────────
     proc_ids      = merged["case_procedure_id"].dropna().unique()
     selected_proc = st.selectbox(
@@ -1216,11 +1532,7 @@ elif page == "cumulative":
     )
 
     proc_data = merged[merged["case_procedure_id"] == selected_proc].copy()
-    ordered_steps = (
-        steps_df[steps_df["procedure_id"] == selected_proc]
-        .sort_values("step_order")["step_name"]
-        .tolist()
-    )
+    pivot, ordered_steps = procedure_pivot(proc_data, steps_df, selected_proc)
 
     # Build display names for step column headers.
     # With writing-mode: vertical-rl + rotate(180deg) + justify-content: flex-end,
@@ -1234,55 +1546,73 @@ elif page == "cumulative":
     _step_display        = {s: _fmt_step_hdr(s) for s in ordered_steps}
     ordered_steps_display = [_step_display[s] for s in ordered_steps]
 
-    # ── Pivot for heatmap ─────────────────────────────────
-    pivot = proc_data.pivot_table(
-        index=["date", "attending_name", "case_id", "case_complexity", "overall_performance"],
-        columns="step_name",
-        values="rating",
-        aggfunc="first",
-    ).reset_index()
-
-    for step in ordered_steps:
-        if step not in pivot.columns:
-            pivot[step] = pd.NA
-
-    pivot = pivot[["date", "attending_name", "case_id", "case_complexity", "overall_performance"] + ordered_steps]
-
     # ── Screenshot-friendly heatmap ──────────────────────────────
     proc_display_name = procs_map.get(selected_proc, selected_proc)
     st.markdown(
         f"### {proc_display_name} — Progress Heatmap\n"
-        "Most recent cases at the top. Zoom out to screenshot this grid. 📸"
+        "Most recent cases at the top."
     )
-    st.caption("💡 Tip: To screenshot the full table — on mobile use print preview; on desktop use File > Print (Cmd+P / Ctrl+P), then adjust the scale percentage down until all columns fit on one page before screenshotting.")
-
-    # Sort cases by date (desc) for Most Recent computation and display
-    pivot_sorted = pivot.sort_values("date", ascending=False)
-
-    # Compute "Most Recent" summary row — per step, first non-null, non-"Not Assessed" value
-    # Label is placed in attending_name so it appears under Attending column (right side of metadata)
-    _mr = {"date": "", "attending_name": "📌 Most Recent", "case_complexity": pd.NA, "overall_performance": pd.NA}
-    for _s in ordered_steps:
-        _vals = pivot_sorted[_s].dropna()
-        _vals = _vals[_vals != "Not Assessed"]
-        _mr[_s] = _vals.iloc[0] if not _vals.empty else pd.NA
 
-    # Compute "Best" summary row — per step, highest rating_num ever
-    _best = {"date": "", "attending_name": "🏆 Best", "case_complexity": pd.NA, "overall_performance": pd.NA}
-    for _s in ordered_steps:
-        _vals = pivot_sorted[_s].dropna()
-        if _vals.empty:
-            _best[_s] = pd.NA
-        else:
-            _best[_s] = max(_vals.tolist(), key=lambda v: RATING_TO_NUM.get(v, -1))
+    # Server-rendered exports; files are only generated when a button is clicked.
+    _export_ver = frame_version(merged[["case_id", "step_id", "rating", "date", "attending_name",
+                                        "case_complexity", "overall_performance"]].astype(str))
+    _export_sub = f"{st.session_state.get('resident_name', '')} ({resident})"
+    _tenant_id  = current_tenant().id
+    _this_proc  = [(proc_display_name, pivot, ordered_steps)]
+    _exp_cols   = st.columns(3)
+    with _exp_cols[0]:
+        st.download_button(
+            label="📄 PDF — this procedure",
+            data=functools.partial(passport_export, _tenant_id, resident, f"{_export_ver}:{selected_proc}",
+                                   "pdf", _this_proc, _export_sub),
+            file_name=f"{resident}_{selected_proc}_passport.pdf",
+            mime="application/pdf",
+            key="dl_passport_pdf",
+        )
+    with _exp_cols[1]:
+        st.download_button(
+            label="📚 PDF — all procedures",
+            data=lambda: passport_export(_tenant_id, resident, f"{_export_ver}:all", "pdf",
+                                         resident_passport_sections(merged, steps_df, procs_map), _export_sub),
+            file_name=f"{resident}_passport.pdf",
+            mime="application/pdf",
+            key="dl_passport_pdf_all",
+        )
+    with _exp_cols[2]:
+        st.download_button(
+            label="🖼️ PNG — this procedure",
+            data=functools.partial(passport_export, _tenant_id, resident, f"{_export_ver}:{selected_proc}",
+                                   "png", _this_proc, _export_sub),
+            file_name=f"{resident}_{selected_proc}_passport.png",
+            mime="image/png",
+            key="dl_passport_png",
+        )
 
-    _summary_df = pd.DataFrame([_mr, _best])
+    # "Most Recent", "Best" and "Readiness" summary rows, read from the incrementally
+    # maintained views; labels sit under the Attending column
+    _proc_steps = steps_df[steps_df["procedure_id"] == selected_proc].sort_values("step_order")
+    _step_cols  = list(zip(_proc_steps["step_id"].astype(str).str.strip(), _proc_steps["step_name"]))
+    _summary_df = get_derived_view("summaries").summary_rows(resident, selected_proc, _step_cols)
+    # The readiness row is colored as the nearest rating and labeled with its 0–100 score.
+    _ready_df   = get_derived_view("readiness").summary_row(resident, selected_proc, _step_cols)
+    _ready_text = [f"{_ready_df.at[0, s]:.0f}" if s in _ready_df and pd.notna(_ready_df.at[0, s]) else " "
+                   for s in ordered_steps]
+    _ready_df   = _ready_df.assign(**{s: readiness_rating(_ready_df.at[0, s]) if s in _ready_df else pd.NA
+                                      for s in ordered_steps})
     _meta_cols  = ["date", "attending_name", "case_complexity", "overall_performance"]
 
+    # Only a window of case rows is rendered: a date range (binary search over the
+    # date-sorted pivot) and then one page. Summaries and exports use the full history.
+    _pivot_asc, _pivot_dates = sort_by_date(pivot)
+    _hm_range = st.date_input("Cases between", value=(), key="cum_dates")
+    _hm_rows  = _pivot_asc.iloc[date_window(_pivot_dates, *_hm_range)].iloc[::-1]
+    _hm_rows  = paginate(_hm_rows, key="cum_page", page_size=HEATMAP_PAGE_SIZE)
+
     # Build display df: summary rows first, then sorted case rows (case_id dropped)
     display_df = pd.concat(
         [_summary_df[_meta_cols + ordered_steps],
-         pivot_sorted.drop(columns=["case_id"])[_meta_cols + ordered_steps]],
+         _ready_df[_meta_cols + ordered_steps],
+         _hm_rows.drop(columns=["case_id"])[_meta_cols + ordered_steps]],
         ignore_index=True,
     )
 
@@ -1320,18 +1650,19 @@ elif page == "cumulative":
     # Step 2: blank ALL rating columns so no text appears in any cell
     for _c in _rating_cols:
         display_df[_c] = " "
+    for _i, _text in enumerate(_ready_text):
+        display_df.iloc[2, len(_meta_cols) + _i] = _text
 
     # Determine "never attempted" step columns: every non-summary data cell is
     # NaN or "Not Assessed" (step was never meaningfully attempted by this resident).
+    # Judged on the full history, not just the rows on this page.
     _never_attempted_cols = set()
-    _n_summary = 2  # rows 0 and 1 are Most Recent / Best
-    for _sc in ordered_steps_display:
-        if _sc not in _orig_vals:
-            continue
-        _data_vals = _orig_vals[_sc].iloc[_n_summary:]
+    _n_summary = 3  # rows 0–2 are Most Recent / Best / Readiness
+    for _s in ordered_steps:
+        _data_vals = pivot[_s]
         _meaningful = _data_vals[~(_data_vals.isna() | (_data_vals == "Not Assessed"))]
         if _meaningful.empty:
-            _never_attempted_cols.add(_sc)
+            _never_attempted_cols.add(_step_display[_s])
 
     # Color functions — operate on original (pre-blank) values
     def _color_step(val, col=None):
@@ -1433,21 +1764,17 @@ elif page == "cumulative":
             {"selector": "thead tr:last-child th", "props": [("border-bottom", "2px solid #555")]},
             # Strong horizontal borders between data rows
             {"selector": "tbody tr", "props": [("border-bottom", "1px solid #bbb")]},
-            # Summary rows (first two) — strong bottom border
-            {"selector": "tbody tr:nth-child(1)", "props": [("border-bottom", "2px solid #555")]},
-            {"selector": "tbody tr:nth-child(2)", "props": [("border-bottom", "2px solid #555")]},
+            # Summary rows (first three) — strong bottom border
+            {"selector": "tbody tr:nth-child(-n+3)", "props": [("border-bottom", "2px solid #555")]},
             # Summary row labels: right-justify in the Attending (2nd) column;
             # visually merge Date+Attending by removing their shared border.
-            {"selector": "tbody tr:nth-child(1) td:nth-child(1)",
-             "props": [("border-right", "none")]},
-            {"selector": "tbody tr:nth-child(2) td:nth-child(1)",
+            {"selector": "tbody tr:nth-child(-n+3) td:nth-child(1)",
              "props": [("border-right", "none")]},
-            {"selector": "tbody tr:nth-child(1) td:nth-child(2)",
-             "props": [("text-align", "right"), ("font-weight", "600"),
-                       ("padding-right", "6px"), ("border-left", "none")]},
-            {"selector": "tbody tr:nth-child(2) td:nth-child(2)",
+            {"selector": "tbody tr:nth-child(-n+3) td:nth-child(2)",
              "props": [("text-align", "right"), ("font-weight", "600"),
                        ("padding-right", "6px"), ("border-left", "none")]},
+            # Readiness scores are the only text in step cells
+            {"selector": "tbody tr:nth-child(3) td", "props": [("font-size", "0.7rem"), ("font-weight", "600")]},
         ]
         # Vertical step headers: writing-mode + rotate(180deg) makes text read bottom-to-top.
         # vertical-align: bottom anchors text to the visual bottom of the header cell.
@@ -1509,45 +1836,24 @@ elif page == "cumulative":
         unsafe_allow_html=True,
     )
 
+    # ── Learning curves ───────────────────────────────────
+    st.markdown("#### 📈 Learning Curves")
+    _lc_window = st.select_slider("Rolling window (cases)", options=[1, 2, 3, 4, 5], value=3,
+                                  key="lc_window")
+    _lc_data = proc_data[["case_id", "date", "step_name", "rating", "overall_performance"]]
+    st.image(
+        learning_curve_png(current_tenant().id, resident, selected_proc, frame_version(_lc_data), _lc_window,
+                           _lc_data, ordered_steps, title=proc_display_name),
+        width="stretch",
+    )
+
     # ── Excel export ──────────────────────────────────────
     st.markdown("---")
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        # Rename pivot columns for readability; fix 1: date as MM-DD-YYYY
-        pivot_excel = pivot.copy()
-        pivot_excel["date"] = pivot_excel["date"].apply(fmt_date)
-        pivot_excel = pivot_excel.rename(columns={
-            "date":                "Date",
-            "attending_name":      "Attending",
-            "case_id":             "Case ID",
-            "case_complexity":     "Case Complexity",
-            "overall_performance": "Overall Performance",
-        })
-        pivot_excel.to_excel(writer, index=False, sheet_name="Cumulative")
-        ws_xl = writer.sheets["Cumulative"]
-        from openpyxl.styles import PatternFill, Font
-
-        step_fill_map = {k: v.lstrip("#") for k, v in RATING_HEX.items() if k not in ("Not Assessed",)}
-        step_fill_map["Not Assessed"] = "E0E0E0"  # light gray in Excel
-
-        start_col = 6
-        for xl_row in ws_xl.iter_rows(
-            min_row=2, max_row=ws_xl.max_row,
-            min_col=start_col, max_col=5 + len(ordered_steps),
-        ):
-            for cell in xl_row:
-                val = cell.value
-                if val in step_fill_map:
-                    cell.fill = PatternFill(
-                        start_color=step_fill_map[val],
-                        end_color=step_fill_map[val],
-                        fill_type="solid",
-                    )
-                    cell.font = Font(color="FFFFFF" if val in ("Not Yet", "Auto") else "000000")
+    output = cumulative_workbook([("Cumulative", pivot, ordered_steps)])
 
     st.download_button(
         label=f"📥 Download Excel — {procs_map.get(selected_proc, selected_proc)}",
-        data=output.getvalue(),
+        data=output,
         file_name=f"{resident}_{selected_proc}_cumulative.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
@@ -1574,15 +1880,12 @@ elif page == "attending_assessment":
 
     st.title("📝 Attending Evaluation")
     try:
-        _, proc_df_att, steps_df, _ = load_refs()
+        # Narrow fetch: only this procedure's name and steps, not every reference table.
+        _att_proc_name, steps = load_procedure(procedure_id)
     except ConnectionError as exc:
         show_gs_error(exc)
         st.stop()
 
-    # Resolve procedure name for display (Fix 3)
-    _att_proc_rows = proc_df_att.loc[proc_df_att["procedure_id"] == procedure_id, "procedure_name"].values
-    _att_proc_name = _att_proc_rows[0] if len(_att_proc_rows) else procedure_id
-
     st.markdown(
         f'<div class="pp-card">'
         f'<b>Resident:</b> {resident_email}<br>'
@@ -1592,7 +1895,6 @@ elif page == "attending_assessment":
         unsafe_allow_html=True,
     )
 
-    steps = steps_df[steps_df["procedure_id"] == procedure_id].sort_values("step_order")
     if steps.empty:
         st.error("This procedure has no defined steps. Please contact the program coordinator.")
         st.stop()
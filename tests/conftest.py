@@ -0,0 +1,72 @@
+"""Shared fixtures: each test runs against the offline Sheets backend (passport_local_sheets).
+
+    python -m pytest -q
+"""
+import csv
+import os
+import shutil
+import sys
+
+import pytest
+import streamlit as st
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import passport_core as core  # noqa: E402
+import passport_local_sheets  # noqa: E402
+
+REFERENCE_SHEETS = ("attendings", "procedures", "residents", "specialties", "steps")
+
+
+def _seed_dir(directory, cases: list, scores: list) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for name in REFERENCE_SHEETS:
+        shutil.copy(os.path.join(REPO, f"{name}.csv"), directory)
+    for table, cols, rows in ((core.SHEET_CASES, core.CASE_COLS, cases),
+                              (core.SHEET_SCORES, core.SCORE_COLS, scores)):
+        with open(os.path.join(directory, f"{table}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=cols, restval="")
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def _fresh_process_state() -> None:
+    # Clients, read caches and per-tenant state all live in Streamlit's caches.
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+@pytest.fixture
+def local_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHEETS_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_SHEETS_DIR", str(tmp_path))
+    for name in ("SHARED_CACHE_PATH", "JOURNAL_PATH", "JOURNAL_READS", "PASSPORT_TENANT", "BACKUP_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    yield tmp_path
+    _fresh_process_state()
+
+
+@pytest.fixture
+def local_sheets(local_env):
+    """seed(cases, scores) → the in-memory workbook the app reads, holding the
+    repository's reference sheets plus the given case and score rows (dicts)."""
+    def seed(cases: list = (), scores: list = ()):
+        _seed_dir(local_env, cases, scores)
+        _fresh_process_state()
+        return passport_local_sheets.local_workbook(str(local_env))
+    return seed
+
+
+@pytest.fixture
+def programs(local_env, monkeypatch):
+    """seed({tenant_id: (cases, scores)}, {tenant_id: settings}) → {tenant_id: workbook}, one local
+    program per tenant configured as [tenants.<id>] in secrets; the first is the default."""
+    def seed(rows: dict, settings: dict = None):
+        monkeypatch.setattr(st, "secrets", {"tenants": {
+            tid: {"name": tid.title(), **(settings or {}).get(tid, {})} for tid in rows}})
+        for tid, (cases, scores) in rows.items():
+            _seed_dir(local_env / tid, cases, scores)
+        _fresh_process_state()
+        return {tid: passport_local_sheets.local_workbook(str(local_env / tid)) for tid in rows}
+    return seed
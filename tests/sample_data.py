@@ -0,0 +1,43 @@
+"""Case and score rows the tests seed into the offline Sheets backend."""
+import datetime
+
+import pandas as pd
+
+import passport_core as core
+
+RESIDENT  = "jenkinph@ohsu.edu"
+LAP_STEPS = ["S_LAP_01", "S_LAP_02", "S_LAP_03", "S_LAP_04"]
+TODAY     = datetime.date.today().isoformat()
+
+# Legacy random case_ids spread over three completed academic years and the current one.
+HISTORY = [
+    ("a1f0c3d2e9b8", "2022-09-14", ["Prompt", "Steer", "Back up", "Auto"]),
+    ("123456789012", "2023-02-03", ["Steer", "Not Assessed", "Prompt", "Back up"]),
+    ("b7e6d5c4a3f2", "2023-11-20", ["Back up", "Prompt", "Auto", "Not Yet"]),
+    ("c0ffee000001", "2024-08-05", ["Auto", "Back up", "Shown/Told", "Prompt"]),
+    ("d15ea5e00002", "2025-03-30", ["Not Yet", "Auto", "Steer", "Not Assessed"]),
+    ("e0e0e0e0e0e0", TODAY,        ["Prompt", "Prompt", "Back up", "Auto"]),
+]
+
+
+def case(case_id: str, date: str, resident: str = RESIDENT, procedure_id: str = "LAPAPP") -> dict:
+    return {"case_id": case_id, "resident_email": resident, "date": date, "specialty_id": "GS",
+            "procedure_id": procedure_id, "attending_id": "A_GS_THANAWALA",
+            "case_complexity": "Moderate", "overall_performance": "3 - Prompt"}
+
+
+def scores(case_id: str, ratings: list, steps: list = LAP_STEPS) -> list:
+    return [{"case_id": case_id, "step_id": sid, "rating": r, "rating_num": core.RATING_TO_NUM[r],
+             "case_complexity": "Moderate", "overall_performance": "3 - Prompt"}
+            for sid, r in zip(steps, ratings)]
+
+
+def history(resident: str = RESIDENT) -> tuple:
+    """(cases, scores) of HISTORY, logged by `resident`."""
+    return ([case(cid, date, resident) for cid, date, _ in HISTORY],
+            [row for cid, _, ratings in HISTORY for row in scores(cid, ratings)])
+
+
+def score_keys(scores_df: pd.DataFrame) -> list:
+    return sorted(zip(core.norm_id(scores_df["case_id"]), scores_df["step_id"].astype(str).str.strip(),
+                      scores_df["rating"].astype(str)))
@@ -0,0 +1,85 @@
+"""The read-only JSON API: routes, bearer token, ETag revalidation and error statuses."""
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import passport_api as api
+import passport_core as core
+from sample_data import LAP_STEPS, RESIDENT, history
+
+
+@pytest.fixture
+def serve(local_sheets):
+    """serve(token="") → get(path, method="GET", **headers) → (status, headers, body) against a live server."""
+    servers = []
+
+    def start(token: str = ""):
+        server = api.serve_in_background(token=token)
+        servers.append(server)
+        base = f"http://127.0.0.1:{server.server_address[1]}{api.API_PREFIX}"
+
+        def get(path: str, method: str = "GET", **headers):
+            request = urllib.request.Request(base + path, method=method, headers=headers)
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    status, head, raw = response.status, response.headers, response.read()
+            except urllib.error.HTTPError as exc:
+                status, head, raw = exc.code, exc.headers, exc.read()
+            return status, head, json.loads(raw) if raw else None
+        return get
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unchanged_data_revalidates_with_a_304_and_no_sheet_reads(serve, local_sheets, monkeypatch):
+    monkeypatch.setattr(core, "TABLE_VERSION_TTL", 0)
+    wb = local_sheets(*history())
+    get = serve()
+    get(f"/residents/{RESIDENT}")   # the first read adds the optional sheets, a change in itself
+
+    status, head, body = get(f"/residents/{RESIDENT}")
+    assert status == 200 and body["procedures"][0]["cases"] == 6
+    etag = head["ETag"]
+
+    wb.reset_counters()
+    status, head, body = get(f"/residents/{RESIDENT}", **{"If-None-Match": etag})
+    assert (status, head["ETag"], body) == (304, etag, None)
+    assert wb.api_calls() == {"read": 1, "drive": 1}   # only the modification time was asked
+    status, head, body = get(f"/residents/{RESIDENT}", method="HEAD")
+    assert (status, head["ETag"], body) == (200, etag, None)
+    assert get("/residents", **{"If-None-Match": etag})[0] == 200   # tags are per URL
+
+    # A save — by this or any other replica, or in the sheet itself — changes the tag.
+    core.save_case(RESIDENT, "2025-05-01", "GS", "LAPAPP", "A_GS_THANAWALA", dict.fromkeys(LAP_STEPS, "Auto"))
+    status, head, body = get(f"/residents/{RESIDENT}", **{"If-None-Match": etag})
+    assert status == 200 and head["ETag"] != etag
+    assert body["procedures"][0]["cases"] == 7
+
+
+def test_token_missing_routes_and_failures_map_to_statuses(serve, local_sheets, monkeypatch):
+    local_sheets(*history())
+    get = serve(token="s3cret")
+    assert get("/health")[0] == 401
+    auth = {"Authorization": "Bearer s3cret"}
+    assert get("/health", **auth)[2]["sheets"] == "ok"
+    assert get("/nowhere", **auth)[0] == 404
+    assert get("/procedures/NOPE", **auth)[0] == 404
+    assert get("/cohort?tenant=other", **auth)[0] == 404
+
+    def unreachable(*args):
+        raise ConnectionError("Cannot reach Google Sheets")
+    monkeypatch.setattr(core, "get_derived_view", unreachable)
+    assert get("/cohort", **auth)[0] == 503
+
+    def broken(*args):
+        raise RuntimeError("bug")
+    monkeypatch.setattr(core, "get_derived_view", broken)
+    status, _, body = get("/cohort", **auth)
+    assert (status, body) == (500, {"error": "internal server error"})
+
+    with pytest.raises(ValueError):
+        api.make_server("0.0.0.0", 0, token="")
@@ -0,0 +1,41 @@
+"""Academic-year archive partitions of cases and scores."""
+import passport_core as core
+from sample_data import HISTORY, history, score_keys
+
+
+def test_archive_academic_years_moves_completed_years(local_sheets):
+    wb = local_sheets(*history())
+    scores_before = score_keys(core.read_scores_df())
+
+    preview = core.archive_academic_years(dry_run=True)
+    assert wb.table(core.SHEET_PARTITIONS) == []
+    assert len(wb.table(core.SHEET_CASES)) == len(HISTORY) + 1
+
+    report = core.archive_academic_years()
+    assert report == preview
+    assert {(r["table"], r["academic_year"], r["moved"]) for r in report} == {
+        (table, year, moved)
+        for year in ("2022-23", "2023-24", "2024-25")
+        for table, moved in ((core.SHEET_CASES, 1 if year == "2023-24" else 2),
+                             (core.SHEET_SCORES, 4 if year == "2023-24" else 8))
+    }
+    live = core.read_sheet_df(core.SHEET_CASES, expected_cols=core.CASE_COLS)
+    assert list(live["case_id"]) == [HISTORY[-1][0]]
+    assert sorted(core.norm_id(core.read_cases_df()["case_id"])) == sorted(cid for cid, _, _ in HISTORY)
+    assert score_keys(core.read_scores_df()) == scores_before
+    # Bounded reads only touch the archives they need.
+    assert set(core.norm_id(core.read_cases_df(2023, 2023)["case_id"])) == {"b7e6d5c4a3f2", HISTORY[-1][0]}
+
+    assert core.archive_academic_years() == []
+
+
+def test_archived_partitions_are_read_once_per_archival_run(local_sheets):
+    wb = local_sheets(*history())
+    core.archive_academic_years()
+    core.read_cases_df()
+    wb.reset_counters()
+
+    core.clear_read_caches()          # as after any save
+    assert len(core.read_cases_df()) == len(HISTORY)
+    # Only the catalog and the live sheet are fetched again, not the three archives.
+    assert wb.api_calls()["get"] == 2
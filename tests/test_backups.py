@@ -0,0 +1,48 @@
+"""Incremental local backups and point-in-time restore."""
+import passport_core as core
+from sample_data import case, history
+
+
+def _backup(local_env, monkeypatch) -> dict:
+    monkeypatch.setenv("BACKUP_DIR", str(local_env / "backups"))
+    return {r["table"]: r for r in core.backup_tables()}
+
+
+def _add_case(case_id: str) -> None:
+    core.append_sheet_rows(core.SHEET_CASES, [case(case_id, "2025-04-01")], core.CASE_COLS, unique_key="case_id")
+
+
+def test_backup_records_appends_as_deltas_and_restores_a_point_in_time(local_sheets, local_env, monkeypatch):
+    wb = local_sheets(*history())
+    first = _backup(local_env, monkeypatch)
+    assert first[core.SHEET_CASES]["snapshot"] == "full" and first[core.SHEET_CASES]["rows"] == 6
+
+    assert _backup(local_env, monkeypatch)[core.SHEET_CASES] == {
+        "table": core.SHEET_CASES, "snapshot": "unchanged", "downloaded": "none"}
+
+    _add_case("f00000000001")
+    second = _backup(local_env, monkeypatch)
+    assert {k: second[core.SHEET_CASES][k] for k in ("snapshot", "added", "removed", "downloaded")} == {
+        "snapshot": "delta", "added": 1, "removed": 0, "downloaded": "tail"}
+    assert second[core.SHEET_PROCEDURES]["snapshot"] == "unchanged"
+
+    taken = list(core.backup_history(core.SHEET_CASES)["taken_at"])
+    before = core.restore_table(core.SHEET_CASES, taken[0], dry_run=True)
+    assert len(before) == 6 and len(wb.table(core.SHEET_CASES)) == 8
+
+    core.restore_table(core.SHEET_CASES, taken[0])
+    assert [row[0] for row in wb.table(core.SHEET_CASES)[1:]] == list(before["case_id"])
+
+
+def test_backup_starts_a_new_chain_after_backup_full_every_deltas(local_sheets, local_env, monkeypatch):
+    local_sheets(*history())
+    monkeypatch.setattr(core, "BACKUP_FULL_EVERY", 2)
+    _backup(local_env, monkeypatch)
+    for n in range(3):
+        _add_case(f"f0000000000{n}")
+        _backup(local_env, monkeypatch)
+
+    catalog = core.backup_history(core.SHEET_CASES)
+    assert list(catalog["kind"]) == ["full", "delta", "delta", "full"]
+    assert list(catalog["rows"]) == [6, 7, 8, 9]
+    assert len(core.restore_table(core.SHEET_CASES, dry_run=True)) == 9
@@ -0,0 +1,77 @@
+"""Time-ordered case IDs and the legacy ID migration."""
+import pandas as pd
+
+import passport_core as core
+from sample_data import HISTORY, case, history, scores, score_keys
+
+
+def test_new_case_ids_sort_in_creation_order():
+    ids = [core.new_case_id() for _ in range(2000)]   # many share a millisecond
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    assert all(core.is_time_ordered_id(i) for i in ids)
+    assert abs(core.case_id_time(ids[-1]) - pd.Timestamp.now(tz="UTC")) < pd.Timedelta(seconds=5)
+
+    minted = core.new_case_id("2024-03-01T12:00:00Z")
+    assert core.case_id_time(minted) == pd.Timestamp("2024-03-01T12:00:00Z")
+    assert core.case_id_floor("2024-03-01T12:00:00") <= minted < core.case_id_floor("2024-03-01T12:00:00.001")
+    assert not core.is_time_ordered_id("a1f0c3d2e9b8") and core.case_id_time("a1f0c3d2e9b8") is None
+
+
+def test_case_id_window_bounds_by_time_and_leaves_legacy_ids_out():
+    minted = [core.new_case_id(f"2024-0{m}-15") for m in (1, 2, 3, 4)]
+    df = pd.DataFrame({"case_id": [minted[2], "a1f0c3d2e9b8", minted[0], minted[3], minted[1]]})
+    ordered, keys = core.sort_by_case_id(df)
+    assert list(ordered["case_id"]) == minted + ["a1f0c3d2e9b8"]
+
+    window = core.case_id_window(keys, since="2024-02-01", until="2024-04-01")
+    assert list(ordered["case_id"].iloc[window]) == minted[1:3]
+    assert list(ordered["case_id"].iloc[core.case_id_window(keys, since=minted[2])]) == minted[2:]
+    assert len(ordered.iloc[core.case_id_window(keys)]) == len(df)
+
+
+def test_migrate_case_ids_rewrites_live_and_archived_sheets(local_sheets):
+    local_sheets(*history())
+    core.archive_academic_years()
+    scores_before = core.read_scores_df()
+
+    preview = core.migrate_case_ids(dry_run=True)
+    assert preview["case_ids_mapped"] == len(HISTORY)
+    assert core.case_id_map() == {}
+
+    report = core.migrate_case_ids()
+    assert report["case_ids_mapped"] == len(HISTORY)
+    assert report["unmapped_score_ids"] == 0
+    mapping = core.case_id_map()
+    assert sorted(mapping) == sorted(cid for cid, _, _ in HISTORY)
+
+    cases = core.read_cases_df()
+    assert cases["case_id"].map(core.is_time_ordered_id).all()
+    for old, date, _ in HISTORY:
+        assert core.case_id_time(mapping[old]).date().isoformat() == date
+    migrated = core.read_scores_df()
+    assert set(core.norm_id(migrated["case_id"])) == set(cases["case_id"])
+    assert score_keys(migrated) == score_keys(
+        scores_before.assign(case_id=core.norm_id(scores_before["case_id"]).map(mapping)))
+
+    rerun = core.migrate_case_ids()
+    assert (rerun["case_ids_mapped"], rerun["previously_mapped"], rerun["rows_rewritten"]) == (0, len(HISTORY), 0)
+
+
+def test_case_id_map_grows_with_each_migration_and_ids_are_repeatable(local_sheets):
+    local_sheets(*history())
+    core.migrate_case_ids()
+    first = core.case_id_map()
+
+    # A legacy case restored from an old export after the first migration.
+    core.append_sheet_rows(core.SHEET_CASES, [case("0ld0ld0ld0ld", "2025-01-20")], core.CASE_COLS)
+    core.append_sheet_rows(core.SHEET_SCORES, scores("0ld0ld0ld0ld", ["Auto"]), core.SCORE_COLS)
+    report = core.migrate_case_ids()
+    assert (report["case_ids_mapped"], report["previously_mapped"]) == (1, len(HISTORY))
+    mapping = core.case_id_map()
+    assert {k: v for k, v in mapping.items() if k in first} == first
+    assert core.case_id_time(mapping["0ld0ld0ld0ld"]).date().isoformat() == "2025-01-20"
+
+    # Minting is a function of the rows, so a resumed run picks the same IDs.
+    legacy = pd.DataFrame([case(cid, date) for cid, date, _ in HISTORY])
+    now = pd.Timestamp.now(tz="UTC")
+    assert core._legacy_case_ids(legacy, {}, now) == core._legacy_case_ids(legacy, {}, now) == first
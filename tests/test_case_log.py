@@ -0,0 +1,65 @@
+"""Case-log reconciliation against national case-log exports."""
+import pandas as pd
+import pytest
+
+import passport_core as core
+from sample_data import RESIDENT, history
+
+
+def test_reconcile_case_log_matches_export_rows_to_cases(local_sheets):
+    local_sheets(*history())
+    export = pd.DataFrame({
+        "Resident Name":   ["Jenkins, Phillip", RESIDENT, "Phillip Jenkins", "Nobody Known", RESIDENT, RESIDENT],
+        "Procedure Date":  ["11/21/2023", "2024-08-05", "2024-08-06", "2024-08-06", "someday", "2025-04-05"],
+        "CPT Description": ["Laparoscopic Appendectomy", "LAPAPP", "Lap appy", "LAPAPP", "LAPAPP", "LAPAPP"],
+    })
+
+    report = core.reconcile_case_log(export, window_days=3)
+    assert list(zip(report["matched"]["log_row"], report["matched"]["case_id"], report["matched"]["days_apart"])) == [
+        (0, "b7e6d5c4a3f2", 1), (1, "c0ffee000001", 0)]
+    assert dict(zip(report["unmatched_log"].index, report["unmatched_log"]["reason"])) == {
+        2: "unmapped procedure", 3: "unknown resident", 4: "unreadable date", 5: "no passport case"}
+    # Only cases inside the export's span can go unmatched: 2025-03-30 is, 2022-09-14 is not.
+    assert list(report["unmatched_cases"]["case_id"]) == ["d15ea5e00002"]
+    assert report["unmapped_procedures"] == ["Lap appy"]
+
+    core.save_case_log_map({"Lap appy": "LAPAPP"})
+    remapped = core.reconcile_case_log(export, window_days=3)
+    assert remapped["unmapped_procedures"] == []
+    assert remapped["unmatched_log"].at[2, "reason"] == "no passport case"   # its case went to row 1
+
+    with pytest.raises(ValueError):
+        core.reconcile_case_log(export.drop(columns="Procedure Date"))
+
+
+def test_pair_by_date_pairs_one_to_one_nearest_first():
+    def frame(rows, date_col):
+        return pd.DataFrame(rows).assign(**{date_col: lambda df: pd.to_datetime(df[date_col])})
+
+    log = frame([
+        {"log_row": 0, "resident_email": RESIDENT, "procedure_id": "LAPAPP", "date": "2024-01-10"},
+        {"log_row": 1, "resident_email": RESIDENT, "procedure_id": "LAPAPP", "date": "2024-02-01"},
+        {"log_row": 2, "resident_email": RESIDENT, "procedure_id": "LAPAPP", "date": "2024-02-05"},
+        {"log_row": 3, "resident_email": RESIDENT, "procedure_id": "LAPAPP", "date": "2024-03-01"},
+        {"log_row": 4, "resident_email": RESIDENT, "procedure_id": "LAPAPP", "date": "2024-03-02"},
+        {"log_row": 5, "resident_email": RESIDENT, "procedure_id": "LAPAPP", "date": "2024-05-01"},
+        {"log_row": 6, "resident_email": RESIDENT, "procedure_id": "HYST",   "date": "2024-01-10"},
+    ], "date")
+    cases = frame([
+        {"case_id": "c1", "resident_email": RESIDENT, "procedure_id": "LAPAPP", "case_date": "2024-01-10"},
+        {"case_id": "c2", "resident_email": RESIDENT, "procedure_id": "LAPAPP", "case_date": "2024-02-03"},
+        {"case_id": "c3", "resident_email": RESIDENT, "procedure_id": "LAPAPP", "case_date": "2024-02-06"},
+        {"case_id": "c4", "resident_email": RESIDENT, "procedure_id": "LAPAPP", "case_date": "2024-03-02"},
+        {"case_id": "c5", "resident_email": RESIDENT, "procedure_id": "LAPAPP", "case_date": "2024-03-06"},
+        {"case_id": "c6", "resident_email": RESIDENT, "procedure_id": "LAPAPP", "case_date": "2024-06-01"},
+    ], "case_date")
+
+    pairs = core._pair_by_date(log, cases, window_days=7)
+    assert sorted(zip(pairs["log_row"], pairs["case_id"])) == [
+        (0, "c1"),   # same day
+        (1, "c2"),   # nearest free case
+        (2, "c3"),
+        (3, "c5"),   # c4 went to the same-day log row
+        (4, "c4"),
+    ]
+    assert set(core._pair_by_date(log, cases, window_days=0)["case_id"]) == {"c1", "c4"}
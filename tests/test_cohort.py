@@ -0,0 +1,52 @@
+"""Cohort-wide Excel workbook."""
+import io
+import threading
+
+from openpyxl import load_workbook
+
+import passport_core as core
+from sample_data import RESIDENT, history
+
+OTHER_RESIDENT = "cowanand@ohsu.edu"
+
+
+def _rows(data: bytes) -> dict:
+    """sheet title → data rows (resident, email, cases, then Most Recent / Best per step)."""
+    wb = load_workbook(io.BytesIO(data))
+    return {ws.title: [list(r) for r in ws.iter_rows(min_row=3, values_only=True)] for ws in wb}
+
+
+def test_cohort_workbook_summarises_every_partition(local_sheets):
+    local_sheets(*history())
+    core.archive_academic_years()
+    tenant = core.current_tenant().id
+
+    sheets = _rows(core.cohort_workbook(tenant))
+    assert sheets == {"Laparoscopic Appendectomy": [[
+        "Phillip Jenkins", RESIDENT, 6,
+        "Prompt", "Auto", "Prompt", "Auto", "Back up", "Auto", "Auto", "Auto",
+    ]]}
+
+    bounded = _rows(core.cohort_workbook(tenant, since="2023-01-01", until="2024-12-31"))
+    assert bounded["Laparoscopic Appendectomy"][0][2:] == [
+        3, "Auto", "Auto", "Back up", "Back up", "Shown/Told", "Auto", "Prompt", "Back up",
+    ]
+    assert _rows(core.cohort_workbook(tenant, residents=[OTHER_RESIDENT])) == {
+        "Cohort": [],
+    }
+
+
+def test_cohort_workbook_reads_the_given_program_from_any_thread(programs):
+    programs({"alpha": history(RESIDENT), "beta": history(OTHER_RESIDENT)})
+    built = {}
+
+    # A deferred download runs on a worker thread that never saw set_tenant().
+    def download(tenant_id):
+        built[tenant_id] = core.cohort_workbook(tenant_id)
+    for tenant_id in ("alpha", "beta"):
+        worker = threading.Thread(target=download, args=(tenant_id,))
+        worker.start()
+        worker.join()
+
+    assert [row[1] for row in _rows(built["alpha"])["Laparoscopic Appendectomy"]] == [RESIDENT]
+    assert [row[1] for row in _rows(built["beta"])["Laparoscopic Appendectomy"]] == [OTHER_RESIDENT]
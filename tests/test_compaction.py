@@ -0,0 +1,46 @@
+"""Compaction of the live case and score sheets."""
+import passport_core as core
+from sample_data import HISTORY, LAP_STEPS, case, history, scores
+
+
+def test_compact_tables_reports_and_removes_junk(local_sheets):
+    cases, score_rows = history()
+    cases += [case("a1f0c3d2e9b8", "2022-09-14"),                  # duplicate case
+              case("f00f00f00f00", "2024-01-01", "gone@ohsu.edu"),  # resident no longer on the roster
+              case("", "2024-01-02")]                               # no ID
+    score_rows += (scores("a1f0c3d2e9b8", ["Auto"])                 # duplicate (case, step): first wins
+                   + scores("0dd0dd0dd0dd", ["Steer"])              # case that never existed
+                   + scores("c0ffee000001", ["Prompt"], ["S_GONE_01"]))  # step missing from the steps sheet
+    wb = local_sheets(cases, score_rows)
+
+    preview = core.compact_tables(dry_run=True)
+    assert len(wb.table(core.SHEET_CASES)) == len(cases) + 1
+    report = core.compact_tables()
+    assert report == preview
+    assert report["duplicate_cases"] == 1
+    assert report["duplicate_scores"] == 1
+    assert report["orphan_cases"] == 1
+    assert report["blank_ids"] == 1
+    assert report["orphan_scores"] == 1
+    assert report["unknown_step_scores"] == 1
+    assert report["cases_after"] == len(HISTORY)
+    assert report["scores_after"] == len(HISTORY) * len(LAP_STEPS) + 1   # unknown steps kept by default
+
+    stored = core.read_sheet_df(core.SHEET_SCORES, expected_cols=core.SCORE_COLS)
+    first = stored[(stored["case_id"] == "a1f0c3d2e9b8") & (stored["step_id"] == "S_LAP_01")]
+    assert list(first["rating"]) == ["Prompt"]
+
+    dropped = core.compact_tables(drop_unknown_steps=True)
+    assert dropped["scores_after"] == len(HISTORY) * len(LAP_STEPS)
+    again = core.compact_tables()
+    assert (again["cases_after"], again["scores_after"]) == (again["cases_before"], again["scores_before"])
+
+
+def test_compact_tables_keeps_scores_of_archived_cases(local_sheets):
+    local_sheets(*history())
+    core.archive_academic_years()
+    # A late rating of a case that now lives in an archive.
+    core.append_sheet_rows(core.SHEET_SCORES, scores("a1f0c3d2e9b8", ["Auto"]), core.SCORE_COLS)
+    report = core.compact_tables()
+    assert report["orphan_scores"] == 0
+    assert report["scores_after"] == report["scores_before"] == len(LAP_STEPS) + 1
@@ -0,0 +1,56 @@
+"""The append-only event journal: replay from checkpoints and rebuilding a table from it."""
+import sqlite3
+
+import pytest
+
+import passport_core as core
+from sample_data import HISTORY, LAP_STEPS, RESIDENT, history
+
+
+def _case_ids(df) -> list:
+    return sorted(core.norm_id(df["case_id"]))
+
+
+def test_events_can_be_appended_but_never_changed(tmp_path):
+    journal = core.EventJournal(str(tmp_path / "journal.db"))
+    seq = journal.append("append", core.SHEET_CASES, ["case_id"], [["a1f0c3d2e9b8"]])
+    with sqlite3.connect(journal.path) as db:
+        for statement in ("UPDATE events SET rows = 0", "DELETE FROM events"):
+            with pytest.raises(sqlite3.DatabaseError, match="append-only"):
+                db.execute(statement)
+    assert [e[0] for e in journal.events()] == [seq]
+
+
+def test_replay_starts_from_the_newest_checkpoint_and_rebuilds_a_table(local_sheets, local_env, monkeypatch):
+    monkeypatch.setenv("JOURNAL_PATH", str(local_env / "journal.db"))
+    monkeypatch.setattr(core, "JOURNAL_CHECKPOINT_EVERY", 4)
+    wb = local_sheets(*history())
+    core.record_journal_baseline()
+    journal = core.event_journal()
+    baseline = journal.last_seq()
+
+    for date in ("2025-05-01", "2025-05-02", "2025-05-03"):   # a case and its scores: two events each
+        core.save_case(RESIDENT, date, "GS", "LAPAPP", "A_GS_THANAWALA", dict.fromkeys(LAP_STEPS, "Auto"))
+    state = core.replay_journal()
+    assert journal.checkpoints() == [state.seq]
+    assert _case_ids(state.frame(core.SHEET_CASES)) == _case_ids(core.read_cases_df())
+
+    # Past a checkpoint only the events after it are replayed; before it, they all are.
+    read_from, events = [], journal.events
+
+    def counted(after=0, until=None):
+        read_from.append(after)
+        return events(after, until)
+    monkeypatch.setattr(journal, "events", counted)
+    assert len(core.replay_journal().frame(core.SHEET_CASES)) == len(HISTORY) + 3
+    assert len(core.replay_journal(baseline + 2).frame(core.SHEET_CASES)) == len(HISTORY) + 1
+    assert read_from == [state.seq, 0]
+
+    # A bad bulk edit in the sheet, undone from the journal.
+    core.write_sheet_df(core.SHEET_CASES, core.read_sheet_df(core.SHEET_CASES).head(2))
+    preview = core.rebuild_table_from_journal(core.SHEET_CASES, until=state.seq, dry_run=True)
+    assert len(wb.table(core.SHEET_CASES)) == 3
+    core.rebuild_table_from_journal(core.SHEET_CASES, until=state.seq)
+    assert _case_ids(core.read_cases_df()) == _case_ids(preview) == _case_ids(state.frame(core.SHEET_CASES))
+    with pytest.raises(LookupError):
+        core.rebuild_table_from_journal(core.SHEET_CASES, until=0)
@@ -0,0 +1,41 @@
+"""Narrow single-procedure reads for the magic-link attending page."""
+import passport_core as core
+
+PROC_COLS = ["procedure_id", "procedure_name", "specialty_id"]
+STEP_COLS = ["step_id", "procedure_id", "step_order", "step_name"]
+
+
+def test_read_matching_rows_fetches_only_the_key_rows_in_two_calls(local_sheets):
+    wb = local_sheets()
+    wb.reset_counters()
+    procs, steps = core.read_matching_rows([
+        (core.SHEET_PROCEDURES, "procedure_id", "LAPAPP", PROC_COLS),
+        (core.SHEET_STEPS,      "procedure_id", "LAPAPP", STEP_COLS),
+    ])
+    assert wb.api_calls().get("read") == 2
+    assert list(procs["procedure_name"]) == ["Laparoscopic Appendectomy"]
+    assert list(steps["step_id"]) == ["S_LAP_01", "S_LAP_02", "S_LAP_03", "S_LAP_04"]
+
+
+def test_read_matching_rows_finds_a_moved_key_column_and_skips_missing_sheets(local_sheets):
+    wb = local_sheets()
+    steps_df = core.read_sheet_df(core.SHEET_STEPS, expected_cols=STEP_COLS)
+    core.write_sheet_df(core.SHEET_STEPS, steps_df[["step_name", "step_order", "procedure_id", "step_id"]])
+    wb.reset_counters()
+    steps, missing = core.read_matching_rows([
+        (core.SHEET_STEPS, "procedure_id", "HYST", STEP_COLS),
+        ("no_such_sheet",  "procedure_id", "HYST", ["procedure_id"]),
+    ])
+    assert len(steps) == 14 and set(steps["procedure_id"]) == {"HYST"}
+    assert list(steps.columns) == STEP_COLS
+    assert missing.empty
+
+
+def test_load_procedure_orders_steps_and_caches(local_sheets):
+    wb = local_sheets()
+    name, steps = core.load_procedure("HYST")
+    assert name == "Hysterectomy (BS vs BSO)"
+    assert list(steps["step_order"].astype(int)) == list(range(1, 15))
+    wb.reset_counters()
+    core.load_procedure("HYST")
+    assert wb.api_calls() == {}
@@ -0,0 +1,104 @@
+"""Retries, the circuit breaker, the request budget and the last-good fallback when Sheets is down."""
+import json
+
+import gspread
+import pytest
+import requests
+
+import passport_core as core
+from sample_data import HISTORY, history
+
+
+def _api_error(code: int) -> gspread.exceptions.APIError:
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": "", "status": ""}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+@pytest.fixture
+def google(monkeypatch):
+    """script(*outcomes) → (client, calls): each request to Google takes the next outcome (an
+    exception to raise, or "ok")."""
+    monkeypatch.setattr(core, "SHEETS_RETRY_BASE", 0)
+
+    def script(*outcomes, breaker=None):
+        calls, pending = [], list(outcomes)
+
+        def request(self, method, endpoint, *args, **kwargs):
+            calls.append(method)
+            outcome = pending.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        monkeypatch.setattr(gspread.http_client.HTTPClient, "request", request)
+        client_cls = type("Client", (core.ResilientHTTPClient,), {"breaker": breaker or core.CircuitBreaker()})
+        return client_cls(None, requests.Session()), calls
+    return script
+
+
+def test_reads_retry_transient_errors_and_writes_are_never_replayed(google):
+    client, calls = google(_api_error(503), requests.exceptions.Timeout(), "ok")
+    assert client.request("get", "values") == "ok"
+    assert calls == ["get"] * 3
+    assert not client.breaker.is_open() and client.breaker.failures == 0
+
+    client, calls = google(_api_error(503))
+    with pytest.raises(gspread.exceptions.APIError):
+        client.request("post", "values:batchUpdate")
+    assert calls == ["post"]
+
+    client, calls = google(_api_error(404))          # not transient: no retry, breaker untouched
+    with pytest.raises(gspread.exceptions.APIError):
+        client.request("get", "values")
+    assert calls == ["get"] and client.breaker.failures == 0
+
+
+def test_breaker_opens_after_repeated_failures_and_lets_one_trial_through(google, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(core.time, "time", lambda: clock[0])
+    breaker = core.CircuitBreaker(threshold=4, cooldown=30)
+    client, calls = google(*[_api_error(503)] * 4, "ok", breaker=breaker)
+
+    with pytest.raises(gspread.exceptions.APIError):
+        client.request("get", "values")               # four attempts, all failing
+    assert breaker.is_open()
+    with pytest.raises(core.SheetsUnavailable):
+        client.request("get", "values")               # fails fast, Google is not called
+    assert len(calls) == 4
+
+    clock[0] += 31
+    breaker.before_call()                             # the trial call ...
+    with pytest.raises(core.SheetsUnavailable):
+        breaker.before_call()                         # ... is the only one let through
+    breaker.record(ok=False)                          # a failed trial re-opens for a full cooldown
+    with pytest.raises(core.SheetsUnavailable):
+        client.request("get", "values")
+
+    clock[0] += 31
+    assert client.request("get", "values") == "ok"    # a good trial closes it
+    assert not breaker.is_open() and breaker.failures == 0
+
+
+def test_request_budget_throttles_then_refuses():
+    budget = core.RequestBudget(per_minute=3, wait=0)
+    for _ in range(3):
+        budget.acquire()
+    with pytest.raises(core.SheetsQuotaExceeded):
+        budget.acquire()
+    assert budget.throttled == 1
+
+
+def test_reads_fall_back_to_the_last_good_copy_unless_strict(local_sheets, monkeypatch):
+    wb = local_sheets(*history())
+    assert len(core.read_cases_df()) == len(HISTORY)
+
+    def down(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("Google is unreachable")
+    monkeypatch.setattr(wb, "handle", down)
+    core.clear_read_caches()
+
+    assert len(core.read_sheet_df(core.SHEET_CASES, expected_cols=core.CASE_COLS)) == len(HISTORY)
+    with core.strict_reads(), pytest.raises(ConnectionError):
+        core.read_sheet_df(core.SHEET_CASES, expected_cols=core.CASE_COLS)
@@ -0,0 +1,52 @@
+"""Migration between the long and wide score layouts."""
+import pytest
+
+import passport_core as core
+from sample_data import HISTORY, history, score_keys
+
+
+def test_migrate_scores_round_trip(local_sheets, monkeypatch):
+    local_sheets(*history())
+    core.archive_academic_years()
+    scores_before = score_keys(core.read_scores_df())
+
+    to_wide = core.migrate_scores("wide")
+    assert to_wide["verified"]
+    assert to_wide["archives_migrated"] == 3
+    assert to_wide["cases"] == len(HISTORY)
+
+    monkeypatch.setattr(core, "scores_layout", lambda: "wide")
+    core.clear_read_caches()
+    assert score_keys(core.read_scores_df()) == scores_before
+
+    # The long sheets still hold the scores migrated from, so going back replaces them.
+    with pytest.raises(ValueError, match="already holds scores"):
+        core.migrate_scores("long")
+    to_long = core.migrate_scores("long", replace=True)
+    assert to_long["undecodable"] == 0
+    assert to_long["archives_migrated"] == 3
+    monkeypatch.setattr(core, "scores_layout", lambda: "long")
+    core.clear_read_caches()
+    assert score_keys(core.read_scores_df()) == scores_before
+
+
+def test_migrate_scores_never_overwrites_scores_unasked(local_sheets):
+    wb = local_sheets(*history())
+    core.migrate_scores("wide")
+    wide_before = wb.table(core.SHEET_CASE_SCORES)
+
+    with pytest.raises(ValueError, match="already holds scores"):
+        core.migrate_scores("wide", dry_run=True)
+    with pytest.raises(ValueError, match="already holds scores"):
+        core.migrate_scores("wide")
+    assert wb.table(core.SHEET_CASE_SCORES) == wide_before
+    # The sheet SCORES_LAYOUT reads is never a target, even with replace.
+    with pytest.raises(ValueError, match="live scores"):
+        core.migrate_scores("long", replace=True)
+    assert core.migrate_scores("wide", replace=True)["verified"]
+
+
+def test_migrate_scores_rejects_unknown_layout(local_sheets):
+    local_sheets(*history())
+    with pytest.raises(ValueError):
+        core.migrate_scores("columnar")
@@ -0,0 +1,72 @@
+"""The host-wide SQLite cache and its leases, shared by the replicas on one host."""
+import sqlite3
+import time
+
+import streamlit as st
+
+import passport_core as core
+from sample_data import HISTORY, case, history
+
+
+def _lease(cache, name):
+    with sqlite3.connect(cache.path) as db:
+        return db.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+
+
+def test_lease_release_never_frees_a_lease_another_replica_took_over(tmp_path, monkeypatch):
+    cache = core.SharedCache(str(tmp_path / "shared.db"))
+    first = cache._take_lease("cases")
+    assert first and cache._take_lease("cases") is None
+
+    # The first holder stalls past its lease; another replica takes over.
+    later = time.time() + core.SHARED_CACHE_LEASE + 1
+    monkeypatch.setattr(core.time, "time", lambda: later)
+    second = cache._take_lease("cases")
+    assert second and second != first
+    cache._release_lease("cases", first)
+    assert _lease(cache, "cases") == (second,)
+    cache._release_lease("cases", second)
+    assert _lease(cache, "cases") is None
+
+
+def test_read_through_downloads_once_and_releases_its_lease(tmp_path):
+    cache = core.SharedCache(str(tmp_path / "shared.db"))
+    downloads = []
+
+    def download(name):
+        downloads.append(name)
+        assert _lease(cache, name) is not None   # the others wait on it meanwhile
+        return history()[0]
+
+    cache.read_through("cases", download)
+    assert cache.read_through("cases", download) == history()[0]
+    assert downloads == ["cases"]
+    assert _lease(cache, "cases") is None
+
+    with cache.lock("table:cases"):
+        assert cache._take_lease("lock:table:cases") is None
+    assert _lease(cache, "lock:table:cases") is None
+
+
+def test_replicas_share_downloads_and_see_each_others_writes(local_sheets, local_env, monkeypatch):
+    monkeypatch.setenv("SHARED_CACHE_PATH", str(local_env / "shared.db"))
+    wb = local_sheets(*history())
+    core.sync_shared_cache()
+    assert len(core.read_cases_df()) == len(HISTORY)
+
+    # A second replica: empty process caches, same host cache.
+    st.cache_data.clear()
+    wb.reset_counters()
+    core.sync_shared_cache()
+    assert len(core.read_cases_df()) == len(HISTORY)
+    assert wb.api_calls().get("get", 0) == 0
+
+    # Another replica saves a case: it writes the sheet, drops the host copy and bumps the generation.
+    sheet = wb.sheets[core.SHEET_CASES]
+    row = case("f1f1f1f1f1f1", "2025-04-01")
+    sheet.write(sheet.last_row(), 0, [[row.get(c, "") for c in core.CASE_COLS]], False)
+    with sqlite3.connect(local_env / "shared.db") as db:
+        db.execute("DELETE FROM sheets WHERE name = ?", (core.SHEET_CASES,))
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+    core.sync_shared_cache()
+    assert len(core.read_cases_df()) == len(HISTORY) + 1
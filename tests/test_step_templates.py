@@ -0,0 +1,49 @@
+"""Versioned step templates with stable step IDs and aliases for retired steps."""
+import pandas as pd
+
+import passport_core as core
+from sample_data import HISTORY, history
+
+LAP_TEMPLATE = pd.DataFrame({
+    "step_id":      ["S_LAP_01", "S_LAP_02", "S_LAP_03", "S_LAP_04"],
+    "procedure_id": "LAPAPP",
+    "step_order":   [1, 2, 3, 4],
+    "step_name":    ["Establish pneumoperitoneum", "Place ports", "Control mesoappendix", "Divide appendix base"],
+})
+
+
+def test_plan_step_revision_keeps_renames_merges_and_adds():
+    plan = core.plan_step_revision(
+        "LAPAPP", LAP_TEMPLATE,
+        ["place PORTS", "Establish pneumoperitoneum", "Ligate mesoappendix", "Irrigate"],
+        merges={"S_LAP_03": "Ligate mesoappendix", "S_LAP_04": "Ligate mesoappendix"},
+        used_ids=["S_LAP_07"],
+    )
+    assert list(plan["steps"]["step_id"]) == ["S_LAP_02", "S_LAP_01", "S_LAP_03", "S_LAPAPP_08"]
+    assert list(plan["steps"]["step_order"]) == [1, 2, 3, 4]
+    assert plan["aliases"] == {"S_LAP_04": "S_LAP_03"}
+    assert plan["retired"] == [("S_LAP_04", "Divide appendix base", "S_LAP_03")]
+    assert plan["summary"] == {"kept": 2, "renamed": 1, "added": 1, "merged": 1, "retired": 0}
+
+
+def test_revise_procedure_steps_versions_the_template_and_aliases_old_scores(local_sheets):
+    local_sheets(*history())
+    summary = core.revise_procedure_steps(
+        "LAPAPP", ["Establish pneumoperitoneum", "Place ports", "Ligate mesoappendix"],
+        merges={"S_LAP_03": "Ligate mesoappendix", "S_LAP_04": "Place ports"})
+    assert summary == {"kept": 2, "renamed": 1, "added": 0, "merged": 1, "retired": 0}
+
+    stored_history = core.read_sheet_df(core.SHEET_STEP_HISTORY, expected_cols=core.STEP_HISTORY_COLS)
+    assert list(stored_history["template_version"].astype(int).value_counts().sort_index()) == [4, 4]
+    # Ratings of the merged step now count toward the step it was merged into.
+    scores = core.read_scores_df()
+    assert set(scores["step_id"]) == {"S_LAP_01", "S_LAP_02", "S_LAP_03"}
+    assert (scores["step_id"] == "S_LAP_02").sum() == 2 * len(HISTORY)
+
+    # A later merge carries the alias along, and a new step never reuses a retired ID.
+    core.revise_procedure_steps("LAPAPP", ["Establish pneumoperitoneum", "Ligate mesoappendix", "Irrigate"],
+                                merges={"S_LAP_02": "Establish pneumoperitoneum"})
+    assert core.load_step_aliases() == {"S_LAP_04": "S_LAP_01", "S_LAP_02": "S_LAP_01"}
+    steps = core.read_sheet_df(core.SHEET_STEPS)
+    assert list(steps.loc[steps["procedure_id"] == "LAPAPP", "step_id"]) == ["S_LAP_01", "S_LAP_03", "S_LAPAPP_05"]
+    assert (core.read_scores_df()["step_id"] == "S_LAP_01").sum() == 3 * len(HISTORY)
@@ -0,0 +1,45 @@
+"""Several programs served by one process: per-tenant sheets, caches and views."""
+import passport_core as core
+from sample_data import LAP_STEPS, RESIDENT, history
+
+OTHER_RESIDENT = "cowanand@ohsu.edu"
+
+
+def _emails(df) -> set:
+    return set(df["resident_email"].astype(str))
+
+
+def test_each_program_reads_caches_and_writes_its_own_sheets(programs):
+    wbs = programs({"alpha": history(RESIDENT), "beta": history(OTHER_RESIDENT)})
+    assert core.current_tenant().id == "alpha"
+
+    for tid, resident in (("alpha", RESIDENT), ("beta", OTHER_RESIDENT)):
+        with core.use_tenant(tid):
+            assert _emails(core.read_cases_df()) == {resident}
+            assert set(core.get_derived_view("summaries").records()["resident_email"]) == {resident}
+
+    with core.use_tenant("alpha"):
+        core.save_case(RESIDENT, "2025-05-01", "GS", "LAPAPP", "A_GS_THANAWALA",
+                       dict.fromkeys(LAP_STEPS, "Auto"))
+        assert len(core.read_cases_df()) == 7
+    # Alpha's save left beta's cached reads and views in place.
+    wbs["beta"].reset_counters()
+    with core.use_tenant("beta"):
+        assert len(core.read_cases_df()) == 6
+        assert core.get_derived_view("summaries").records()["most_recent"].notna().all()
+    assert wbs["beta"].api_calls() == {}
+    assert len(wbs["beta"].table(core.SHEET_CASES)) == 7
+
+
+def test_tenant_for_email_picks_the_program_by_domain_then_by_roster(programs):
+    programs({"alpha": history(RESIDENT), "beta": history(OTHER_RESIDENT), "gamma": ((), ())},
+             {"alpha": {"domains": ["ohsu.edu"], "admins": ["chief@ohsu.edu"]},
+              "beta":  {"domains": ["ohsu.edu"]},
+              "gamma": {"domains": ["@Example.org"]}})
+
+    assert core.tenant_for_email("someone@example.org") == "gamma"
+    assert core.tenant_for_email("chief@ohsu.edu") == "alpha"
+    with core.use_tenant("beta"):
+        core.ensure_resident("newintern@ohsu.edu", "New Intern", "GS")
+    assert core.tenant_for_email("newintern@ohsu.edu") == "beta"
+    assert core.tenant_for_email("stranger@ohsu.edu") is None
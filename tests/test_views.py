@@ -0,0 +1,77 @@
+"""Incrementally maintained derived views."""
+import pandas as pd
+import pytest
+
+import passport_core as core
+from sample_data import HISTORY, LAP_STEPS, RESIDENT, TODAY, case, history, scores
+
+# Sheets hand back ISO and locale dates side by side; a blank date sorts as oldest.
+MIXED_DATES = [
+    ("a00000000001", "2024-08-05", ["Prompt", "Steer", "Back up", "Auto"]),
+    ("a00000000002", "12/01/2025", ["Auto", "Not Assessed", "Steer", "Back up"]),
+    ("a00000000003", "",           ["Not Yet", "Prompt", "Prompt", "Prompt"]),
+]
+
+
+def _seed_mixed_dates(local_sheets):
+    local_sheets([case(cid, date) for cid, date, _ in MIXED_DATES],
+                 [row for cid, _, ratings in MIXED_DATES for row in scores(cid, ratings)])
+
+
+def _expected_summary(steps_df: pd.DataFrame) -> pd.DataFrame:
+    """passport_summary_rows() over the resident's date-descending LAPAPP pivot."""
+    merged = core.resident_passport_rows(core.read_cases_df(), core.read_scores_df(), steps_df,
+                                         core.read_sheet_df(core.SHEET_ATTENDINGS), RESIDENT)
+    pivot, ordered = core.procedure_pivot(merged, steps_df, "LAPAPP")
+    pivot = pivot.assign(date=[pd.to_datetime(d, errors="coerce") for d in pivot["date"]])
+    return core.passport_summary_rows(pivot.sort_values("date", ascending=False), ordered)
+
+
+def test_summaries_most_recent_compares_dates_not_strings(local_sheets):
+    _seed_mixed_dates(local_sheets)
+    steps_df  = core.read_sheet_df(core.SHEET_STEPS)
+    step_cols = list(zip(LAP_STEPS, steps_df.set_index("step_id").loc[LAP_STEPS, "step_name"]))
+    view = core.get_derived_view("summaries")
+
+    summary = view.summary_rows(RESIDENT, "LAPAPP", step_cols)
+    assert [summary.at[0, name] for _, name in step_cols] == ["Auto", "Steer", "Steer", "Back up"]
+    pd.testing.assert_frame_equal(summary, _expected_summary(steps_df), check_like=True)
+
+    # A case saved later with an older date than the newest rating does not displace it.
+    core.advance_derived_views(case("a00000000004", "2025-06-01"),
+                               scores("a00000000004", ["Back up", "Prompt", "Auto", "Steer"]))
+    assert list(view.records(RESIDENT, "LAPAPP")["most_recent"]) == ["Auto", "Prompt", "Steer", "Back up"]
+
+
+def test_readiness_weights_recent_and_complex_cases_more_in_any_order():
+    older = (case("a00000000001", "2024-01-01"), scores("a00000000001", ["Not Yet"]))
+    newer = ({**case("a00000000002", "2024-04-30"), "case_complexity": "Complex"},   # one half-life later
+             scores("a00000000002", ["Auto"]))
+    for order in ((older, newer), (newer, older)):
+        view = core.ReadinessIndex()
+        for case_row, score_rows in order:
+            view.add_case(case_row, score_rows)
+        # Weights 1 and 1.5·2: (1·20 + 3·100) / 4.
+        summary = view.summary_row(RESIDENT, "LAPAPP", [("S_LAP_01", "Establish")])
+        assert summary.at[0, "Establish"] == pytest.approx(80)
+    assert core.readiness_rating(80) == "Back up"
+    table = view.table("LAPAPP", RESIDENT)
+    assert (table["ratings"].tolist(), table["last_rated"].tolist()) == ([2], [pd.Timestamp("2024-04-30")])
+    assert not table["ready"].any()   # long-faded evidence
+
+
+def test_readiness_view_advances_like_a_rebuild(local_sheets):
+    cases, score_rows = history()
+    local_sheets(cases + [case("a00000000005", "12/01/2025")],
+                 score_rows + scores("a00000000005", ["Back up"] * 4))
+    view = core.get_derived_view("readiness")
+    view.table()
+
+    for date in ("2023-01-10", TODAY, TODAY, TODAY):   # a backdated case, then three today
+        core.save_case(RESIDENT, date, "GS", "LAPAPP", "A_GS_THANAWALA", dict.fromkeys(LAP_STEPS, "Auto"))
+    incremental = view.table().sort_values("step_id", ignore_index=True)
+    rebuilt = core.ReadinessIndex.build().table().sort_values("step_id", ignore_index=True)
+    pd.testing.assert_frame_equal(incremental, rebuilt)
+    # Every case counts, the locale-dated one too; "Not Assessed" is no rating.
+    assert incremental["ratings"].tolist() == [len(HISTORY) + 5, len(HISTORY) + 4] * 2
+    assert incremental["ready"].all()
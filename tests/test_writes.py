@@ -0,0 +1,63 @@
+"""Serialized table writes: whole-table rewrites and their conflict checks."""
+import pytest
+
+import passport_core as core
+
+RESIDENT_COLS = ["email", "name", "specialty_id", "created_at"]
+
+
+def _resident(email: str) -> dict:
+    return {"email": email, "name": email.split("@")[0], "specialty_id": "GS", "created_at": "2025-01-01"}
+
+
+def _sign_up_elsewhere(email: str) -> None:
+    """A resident saved by another host between the rewrite's read and its write."""
+    core.append_sheet_rows(core.SHEET_RESIDENTS, [_resident(email)], RESIDENT_COLS, unique_key="email")
+
+
+def _emails(wb) -> list:
+    return [row[0] for row in wb.table(core.SHEET_RESIDENTS)[1:]]
+
+
+def test_rewrite_sheet_reapplies_the_edit_after_a_conflict(local_sheets):
+    wb = local_sheets()
+    before = _emails(wb)
+    calls = []
+
+    def rename(df):
+        calls.append(len(df))
+        if len(calls) == 1:
+            _sign_up_elsewhere("late@ohsu.edu")
+        return df.assign(name=df["name"].astype(str).str.upper())
+
+    core.rewrite_sheet(core.SHEET_RESIDENTS, rename, RESIDENT_COLS)
+    assert calls == [len(before), len(before) + 1]
+    assert _emails(wb) == before + ["late@ohsu.edu"]
+    metrics = core.write_metrics().set_index("table")
+    assert metrics.at[core.SHEET_RESIDENTS, "conflicts_merged"] == 1
+
+
+def test_rewrite_sheet_raises_write_conflict_when_the_sheet_keeps_changing(local_sheets):
+    wb = local_sheets()
+    n = iter(range(core.WRITE_CONFLICT_RETRIES + 1))
+
+    def rename(df):
+        _sign_up_elsewhere(f"late{next(n)}@ohsu.edu")
+        return df.assign(name="overwritten")
+
+    with pytest.raises(core.WriteConflict):
+        core.rewrite_sheet(core.SHEET_RESIDENTS, rename, RESIDENT_COLS)
+    assert "overwritten" not in {row[1] for row in wb.table(core.SHEET_RESIDENTS)[1:]}
+
+
+def test_rewrite_sheet_plans_from_the_sheet_not_the_journal(local_sheets, local_env, monkeypatch):
+    wb = local_sheets()
+    monkeypatch.setenv("JOURNAL_PATH", str(local_env / "journal.db"))
+    monkeypatch.setenv("JOURNAL_READS", "1")
+    core.record_journal_baseline([core.SHEET_RESIDENTS])
+    # A row typed into the sheet by hand is in Google but not in the journal.
+    sheet = wb.sheets[core.SHEET_RESIDENTS]
+    sheet.write(sheet.last_row(), 0, [list(_resident("typed@ohsu.edu").values())], True)
+
+    core.rewrite_sheet(core.SHEET_RESIDENTS, lambda df: df, RESIDENT_COLS)
+    assert "typed@ohsu.edu" in _emails(wb)